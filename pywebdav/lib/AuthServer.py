@@ -55,7 +55,7 @@ class AuthRequestHandler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
                 self.send_error(501)
                 return False
             credentials = base64.decodebytes(credentials.encode()).decode()
-            user, password = credentials.split(':')
+            user, password = credentials.split(':', 1)
             if not self.get_userinfo(user, password, self.command):
                 self.send_autherror(401, "Authorization Required")
                 return False
@@ -86,12 +86,22 @@ class AuthRequestHandler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
         # #1100201)
         content = (self.error_auth_message_format % {'code': code, 'message':
                    _quote_html(message), 'explain': explain})
+        body = content.encode('utf-8')
         self.send_response(code, message)
         self.send_header('Content-Type', self.error_content_type)
+        self.send_header('Content-Length', len(body))
         self.send_header('WWW-Authenticate', 'Basic realm="PyWebDAV"')
-        self.send_header('Connection', 'close')
+        self.send_connection_header()
         self.end_headers()
-        self.wfile.write(content.encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_connection_header(self):
+        """Send the Connection header of a response.
+
+        The default is to close the connection after every response,
+        subclasses supporting persistent connections override this.
+        """
+        self.send_header('Connection', 'close')
 
     error_auth_message_format = DEFAULT_AUTH_ERROR_MESSAGE
 
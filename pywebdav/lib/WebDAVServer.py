@@ -14,13 +14,19 @@ from .delete import DELETE
 from .davcopy import COPY
 from .davmove import MOVE
 
-from .utils import rfc1123_date, IfParser, tokenFinder
+from .utils import rfc1123_date, IfParser, tokenFinder, parse_http_date, \
+    etag_matches, parse_byte_ranges, gzip_etag
 from .errors import DAV_Error, DAV_NotFound
 
 from .constants import DAV_VERSION_1, DAV_VERSION_2
 from .locks import LockManager
-import gzip
-import io
+from .metrics import CountingFile, take_visited
+from .chunked import read_chunked, PIECE_SIZE
+import threading
+import time
+import types
+import uuid
+import zlib
 
 from pywebdav import __version__
 
@@ -31,6 +37,148 @@ log = logging.getLogger(__name__)
 
 BUFFER_SIZE = 128 * 1000  # 128 Ko
 
+timer = getattr(time, 'perf_counter', time.time)
+
+# unread request bodies up to this size are skipped to keep the
+# connection alive, bigger ones make us close the connection
+MAX_DRAIN_SIZE = 64 * 1024
+
+# media types which are worth compressing, may be overridden by the
+# gzip_mimetypes option (prefixes separated by commas)
+GZIP_MIMETYPES = 'text/, application/xml, application/json, ' \
+                 'application/javascript, image/svg+xml, httpd/unix-directory'
+
+
+class ConnectionStats(object):
+    """ process wide counters for persistent connection reuse """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.reused = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def request_started(self, reused):
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+
+
+class ConcurrencyLimits(object):
+    """ process wide limits of the number of concurrent requests
+
+    spec is a comma separated list of KEY=N where KEY is a method
+    (e.g. COPY=4) or a method and a depth (e.g. PROPFIND/infinity=2,
+    a missing Depth header counts as infinity). A request which would
+    exceed a limit is not waited for but rejected (see acquire()).
+
+    """
+
+    def __init__(self, spec):
+        self.limits = {}
+        for item in spec.split(','):
+            if not item.strip():
+                continue
+            key, sep, value = item.partition('=')
+            method, sep, depth = key.strip().partition('/')
+            self.limits[method.upper(), depth.lower() or None] = \
+                threading.BoundedSemaphore(int(value))
+
+    def __bool__(self):
+        return bool(self.limits)
+    __nonzero__ = __bool__
+
+    def acquire(self, method, depth):
+        """ return the acquired semaphores or None if a limit is reached """
+        depth = (depth or 'infinity').strip().lower()
+        acquired = []
+        for key in ((method, None), (method, depth)):
+            if key not in self.limits:
+                continue
+            sem = self.limits[key]
+            if not sem.acquire(False):
+                self.release(acquired)
+                return None
+            acquired.append(sem)
+        return acquired
+
+    def release(self, acquired):
+        for sem in acquired:
+            sem.release()
+
+
+class ByteRanges(object):
+    """ multipart/byteranges body made of several ranges of some data
+
+    data is what get_data() of the interface class returned for the
+    whole resource. If it is backed by a file (get_file()) all the
+    ranges are read from that one file, otherwise the data is read
+    sequentially (the ranges are sorted) skipping what is not needed.
+
+    """
+
+    def __init__(self, data, ranges, ctype, size):
+        self.data = data
+        self.boundary = uuid.uuid4().hex
+        self.ctype = 'multipart/byteranges; boundary=%s' % self.boundary
+        self.parts = []
+        for start, end in ranges:
+            head = ('\r\n--%s\r\nContent-Type: %s\r\n'
+                    'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                        self.boundary, ctype, start, end - 1, size))
+            self.parts.append((head.encode('utf-8'), start, end))
+        self.trailer = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+
+    def __len__(self):
+        return (sum(len(head) + end - start for head, start, end in self.parts)
+                + len(self.trailer))
+
+    def __iter__(self):
+        data = self.data
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        fp = data.get_file() if hasattr(data, 'get_file') else None
+
+        pos = 0
+        for head, start, end in self.parts:
+            yield head
+            if isinstance(data, bytes):
+                yield data[start:end]
+                continue
+
+            if fp is not None:
+                fp.seek(start)
+            else:
+                # skip the bytes in front of the range
+                while pos < start:
+                    buf = data.read(min(start - pos, BUFFER_SIZE))
+                    if not buf:
+                        return
+                    pos += len(buf)
+
+            left = end - start
+            while left > 0:
+                buf = (fp or data).read(min(left, BUFFER_SIZE))
+                if not buf:
+                    return
+                left -= len(buf)
+                yield buf
+            pos = end
+
+        yield self.trailer
+
+    def read(self, length=0):
+        return b''.join(self)
+
+    def close(self):
+        if hasattr(self.data, 'close'):
+            self.data.close()
+
 
 class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
     """Simple DAV request handler with
@@ -54,7 +202,214 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
     """
 
     server_version = "DAV/" + __version__
+    protocol_version = 'HTTP/1.1'
     encode_threshold = 1400  # common MTU
+    connection_stats = ConnectionStats()
+
+    # a response is written in several pieces (status line, headers,
+    # chunks), with Nagle's algorithm the delayed ACK of the client
+    # stalls every response on a persistent connection
+    disable_nagle_algorithm = True
+
+    # a ConcurrencyLimits instance, set by the server
+    concurrency_limits = None
+
+    # a metrics.Metrics instance and the path serving it, set by the server
+    metrics = None
+    metrics_path = None
+
+    ### persistent connection handling
+
+    def setup(self):
+        self._requests_handled = 0
+        if self._config.DAV.getboolean('keepalive'):
+            # idle timeout between two requests on the same connection
+            self.timeout = float(self._config.DAV.get('keepalive_timeout', 15))
+        AuthServer.AuthRequestHandler.setup(self)
+        self.connection_stats.connection_opened()
+
+    def handle_one_request(self):
+        if self._requests_handled and not self._wait_for_request():
+            self.close_connection = True
+            return
+
+        self._begin_request()
+        try:
+            AuthServer.AuthRequestHandler.handle_one_request(self)
+        finally:
+            self._end_request()
+        if not self.close_connection:
+            self._drain_request_body()
+
+    def _wait_for_request(self):
+        """ let the server close an idle keep-alive connection """
+        wait = getattr(self.server, 'wait_for_request', None)
+        if wait is None:
+            return True
+        return wait(self.connection, self.rfile, self.timeout)
+
+    def _begin_request(self):
+        self._body_left = None
+        self._continue_pending = False
+        self._admitted = None
+        self._metrics_start = None
+        self._status = None
+        self._sent_bytes = 0    # bytes not written through wfile
+        self.IFACE_CLASS.begin_request()
+        self._init_locks().begin_request()
+
+    def _end_request(self):
+        """ clean up after a request, its response was sent """
+        self.IFACE_CLASS.end_request()
+        self._init_locks().end_request()
+        if self._admitted:
+            self.concurrency_limits.release(self._admitted)
+            self._admitted = None
+        if self._metrics_start is not None:
+            self._record_metrics()
+
+    def parse_request(self):
+        self._requests_handled += 1
+        self.connection_stats.request_started(self._requests_handled > 1)
+        if self.metrics is not None:
+            self._start_metrics()
+        if not AuthServer.AuthRequestHandler.parse_request(self):
+            return False
+        return self._admit()
+
+    def _start_metrics(self):
+        """ start to measure a request, its request line was read """
+        if not isinstance(self.rfile, CountingFile):
+            self.rfile = CountingFile(self.rfile)
+            self.wfile = CountingFile(self.wfile)
+        take_visited()
+        self._metrics_start = (timer(),
+                               self.rfile.count - len(self.raw_requestline),
+                               self.wfile.count)
+
+    def _record_metrics(self):
+        started, read, written = self._metrics_start
+        self._metrics_start = None
+
+        method = self.command or ''
+        if not hasattr(self, 'do_' + method):
+            method = 'OTHER'
+        self.metrics.observe(method, self._status or 0, timer() - started,
+                             self.rfile.count - read,
+                             self.wfile.count - written + self._sent_bytes,
+                             take_visited())
+
+    def _send_metrics(self):
+        """ serve the metrics in the Prometheus text format """
+        stats = self.connection_stats
+        extra = [
+            ('pywebdav_locks', 'gauge', 'Active locks',
+             len(self._init_locks())),
+            ('pywebdav_connections_total', 'counter', 'Accepted connections',
+             stats.connections),
+            ('pywebdav_requests_total', 'counter', 'Requests',
+             stats.requests),
+            ('pywebdav_reused_requests_total', 'counter',
+             'Requests on persistent connections', stats.reused),
+        ]
+        self.send_body(self.metrics.render(extra), 200, 'OK', 'OK',
+                       'text/plain; version=0.0.4; charset=utf-8')
+
+    def log_request(self, code='-', size='-'):
+        if code != '-':
+            self._status = int(code)
+        AuthServer.AuthRequestHandler.log_request(self, code, size)
+
+    def _admit(self):
+        """ check the concurrency limits, reject the request with 503 """
+        if not self.concurrency_limits:
+            return True
+
+        self._admitted = self.concurrency_limits.acquire(
+            self.command, self.headers.get('Depth'))
+        if self._admitted is None:
+            log.warning('Too many concurrent %s requests, rejecting %s' % (
+                self.command, self.path))
+            self.close_connection = True
+            self.send_response(503)
+            self.send_connection_header()
+            self.send_header('Retry-After',
+                             str(self._config.DAV.get('retry_after', 5)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        return True
+
+    def handle_expect_100(self):
+        """ defer the interim response of PUT until the request was checked """
+        if self.command == 'PUT':
+            self._continue_pending = True
+            return True
+        return AuthServer.AuthRequestHandler.handle_expect_100(self)
+
+    def _send_continue(self):
+        """ send a deferred 100 Continue interim response """
+        if self._continue_pending:
+            self._continue_pending = False
+            self.send_response_only(100)
+            self.end_headers()
+
+    def _max_requests(self):
+        return int(self._config.DAV.get('keepalive_max_requests', 100))
+
+    def send_connection_header(self):
+        """ keep the connection open if the client and the config allow it """
+        if (self.close_connection or
+                not self._config.DAV.getboolean('keepalive') or
+                self._requests_handled >= self._max_requests() or
+                getattr(self.server, 'saturated', False)):
+            self.send_header('Connection', 'close')
+            return
+
+        if self.request_version == 'HTTP/1.0':
+            self.send_header('Connection', 'keep-alive')
+        self.send_header('Keep-Alive', 'timeout=%d, max=%d' % (
+            self.timeout, self._max_requests() - self._requests_handled))
+
+    def _request_body_left(self):
+        """ return the number of unread body bytes, -1 for a chunked body """
+        if self._body_left is None:
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                self._body_left = -1
+            else:
+                self._body_left = int(self.headers.get('Content-Length', 0))
+        return self._body_left
+
+    def _drain_request_body(self):
+        """ skip an unread request body so that the connection can be reused """
+        left = self._request_body_left()
+        if left == 0:
+            return
+
+        # the client may still wait for a 100 Continue, we cannot
+        # know if a body follows
+        if left < 0 or left > MAX_DRAIN_SIZE or self._continue_pending:
+            self.close_connection = True
+            return
+
+        while left > 0:
+            buf = self.rfile.read(min(left, BUFFER_SIZE))
+            if not buf:
+                self.close_connection = True
+                break
+            left -= len(buf)
+        self._body_left = 0
+
+    def _read_request_body(self):
+        """ read a fixed length request body, returns None if there is none """
+        body = None
+        if 'Content-Length' in self.headers:
+            l = self.headers['Content-Length']
+            body = self.rfile.read(int(l))
+            self._body_left = 0
+        return body
+
+    ### response helpers
 
     def send_body(self, DATA, code=None, msg=None, desc=None,
                   ctype='application/octet-stream', headers={}):
@@ -62,30 +417,29 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         log.debug("Use send_body method")
 
         self.send_response(code, message=msg)
-        self.send_header("Connection", "close")
+        self.send_connection_header()
         self.send_header("Accept-Ranges", "bytes")
         self.send_header('Date', rfc1123_date())
 
         self._send_dav_version()
 
-        for a, v in headers.items():
-            self.send_header(a, v)
+        if isinstance(DATA, six.text_type):
+            DATA = DATA.encode('utf-8')
+        elif isinstance(DATA, types.GeneratorType):
+            # the length must be known up front
+            DATA = b''.join(DATA)
+
+        use_gzip = bool(DATA) and self._use_gzip(DATA, ctype, code)
+        self._send_headers(headers, use_gzip)
 
         if DATA:
             try:
-                if 'gzip' in self.headers.get('Accept-Encoding', '').split(',') \
-                        and len(DATA) > self.encode_threshold:
-                    buffer = io.BytesIO()
-                    output = gzip.GzipFile(mode='wb', fileobj=buffer)
-                    if isinstance(DATA, str) or isinstance(DATA, six.text_type):
-                        output.write(DATA)
-                    else:
-                        for buf in DATA:
-                            output.write(buf)
-                    output.close()
-                    buffer.seek(0)
-                    DATA = buffer.getvalue()
+                if use_gzip:
+                    # the length must be known up front, thus only the
+                    # compressed data is kept in memory
+                    DATA = b''.join(self._gzip_iter(DATA))
                     self.send_header('Content-Encoding', 'gzip')
+                    self.send_header('Vary', 'Accept-Encoding')
 
                 self.send_header('Content-Length', len(DATA))
                 self.send_header('Content-Type', ctype)
@@ -95,10 +449,8 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
             self.send_header('Content-Length', 0)
 
         self.end_headers()
-        if DATA:
-            if isinstance(DATA, str):
-                DATA = DATA.encode('utf-8')
-            if isinstance(DATA, six.text_type) or isinstance(DATA, bytes):
+        if DATA and self.command != 'HEAD':
+            if isinstance(DATA, bytes):
                 log.debug("Don't use iterator")
                 self.wfile.write(DATA)
             else:
@@ -118,6 +470,17 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
                         self.wfile.write(res.encode('utf8'))
         return None
 
+    def send_not_modified(self, headers={}):
+        """ send a 304 Not Modified response, it never has a body """
+        self.send_response(304)
+        self.send_connection_header()
+        self.send_header('Date', rfc1123_date())
+
+        for a, v in headers.items():
+            self.send_header(a, v)
+
+        self.end_headers()
+
     def send_body_chunks_if_http11(self, DATA, code, msg=None, desc=None,
                                    ctype='text/xml; encoding="utf-8"',
                                    headers={}):
@@ -133,69 +496,221 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
         self.responses[207] = (msg, desc)
         self.send_response(code, message=msg)
+        self.send_connection_header()
         self.send_header("Content-type", ctype)
         self.send_header("Transfer-Encoding", "chunked")
         self.send_header('Date', rfc1123_date())
 
         self._send_dav_version()
 
+        GZDATA = None
+        use_gzip = bool(DATA) and self._use_gzip(DATA, ctype, code)
+        self._send_headers(headers, use_gzip)
+        if use_gzip:
+            GZDATA = self._gzip_iter(DATA)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+
+        self.end_headers()
+
+        # a HEAD response must not carry any chunks
+        if self.command == 'HEAD':
+            if hasattr(DATA, 'close'):
+                DATA.close()
+            return
+
+        if GZDATA is not None:
+            # every compressed piece becomes a chunk of its own
+            self.write_chunks(GZDATA)
+        else:
+            self.write_chunks(self._iter_body(DATA))
+
+    def _iter_body(self, DATA):
+        """ yield the pieces of a response body as bytes """
+        if not DATA:
+            return
+
+        DATA = DATA.encode() if isinstance(DATA, six.text_type) else DATA
+        if isinstance(DATA, six.binary_type):
+            yield DATA
+        elif (self._config.DAV.getboolean('http_response_use_iterator') or
+                not hasattr(DATA, 'read')):
+            # Use iterator to reduce using memory
+            for buf in DATA:
+                yield buf.encode() if isinstance(buf, six.text_type) else buf
+        else:
+            # Don't use iterator, it's a compatibility option
+            buf = DATA.read()
+            yield buf.encode() if isinstance(buf, six.text_type) else buf
+
+    def write_chunks(self, pieces):
+        """ write the pieces of a body with the chunked transfer coding """
+        for buf in pieces:
+            if not buf:
+                # an empty chunk would end the body
+                continue
+            self.wfile.write((hex(len(buf))[2:] + "\r\n").encode())
+            self.wfile.write(buf)
+            self.wfile.write(b"\r\n")
+
+        self.wfile.write(b"0\r\n")
+        self.wfile.write(b"\r\n")
+
+    def _accepts_gzip(self):
+        """ test if the client accepts a gzip content coding """
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            params = coding.split(';')
+            if params[0].strip().lower() not in ('gzip', 'x-gzip'):
+                continue
+            for param in params[1:]:
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+        return False
+
+    def _send_headers(self, headers, gzipped=False):
+        """ send the extra headers of a response
+
+        A gzip encoded body is another representation than the
+        identity one, it gets an entity tag of its own.
+
+        """
         for a, v in headers.items():
+            if gzipped and a == 'ETag':
+                v = gzip_etag(v)
             self.send_header(a, v)
 
-        GZDATA = None
-        if DATA:
-            if ('gzip' in self.headers.get('Accept-Encoding', '').split(',')
-                and len(DATA) > self.encode_threshold):
-                buffer = io.BytesIO()
-                output = gzip.GzipFile(mode='wb', fileobj=buffer)
-                if isinstance(DATA, bytes):
-                    output.write(DATA)
-                else:
-                    for buf in DATA:
-                        buf = buf.encode() if isinstance(buf, six.text_type) else buf
-                        output.write(buf)
-                output.close()
-                buffer.seek(0)
-                GZDATA = buffer.getvalue()
-                self.send_header('Content-Encoding', 'gzip')
+    def _use_gzip(self, DATA, ctype, code=200):
+        """ test if DATA of the given content type should be compressed """
+        # the offsets of a partial response refer to the identity body
+        if code in (206, 416):
+            return False
+        if not int(self._config.DAV.get('gzip_level', 6)):
+            return False
+        if not self._accepts_gzip():
+            return False
+        if hasattr(DATA, '__len__') and len(DATA) <= self.encode_threshold:
+            return False
+
+        mediatype = ctype.split(';')[0].strip().lower()
+        allowed = self._config.DAV.get('gzip_mimetypes', GZIP_MIMETYPES)
+        for prefix in allowed.split(','):
+            prefix = prefix.strip().lower()
+            if prefix and mediatype.startswith(prefix):
+                return True
+        return False
+
+    def _gzip_iter(self, DATA):
+        """ compress DATA piece by piece and yield the gzip stream
+
+        Only the compressor state is kept in memory, no matter how
+        big DATA is.
+
+        """
+        level = int(self._config.DAV.get('gzip_level', 6))
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        if isinstance(DATA, (bytes, six.text_type)):
+            DATA = [DATA]
+        elif not self._config.DAV.getboolean('http_response_use_iterator') \
+                and hasattr(DATA, 'read'):
+            DATA = [DATA.read()]
+
+        for buf in DATA:
+            buf = buf.encode() if isinstance(buf, six.text_type) else buf
+            buf = compressor.compress(buf)
+            if buf:
+                yield buf
+        yield compressor.flush()
+
+    def _use_sendfile(self, DATA, ctype, code=200):
+        """ test if DATA can be handed to the kernel instead of copying it """
+        if not self._config.DAV.getboolean('http_response_use_sendfile'):
+            return False
+        if not hasattr(DATA, 'get_file') or DATA.get_file() is None:
+            return False
+        if self._use_gzip(DATA, ctype, code):
+            return False
+        return hasattr(self.connection, 'sendfile')
+
+    def send_body_file(self, DATA, code, msg=None, desc=None,
+                       ctype='application/octet-stream', headers={}):
+        """ send a file backed body with a Content-Length
+
+        The bytes are not copied through python but given to
+        socket.sendfile() which uses os.sendfile() where available
+        and falls back to a send() loop elsewhere.
+
+        """
+        fp = DATA.get_file()
+        offset = fp.tell()
+        count = len(DATA)
 
-            self.send_header('Content-Length', len(DATA))
-            self.send_header('Content-Type', ctype)
+        self.send_response(code, message=msg)
+        self.send_connection_header()
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header('Date', rfc1123_date())
 
-        else:
-            self.send_header('Content-Length', 0)
+        self._send_dav_version()
 
+        for a, v in headers.items():
+            self.send_header(a, v)
+
+        self.send_header('Content-Length', count)
+        self.send_header('Content-Type', ctype)
         self.end_headers()
 
-        if GZDATA:
-            self.wfile.write(GZDATA)
+        try:
+            if count and self.command != 'HEAD':
+                self.connection.sendfile(fp, offset, count)
+                self._sent_bytes += count
+        finally:
+            DATA.close()
 
-        elif DATA:
-            DATA = DATA.encode() if isinstance(DATA, six.text_type) else DATA
-            if isinstance(DATA, six.binary_type):
-                self.wfile.write(b"%s\r\n" % hex(len(DATA))[2:].encode())
-                self.wfile.write(DATA)
-                self.wfile.write(b"\r\n")
-                self.wfile.write(b"0\r\n")
-                self.wfile.write(b"\r\n")
-            else:
-                if self._config.DAV.getboolean('http_response_use_iterator'):
-                    # Use iterator to reduce using memory
-                    for buf in DATA:
-                        buf = buf.encode() if isinstance(buf, six.text_type) else buf
-                        self.wfile.write((hex(len(buf))[2:] + "\r\n").encode())
-                        self.wfile.write(buf)
-                        self.wfile.write(b"\r\n")
+    def send_body_byteranges(self, DATA, code, msg=None, desc=None,
+                             ctype='multipart/byteranges', headers={}):
+        """ send a multipart/byteranges body with a Content-Length
 
-                    self.wfile.write(b"0\r\n")
-                    self.wfile.write(b"\r\n")
-                else:
-                    # Don't use iterator, it's a compatibility option
-                    self.wfile.write((hex(len(DATA))[2:] + "\r\n").encode())
-                    self.wfile.write(DATA.read())
-                    self.wfile.write(b"\r\n")
-                    self.wfile.write(b"0\r\n")
-                    self.wfile.write(b"\r\n")
+        If the ranges come from a file they are handed to sendfile()
+        one after the other, otherwise they are copied from DATA.
+
+        """
+        use_sendfile = self._use_sendfile(DATA.data, ctype, code)
+
+        self.send_response(code, message=msg)
+        self.send_connection_header()
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header('Date', rfc1123_date())
+
+        self._send_dav_version()
+
+        for a, v in headers.items():
+            self.send_header(a, v)
+
+        self.send_header('Content-Length', len(DATA))
+        self.send_header('Content-Type', ctype)
+        self.end_headers()
+
+        try:
+            if self.command == 'HEAD':
+                return
+
+            if use_sendfile:
+                fp = DATA.data.get_file()
+                for head, start, end in DATA.parts:
+                    self.wfile.write(head)
+                    self.connection.sendfile(fp, start, end - start)
+                    self._sent_bytes += end - start
+                self.wfile.write(DATA.trailer)
+            else:
+                for buf in DATA:
+                    self.wfile.write(buf)
+        finally:
+            DATA.close()
 
     def _send_dav_version(self):
         if self._config.DAV.getboolean('lockemulation'):
@@ -209,6 +724,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         """return the list of capabilities """
 
         self.send_response(200)
+        self.send_connection_header()
         self.send_header("Content-Length", 0)
 
         if self._config.DAV.getboolean('lockemulation'):
@@ -237,11 +753,17 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
             pass
 
         # get the ETag if any
+        etag = None
         try:
-            headers['Etag'] = dc.get_prop(uri, "DAV:", "getetag")
+            etag = headers['ETag'] = dc.get_prop(uri, "DAV:", "getetag")
         except DAV_NotFound:
             pass
 
+        # conditional GET
+        if self._not_modified(etag, headers):
+            self.send_not_modified(headers)
+            return 304
+
         # get the content type
         try:
             if uri.endswith('/'):
@@ -253,37 +775,130 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         except DAV_NotFound:
             content_type = "application/octet-stream"
 
+        # byte ranges (RFC 7233), invalid Range headers are ignored
+        ranges = None
+        if 'Range' in self.headers and not dc.is_collection(uri):
+            try:
+                size = int(dc.get_prop(uri, "DAV:", "getcontentlength"))
+                ranges = parse_byte_ranges(self.headers['Range'], size)
+            except (DAV_Error, ValueError):
+                pass
+
+        # only send ranges if the client's copy is still current
+        if ranges is not None and 'If-Range' in self.headers:
+            if not self._if_range_matches(etag, headers.get('Last-Modified')):
+                ranges = None
+
+        if ranges == []:
+            headers['Content-Range'] = 'bytes */%d' % size
+            self.send_body(None, 416, None, None, headers=headers)
+            return 416
+
         range = None
         status_code = 200
-        if 'Range' in self.headers:
-            p = self.headers['Range'].find("bytes=")
-            if p != -1:
-                range = self.headers['Range'][p + 6:].split("-")
-                status_code = 206
+        if ranges is not None:
+            status_code = 206
+            if len(ranges) == 1:
+                start, end = ranges[0]
+                range = [str(start), str(end - 1)]
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    start, end - 1, size)
 
         # get the data
         try:
             data = dc.get_data(uri, range)
         except DAV_Error as error:
             (ec, dd) = error.args
-            self.send_status(ec)
+            if ec == 416:
+                headers['Content-Range'] = 'bytes */%d' % size
+                self.send_body(None, 416, None, None, headers=headers)
+            else:
+                self.send_status(ec)
             return ec
 
-        # send the data
-        if with_body is False:
-            data = None
-
-        if isinstance(data, str) or isinstance(data, six.text_type):
+        if ranges is not None and len(ranges) > 1:
+            data = ByteRanges(data, ranges, content_type, size)
+            content_type = data.ctype
+
+        # send the data, HEAD gets the same headers as GET (the senders
+        # skip the body)
+        if isinstance(data, ByteRanges):
+            self.send_body_byteranges(data, status_code, None, None,
+                                      content_type, headers)
+        elif self._use_sendfile(data, content_type, status_code):
+            self.send_body_file(data, status_code, None, None, content_type,
+                                headers)
+        elif isinstance(data, str) or isinstance(data, six.text_type):
             self.send_body(data, status_code, None, None, content_type,
                            headers)
         else:
-            headers['Keep-Alive'] = 'timeout=15, max=86'
-            headers['Connection'] = 'Keep-Alive'
             self.send_body_chunks_if_http11(data, status_code, None, None,
                                             content_type, headers)
 
         return status_code
 
+    def _not_modified(self, etag, headers):
+        """ evaluate If-None-Match and If-Modified-Since of a GET or HEAD
+
+        The entity tag of the gzip encoded variant matches as well,
+        headers then get it for the 304 response.
+
+        """
+        if 'If-None-Match' in self.headers:
+            # If-Modified-Since is ignored then (RFC 7232, 3.3)
+            value = self.headers['If-None-Match']
+            if etag_matches(value, etag):
+                return True
+            if etag is not None and self._accepts_gzip() and \
+                    etag_matches(value, gzip_etag(etag)):
+                headers['ETag'] = gzip_etag(etag)
+                return True
+            return False
+
+        since = parse_http_date(self.headers.get('If-Modified-Since'))
+        mtime = parse_http_date(headers.get('Last-Modified'))
+        return since is not None and mtime is not None and mtime <= since
+
+    def _if_range_matches(self, etag, last_modified):
+        """ test the validator of an If-Range header """
+        value = self.headers['If-Range'].strip()
+        if value.startswith('"') or value.startswith('W/'):
+            return etag_matches(value, etag, weak=False)
+
+        date = parse_http_date(value)
+        return date is not None and date == parse_http_date(last_modified)
+
+    def _if_header_holds(self, dc, uri, ifheader):
+        """ evaluate an If header against the lock and the ETag of uri
+
+        The header holds if all conditions of one of its lists hold.
+
+        """
+        etag = None
+        try:
+            etag = dc.get_prop(uri, "DAV:", "getetag")
+        except DAV_Error:
+            pass
+
+        for tag in IfParser(ifheader):
+            holds = True
+            for notted, item in tag.conditions:
+                if item.startswith('['):
+                    match = etag_matches(item[1:-1], etag, weak=False)
+                else:
+                    # the lock must be on uri or one of its parents
+                    lock = self._l_getLock(tokenFinder(item))
+                    match = lock is not None and (
+                        uri == lock.uri or
+                        uri.startswith(lock.uri.rstrip('/') + '/'))
+                if match == notted:
+                    holds = False
+                    break
+            if holds:
+                return True
+
+        return False
+
     def do_HEAD(self):
         """ Send a HEAD response: Retrieves resource information w/o body """
 
@@ -294,6 +909,10 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
         log.debug(self.headers)
 
+        if self.metrics_path and \
+                urllib.parse.urlsplit(self.path).path == self.metrics_path:
+            return self._send_metrics()
+
         try:
             status_code = self._HEAD_GET(with_body=True)
             self.log_request(status_code)
@@ -326,10 +945,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
         # read the body containing the xml request
         # iff there is no body then this is an ALLPROP request
-        body = None
-        if 'Content-Length' in self.headers:
-            l = self.headers['Content-Length']
-            body = self.rfile.read(int(l))
+        body = self._read_request_body()
 
         uri = urllib.parse.unquote(urllib.parse.urljoin(self.get_baseuri(dc), self.path))
 
@@ -349,16 +965,19 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         # taken from Resource.py @ Zope webdav
         if (self.headers.get('User-Agent') ==
             'Microsoft Data Access Internet Publishing Provider DAV 1.1'):
-            DATA = DATA.replace(b'<ns0:getlastmodified xmlns:ns0="DAV:">',
+            # every response element is a piece of its own, thus the
+            # replacements can be applied piece by piece
+            DATA = (buf.replace(b'<ns0:getlastmodified xmlns:ns0="DAV:">',
                                 b'<ns0:getlastmodified xmlns:n="DAV:" '
                                 b'xmlns:b="urn:uuid:'
                                 b'c2f41010-65b3-11d1-a29f-00aa00c14882/" '
                                 b'b:dt="dateTime.rfc1123">')
-            DATA = DATA.replace(b'<ns0:creationdate xmlns:ns0="DAV:">',
+                       .replace(b'<ns0:creationdate xmlns:ns0="DAV:">',
                                 b'<ns0:creationdate xmlns:n="DAV:" '
                                 b'xmlns:b="urn:uuid:'
                                 b'c2f41010-65b3-11d1-a29f-00aa00c14882/" '
                                 b'b:dt="dateTime.tz">')
+                    for buf in DATA)
 
         self.send_body_chunks_if_http11(DATA, 207, 'Multi-Status',
                                         'Multiple responses')
@@ -370,17 +989,14 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
         # read the body containing the xml request
         # iff there is no body then this is an ALLPROP request
-        body = None
-        if 'Content-Length' in self.headers:
-            l = self.headers['Content-Length']
-            body = self.rfile.read(int(l))
+        body = self._read_request_body()
 
         uri = urllib.parse.unquote(urllib.parse.urljoin(self.get_baseuri(dc), self.path))
 
         rp = REPORT(uri, dc, self.headers.get('Depth', '0'), body)
 
         try:
-            DATA = '%s\n' % rp.createResponse()
+            DATA = rp.createResponse()
         except DAV_Error as error:
             (ec, dd) = error.args
             return self.send_status(ec)
@@ -392,10 +1008,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         """ create a new collection """
 
         # according to spec body must be empty
-        body = None
-        if 'Content-Length' in self.headers:
-            l = self.headers['Content-Length']
-            body = self.rfile.read(int(l))
+        body = self._read_request_body()
 
         if body:
             return self.send_status(415)
@@ -422,8 +1035,9 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         if uri.find('#') >= 0:
             return self.send_status(404)
 
-        # locked resources are not allowed to delete
-        if self._l_isLocked(uri):
+        # locked resources are not allowed to delete, neither are
+        # collections with locked members
+        if self._l_isLocked(uri) or self._l_isLockedBelow(uri):
             return self.send_body(None, 423, 'Locked', 'Locked')
 
         # Handle If-Match
@@ -434,7 +1048,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
                 etag = dc.get_prop(uri, "DAV:", "getetag")
             except:
                 pass
-            for match in self.headers['If-Match'].split(','):
+            for match in map(str.strip, self.headers['If-Match'].split(',')):
                 if match == '*':
                     if dc.exists(uri):
                         test = True
@@ -456,7 +1070,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
                 etag = dc.get_prop(uri, "DAV:", "getetag")
             except:
                 pass
-            for match in self.headers['If-None-Match'].split(','):
+            for match in map(str.strip, self.headers['If-None-Match'].split(',')):
                 if match == '*':
                     if dc.exists(uri):
                         test = False
@@ -502,7 +1116,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
             log.debug("do_PUT: etag = %s" % etag)
 
-            for match in self.headers['If-Match'].split(','):
+            for match in map(str.strip, self.headers['If-Match'].split(',')):
                 if match == '*':
                     if dc.exists(uri):
                         test = True
@@ -530,7 +1144,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
 
             log.debug("do_PUT: etag = %s" % etag)
 
-            for match in self.headers['If-None-Match'].split(','):
+            for match in map(str.strip, self.headers['If-None-Match'].split(',')):
                 if match == '*':
                     if dc.exists(uri):
                         test = False
@@ -544,8 +1158,14 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
                 self.log_request(412)
                 return
 
-        # locked resources are not allowed to be overwritten
+        # the state and entity tags of the If header must match
         ifheader = self.headers.get('If')
+        if ifheader and not self._if_header_holds(dc, uri, ifheader):
+            self.send_status(412)
+            self.log_request(412)
+            return
+
+        # locked resources are not allowed to be overwritten
         if (
             (self._l_isLocked(uri)) and
             (not ifheader)
@@ -574,11 +1194,7 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
                 return res
 
         # Handle expect
-        expect = self.headers.get('Expect', '')
-        if (expect.lower() == '100-continue' and
-                self.protocol_version >= 'HTTP/1.1' and
-                self.request_version >= 'HTTP/1.1'):
-            self.send_status(100)
+        self._send_continue()
 
         content_type = None
         if 'Content-Type' in self.headers:
@@ -587,47 +1203,72 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         headers = {}
         headers['Location'] = urllib.parse.quote(uri)
 
-        try:
-            etag = dc.get_prop(uri, "DAV:", "getetag")
-            headers['ETag'] = etag
-        except:
-            pass
-
         expect = self.headers.get('transfer-encoding', '')
         if (
             expect.lower() == 'chunked' and
             self.protocol_version >= 'HTTP/1.1' and
             self.request_version >= 'HTTP/1.1'
         ):
-            self.send_body(None, 201, 'Created', '', headers=headers)
+            try:
+                dc.put(uri, self._readChunkedData(), content_type)
+            except DAV_Error as error:
+                (ec, dd) = error.args
+                return self.send_status(ec)
 
-            dc.put(uri, self._readChunkedData(), content_type)
+            self._add_etag(dc, uri, headers)
+            self.send_body(None, 201, 'Created', '', headers=headers)
+            self.log_request(201)
         else:
             # read the body
             body = None
+            length = None
             if 'Content-Length' in self.headers:
                 l = self.headers['Content-Length']
                 log.debug("do_PUT: Content-Length = %s" % l)
-                body = self._readNoChunkedData(int(l))
+                length = int(l)
+                max_size = self._max_body_size()
+                if max_size and length > max_size:
+                    self.close_connection = True
+                    return self.send_status(413)
+                body = self._readNoChunkedData(length)
             else:
                 log.debug("do_PUT: Content-Length = empty")
 
             try:
-                dc.put(uri, body, content_type)
+                dc.put(uri, body, content_type, content_length=length)
             except DAV_Error as error:
                 (ec, dd) = error.args
                 return self.send_status(ec)
 
+            self._add_etag(dc, uri, headers)
             self.send_body(None, 201, 'Created', '', headers=headers)
             self.log_request(201)
 
+    def _add_etag(self, dc, uri, headers):
+        """ add the ETag of the (new) content of uri to headers """
+        try:
+            headers['ETag'] = dc.get_prop(uri, "DAV:", "getetag")
+        except DAV_Error:
+            pass
+
+    def _max_body_size(self):
+        """ the maximum size of a request body, 0 for no limit """
+        return int(self._config.DAV.get('max_body_size', 0) or 0)
+
     def _readChunkedData(self):
-        l = int(self.rfile.readline(), 16)
-        while l > 0:
-            buf = self.rfile.read(l)
-            yield buf
-            self.rfile.readline()
-            l = int(self.rfile.readline(), 16)
+        piece_size = int(self._config.DAV.get('put_buffer_size', 0) or
+                         PIECE_SIZE)
+        views = getattr(self.IFACE_CLASS, 'put_accepts_views', False)
+        try:
+            for piece in read_chunked(self.rfile, piece_size,
+                                      self._max_body_size()):
+                # the buffer is reused for the next piece
+                yield piece if views else bytes(piece)
+        except DAV_Error:
+            # the rest of the body cannot be skipped
+            self.close_connection = True
+            raise
+        self._body_left = 0
 
     def _readNoChunkedData(self, content_length):
         if self._config.DAV.getboolean('http_request_use_iterator'):
@@ -638,18 +1279,24 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
             return self.__readNoChunkedDataWithoutIterator(content_length)
 
     def __readNoChunkedDataWithIterator(self, content_length):
-        while True:
-            if content_length > BUFFER_SIZE:
-                buf = self.rfile.read(BUFFER_SIZE)
-                content_length -= BUFFER_SIZE
-                yield buf
-            else:
-                buf = self.rfile.read(content_length)
-                yield buf
-                break
+        left = content_length
+        while left > 0:
+            buf = self.rfile.read(min(left, BUFFER_SIZE))
+            if not buf:
+                # the client went away, the body is incomplete
+                self.close_connection = True
+                raise DAV_Error(400, 'Incomplete request body')
+            left -= len(buf)
+            self._body_left = left
+            yield buf
 
     def __readNoChunkedDataWithoutIterator(self, content_length):
-        return self.rfile.read(content_length)
+        data = self.rfile.read(content_length)
+        self._body_left = 0
+        if len(data) < content_length:
+            # the client went away, put() refuses the incomplete body
+            self.close_connection = True
+        return data
 
     def do_COPY(self):
         """ copy one resource to another """
@@ -678,8 +1325,11 @@ class DAVRequestHandler(AuthServer.AuthRequestHandler, LockManager):
         dest_uri = self.headers['Destination']
         dest_uri = urllib.parse.unquote(dest_uri)
 
-        # check locks on source and dest
-        if self._l_isLocked(source_uri) or self._l_isLocked(dest_uri):
+        # check locks on source and dest, a move also removes the
+        # members of the source and an overwrite those of the dest
+        if (self._l_isLocked(source_uri) or self._l_isLocked(dest_uri) or
+                self._l_isLockedBelow(dest_uri) or
+                (CLASS is MOVE and self._l_isLockedBelow(source_uri))):
             return self.send_body(None, 423, 'Locked', 'Locked')
 
         # Overwrite?
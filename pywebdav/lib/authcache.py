@@ -0,0 +1,71 @@
+"""
+    Cache of verified credentials
+
+    Used by the authenticating handlers so that the (slow) check of a
+    user and password against a database or a password hash is done
+    once per TTL and not on every request of a client.
+
+    The passwords are not kept, the cache is keyed by the user and a
+    salted SHA-256 digest of the password. A cached value is the
+    permission string of the user:
+
+        'rw'    read and write access
+        'r'     read only access
+        ''      authentication failed (kept for the shorter negative TTL)
+
+"""
+
+from __future__ import absolute_import
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import six
+
+
+class AuthCache(object):
+    """ size and TTL bounded LRU cache of checked credentials """
+
+    def __init__(self, ttl=60, negative_ttl=5, size=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self._salt = os.urandom(16)
+        self._items = OrderedDict()     # key: (expires, perms)
+        self._lock = threading.Lock()
+
+    def _key(self, user, password):
+        if isinstance(password, six.text_type):
+            password = password.encode('utf-8')
+        return user, hashlib.sha256(self._salt + password).digest()
+
+    def get(self, user, password):
+        """ return the cached permissions or None if not cached """
+        key = self._key(user, password)
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            if item[0] <= time.time():
+                return None
+            # most recently used ones last
+            self._items[key] = item
+            return item[1]
+
+    def put(self, user, password, perms):
+        ttl = perms and self.ttl or self.negative_ttl
+        if ttl <= 0 or self.size <= 0:
+            return
+
+        key = self._key(user, password)
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + ttl, perms)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,106 @@
+"""
+    Decoder of chunked request bodies
+
+    read_chunked() reads the chunks of a body with the chunked transfer
+    coding into one reusable buffer and yields the data in pieces of
+    piece_size bytes (the last one may be shorter), whatever the chunk
+    sizes of the client are. The pieces are memoryviews of the buffer,
+    they are only valid until the next piece is taken.
+
+    The data is read with readinto() straight into the buffer and at
+    most piece_size bytes at a time, also for a huge chunk size.
+
+    Chunk extensions are ignored, the trailer section is read and
+    discarded. Malformed bodies raise DAV_Error(400), bodies bigger than
+    max_size DAV_Error(413). Nothing beyond the end of the body is read
+    so that the connection can be reused.
+
+"""
+
+from __future__ import absolute_import
+import re
+
+from .errors import DAV_Error
+
+PIECE_SIZE = 256 * 1024
+
+# maximum length of a chunk size or a trailer line
+MAX_LINE = 4096
+
+# maximum number of trailer fields
+MAX_TRAILERS = 100
+
+# chunk size with optional extensions
+CHUNK_SIZE = re.compile(br'([0-9a-fA-F]{1,16})[ \t]*(?:;[^\r\n]*)?\r?\n\Z')
+
+
+def _readline(rfile):
+    line = rfile.readline(MAX_LINE + 1)
+    if not line.endswith(b'\n'):
+        if not line:
+            raise DAV_Error(400, 'Incomplete chunked body')
+        raise DAV_Error(400, 'Line too long in chunked body')
+    return line
+
+
+def _skip_trailers(rfile):
+    for i in range(MAX_TRAILERS + 1):
+        if _readline(rfile) in (b'\r\n', b'\n'):
+            return
+    raise DAV_Error(400, 'Too many trailer fields')
+
+
+def read_chunked(rfile, piece_size=PIECE_SIZE, max_size=0):
+    """ yield the data of a chunked body read from rfile
+
+    max_size is the maximum size of the data, 0 for no limit.
+
+    """
+    buf = memoryview(bytearray(piece_size))
+    filled = 0
+    total = 0
+
+    readline = rfile.readline
+    readinto = getattr(rfile, 'readinto', None)
+    match = CHUNK_SIZE.match
+
+    while True:
+        line = readline(MAX_LINE + 1)
+        m = match(line)
+        if m is None:
+            if not line:
+                raise DAV_Error(400, 'Incomplete chunked body')
+            raise DAV_Error(400, 'Bad chunk size')
+        size = int(m.group(1), 16)
+        if size == 0:
+            break
+
+        total += size
+        if max_size and total > max_size:
+            raise DAV_Error(413, 'Request body too large')
+
+        while size > 0:
+            n = piece_size - filled
+            if n > size:
+                n = size
+            if readinto is not None:
+                got = readinto(buf[filled:filled + n])
+            else:
+                data = rfile.read(n)
+                got = len(data)
+                buf[filled:filled + got] = data
+            if not got:
+                raise DAV_Error(400, 'Incomplete chunked body')
+
+            filled += got
+            size -= got
+            if filled == piece_size:
+                yield buf
+                filled = 0
+
+        if readline(3) not in (b'\r\n', b'\n'):
+            raise DAV_Error(400, 'Missing end of chunk')
+
+    _skip_trailers(rfile)
+    if filled:
+        yield buf[:filled]
@@ -0,0 +1,208 @@
+"""
+    Credential file
+
+    A file of users with their permissions and salted password hashes,
+    one user per line:
+
+        user:rw:pbkdf2_sha256$260000$<salt>$<hash>
+        reader:r:scrypt$16384$8$1$<salt>$<hash>
+
+    The permissions are r (read only) or rw (read and write), salt and
+    hash are base64 encoded. Empty lines and lines starting with # are
+    ignored. The file is read again when it changes.
+
+    Create or change an entry with
+
+        python -m pywebdav.lib.credentials FILE USER [r|rw]
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+
+import six
+
+log = logging.getLogger(__name__)
+
+PBKDF2_ITERATIONS = 260000
+
+# the file is checked for changes at most this often (in seconds)
+CHECK_INTERVAL = 1
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _unb64(data):
+    return base64.b64decode(data.encode('ascii'))
+
+
+def hash_password(password, method='pbkdf2_sha256'):
+    """ return the encoded salted hash of password """
+    if isinstance(password, six.text_type):
+        password = password.encode('utf-8')
+    salt = os.urandom(16)
+
+    if method == 'scrypt':
+        n, r, p = 16384, 8, 1
+        digest = hashlib.scrypt(password, salt=salt, n=n, r=r, p=p)
+        return 'scrypt$%d$%d$%d$%s$%s' % (n, r, p, _b64(salt), _b64(digest))
+
+    if method == 'pbkdf2_sha256':
+        digest = hashlib.pbkdf2_hmac('sha256', password, salt,
+                                     PBKDF2_ITERATIONS)
+        return 'pbkdf2_sha256$%d$%s$%s' % (PBKDF2_ITERATIONS, _b64(salt),
+                                           _b64(digest))
+
+    raise ValueError('Unknown hash method %s' % method)
+
+
+def verify_password(password, encoded):
+    """ test password against an encoded hash """
+    if isinstance(password, six.text_type):
+        password = password.encode('utf-8')
+
+    try:
+        parts = encoded.split('$')
+        if parts[0] == 'scrypt':
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = _unb64(parts[4]), _unb64(parts[5])
+            digest = hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                                    dklen=len(expected))
+        elif parts[0] == 'pbkdf2_sha256':
+            iterations = int(parts[1])
+            salt, expected = _unb64(parts[2]), _unb64(parts[3])
+            digest = hashlib.pbkdf2_hmac('sha256', password, salt, iterations,
+                                         len(expected))
+        else:
+            log.error('Unknown password hash %s' % parts[0])
+            return False
+    except (IndexError, ValueError, TypeError) as ex:
+        log.error('Malformed password hash: %s' % ex)
+        return False
+
+    return hmac.compare_digest(digest, expected)
+
+
+class CredentialFile(object):
+    """ users, permissions and password hashes read from a file """
+
+    def __init__(self, path, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._users = {}
+        self._signature = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        try:
+            self.reload()
+        except (IOError, OSError) as ex:
+            # nobody can log in until the file can be read
+            log.error('Cannot read %s: %s' % (self.path, ex))
+            self._checked = time.time()
+
+    def _file_signature(self):
+        st = os.stat(self.path)
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def reload(self):
+        """ read the file """
+        users = {}
+        signature = self._file_signature()
+        with open(self.path) as fp:
+            for num, line in enumerate(fp):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    user, perms, encoded = line.split(':', 2)
+                except ValueError:
+                    log.warning('%s:%d: malformed line' % (self.path, num + 1))
+                    continue
+                if perms not in ('r', 'rw'):
+                    log.warning('%s:%d: bad permissions %s' % (
+                        self.path, num + 1, perms))
+                    continue
+                users[user] = (perms, encoded)
+
+        self._users = users
+        self._signature = signature
+        self._checked = time.time()
+        log.info('Read %d users from %s' % (len(users), self.path))
+
+    def reload_if_changed(self):
+        """ read the file again if it changed, returns True if it did """
+        now = time.time()
+        if now - self._checked < self.check_interval:
+            return False
+
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            try:
+                if self._file_signature() == self._signature:
+                    return False
+                self.reload()
+            except (IOError, OSError) as ex:
+                log.error('Cannot read %s: %s' % (self.path, ex))
+                return False
+        return True
+
+    def check(self, user, password):
+        """ return the permissions of user or '' if the password is wrong """
+        entry = self._users.get(user)
+        if entry is None:
+            return ''
+        perms, encoded = entry
+        if verify_password(password, encoded):
+            return perms
+        return ''
+
+
+def set_user(path, user, password, perms='rw', method='pbkdf2_sha256'):
+    """ add user to the file or change its entry """
+    if ':' in user:
+        raise ValueError('A user name must not contain ":"')
+
+    lines = []
+    if os.path.exists(path):
+        with open(path) as fp:
+            lines = [line for line in fp
+                     if line.split(':', 1)[0] != user]
+
+    lines.append('%s:%s:%s\n' % (user, perms, hash_password(password, method)))
+
+    # replace the file at once, a running server may read it meanwhile
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        fp.writelines(lines)
+    os.chmod(tmp, 0o600)
+    os.rename(tmp, path)
+
+
+def main():
+    import getpass
+
+    if len(sys.argv) not in (3, 4) or sys.argv[3:] not in ([], ['r'], ['rw']):
+        print('Usage: python -m pywebdav.lib.credentials FILE USER [r|rw]')
+        sys.exit(2)
+
+    password = getpass.getpass('Password for %s: ' % sys.argv[2])
+    if password != getpass.getpass('Again: '):
+        print('The passwords differ')
+        sys.exit(1)
+    set_user(sys.argv[1], sys.argv[2], password, (sys.argv[3:] or ['rw'])[0])
+
+
+if __name__ == '__main__':
+    main()
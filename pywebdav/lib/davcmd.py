@@ -11,18 +11,44 @@ resources and collections
 from __future__ import absolute_import
 from six.moves import urllib
 
-from .utils import create_treelist, is_prefix
+from .utils import walk_tree
 from .errors import *
 from six.moves import range
 import os
 
-def deltree(dc,uri,exclude={}):
+def _path(uri):
+    return urllib.parse.urlparse(uri).path.rstrip('/')
+
+def _parent(path):
+    return path.rpartition('/')[0]
+
+def _below(path, paths):
+    """ test if path or one of its parents is in paths """
+    while True:
+        if path in paths:
+            return True
+        if not path:
+            return False
+        path = _parent(path)
+
+def _delete(dc, uri, iscol):
+    """ delete uri, returns the error code or None """
+    try:
+        delone(dc, uri, iscol)
+    except DAV_Error as error:
+        (ec, dd) = error.args
+        return ec
+    return None
+
+def deltree(dc,uri,exclude={},workers=1):
     """ delete a tree of resources
 
     dc  -- dataclass to use
     uri -- root uri to delete
     exclude -- an optional list of uri:error_code pairs which should not
            be deleted.
+    workers -- number of threads deleting the non-collection
+           resources
 
     returns dict of uri:error_code tuples from which
     another method can create a multistatus xml element.
@@ -32,46 +58,89 @@ def deltree(dc,uri,exclude={}):
 
     """
 
-    tlist=create_treelist(dc,uri)
     result={}
 
-    for i in range(len(tlist),0,-1):
-        problem_uris=list(result.keys())
-        element=tlist[i-1]
+    # resources in excluded collections are not deleted
+    excluded=set(_path(p) for p in exclude)
+    prune=None
+    if excluded:
+        if _below(_path(uri), excluded):
+            return result
+        prune=lambda u: _path(u) in excluded
+
+    # collections which must not be deleted because a member was
+    # not deleted (see example in 8.6.2.1), this goes up to the root
+    # as the tree is walked from the bottom up
+    keep=set()
+
+    # collection path: [(uri, path, future)] of its members which
+    # are deleted by the pool
+    pending={}
+
+    def failed(element, path, ec):
+        result[element]=ec
+        keep.add(_parent(path))
+
+    def collect(path):
+        """ wait until the members of a collection are deleted """
+        for element, mpath, future in pending.pop(path, ()):
+            ec=future.result()
+            if ec is not None:
+                failed(element, mpath, ec)
+
+    pool=None
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool=ThreadPoolExecutor(workers)
 
-        # test here, if an element is a prefix of an uri which
-        # generated an error before.
-        # note that we walk here from childs to parents, thus
-        # we cannot delete a parent if a child made a problem.
-        # (see example in 8.6.2.1)
-        ok=1
-        for p in problem_uris:
-            if is_prefix(element,p):
-                ok=None
-                break
+    try:
+        for element, iscol, info in walk_tree(dc, uri, post_order=True,
+                                              prune=prune):
+            path=_path(element)
+            if path in excluded:
+                keep.add(_parent(path))
+                continue
+
+            if not iscol:
+                if pool is None:
+                    ec=_delete(dc, element, False)
+                    if ec is not None:
+                        failed(element, path, ec)
+                else:
+                    future=pool.submit(_delete, dc, element, False)
+                    pending.setdefault(_parent(path), []).append(
+                        (element, path, future))
+                continue
+
+            # all members of a collection come before it
+            collect(path)
+            if path in keep:
+                keep.add(_parent(path))
+                continue
+            ec=_delete(dc, element, True)
+            if ec is not None:
+                failed(element, path, ec)
+
+        # uri itself was no collection
+        for path in list(pending):
+            collect(path)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
-            if not ok: continue
+    return result
 
-        # here we test for the exclude list which is the other way round!
-        for p in exclude.keys():
-            if is_prefix(p,element):
-                ok=None
-                break
+def delone(dc,uri,iscol=None):
+    """ delete a single object
 
-            if not ok: continue
+    iscol may be passed if it is already known whether uri is a
+    collection.
 
-        # now delete stuff
-        try:
-            delone(dc,element)
-        except DAV_Error as error:
-            (ec,dd) = error.args
-            result[element]=ec
-
-    return result
+    """
+    if iscol is None:
+        iscol = dc.is_collection(uri)
 
-def delone(dc,uri):
-    """ delete a single object """
-    if dc.is_collection(uri):
+    if iscol:
         return dc.rmcol(uri)   # should be empty
     else:
         return dc.rm(uri)
@@ -82,23 +151,29 @@ def delone(dc,uri):
 
 # helper function
 
-def copy(dc,src,dst):
+def copy(dc,src,dst,iscol=None):
     """ only copy the element
 
     This is just a helper method factored out from copy and
     copytree. It will not handle the overwrite or depth header.
 
+    iscol may be passed for a source which is known to exist,
+    e.g. because it was just listed by a tree walk.
+
     """
 
     # destination should have been deleted before
     if dc.exists(dst): 
         raise DAV_Error(412)
 
-    # source should exist also
-    if not dc.exists(src): 
-        raise DAV_NotFound
+    if iscol is None:
+        # source should exist also
+        if not dc.exists(src): 
+            raise DAV_NotFound
 
-    if dc.is_collection(src):
+        iscol = dc.is_collection(src)
+
+    if iscol:
         dc.copycol(src, dst) # an exception will be passed thru
     else:
         dc.copy(src, dst)  # an exception will be passed thru
@@ -146,8 +221,6 @@ def copytree(dc,src,dst,overwrite=None):
     if delres: 
         return delres
 
-    # get the tree we have to copy
-    tlist = create_treelist(dc,src)
     result = {}
 
     # Extract the path out of the source URI.
@@ -159,22 +232,10 @@ def copytree(dc,src,dst,overwrite=None):
     # the source.
     dst_parsed = urllib.parse.urlparse(dst)
 
-    for element in tlist:
-        problem_uris = list(result.keys())
-
-        # now URIs get longer and longer thus we have
-        # to test if we had a parent URI which we were not
-        # able to copy in problem_uris which is the prefix
-        # of the actual element. If it is, then we cannot
-        # copy this as well but do not generate another error.
-        ok=True
-        for p in problem_uris:
-            if is_prefix(p,element):
-                ok=False
-                break
-
-        if not ok:
-            continue
+    # the walk skips the members of a collection which could not
+    # be copied, they do not generate another error
+    for element, iscol, info in walk_tree(dc, src,
+                                          prune=lambda u: u in result):
 
         # Find the element's path relative to the source.
         element_path = urllib.parse.urlparse(element).path
@@ -189,12 +250,11 @@ def copytree(dc,src,dst,overwrite=None):
             dst_path = os.path.join(dst_parsed.path, element_path_rel)
 
         # Generate destination URI using our derived destination path.
-        dst_uri = urllib.parse.urlunparse(dst_parsed._replace(path=os.path.join(dst_parsed.path, element_path_rel)))
-
+        dst_uri = urllib.parse.urlunparse(dst_parsed._replace(path=dst_path))
 
         # now copy stuff
         try:
-            copy(dc,element,dst_uri)
+            copy(dc,element,dst_uri,iscol)
         except DAV_Error as error:
             (ec,dd) = error.args
             result[element]=ec
@@ -224,22 +284,24 @@ def movetree(dc,src,dst,overwrite=None):
     """ move a collection
 
     This is done by first copying it and then deleting
-    the original.
+    the original. Interface classes should rename the
+    collection instead where they can (see
+    FilesystemHandler.movetree()).
 
-    PROBLEM: if something did not copy then we have a problem
-    when deleting as the original might get deleted!
+    The resources which could not be copied are not deleted,
+    nor are their parent collections. Their errors are returned
+    together with the ones of the delete.
     """
 
     # first copy it
     res = copytree(dc,src,dst,overwrite)
 
-    # TODO: shouldn't we check res for errors and bail out before
-    # the delete if we find any?
-    # TODO: or, better yet, is there anything preventing us from
-    # reimplementing this using `shutil.move()`?
+    # nothing was copied if the destination could not be deleted
+    if not all(_below(_path(uri), (_path(src),)) for uri in res):
+        return res
 
     # then delete it
-    res = deltree(dc,src,exclude=res)
+    res.update(deltree(dc,src,exclude=res))
 
     return res
 
@@ -10,7 +10,7 @@ from io import StringIO
 from . import utils
 from .constants import COLLECTION, OBJECT, DAV_PROPS, RT_ALLPROP, RT_PROPNAME, RT_PROP
 from .errors import *
-from .utils import create_treelist, quote_uri, gen_estring
+from .utils import create_treelist, quote_uri, gen_estring, make_xmlresponse
 
 class COPY:
     """ copy resources and eventually create multistatus responses
@@ -78,25 +78,5 @@ class COPY:
 
         if not result: return None
 
-        ###
-        ### create the multistatus XML element
-        ### (this is also the same as in delete.py.
-        ###  we might make a common method out of it)
-        ###
-
-        doc = domimpl.createDocument(None, "D:multistatus", None)
-        doc.documentElement.setAttribute("xmlns:D","DAV:")
-
-        for el,ec in result.items():
-                re=doc.createElement("D:response")
-                hr=doc.createElement("D:href")
-                st=doc.createElement("D:status")
-                huri=doc.createTextNode(quote_uri(el))
-                t=doc.createTextNode(gen_estring(ec))
-                st.appendChild(t)
-                hr.appendChild(huri)
-                re.appendChild(hr)
-                re.appendChild(st)
-                ms.appendChild(re)
-
-        return doc.toxml(encoding="utf-8") + b"\n"
+        # create the multistatus XML element
+        return make_xmlresponse(result)
@@ -1,8 +1,14 @@
 from __future__ import absolute_import
+import os
 import logging
+import threading
+from contextlib import contextmanager
 
 log = logging.getLogger(__name__)
 
+# maximum number of open connections of a pool
+POOL_SIZE = 8
+
 try:
     import MySQLdb
 except ImportError:
@@ -11,6 +17,88 @@ except ImportError:
 
 import sys
 
+
+class ConnectionPool(object):
+    """ thread safe pool of MySQL connections
+
+    Connections are opened when needed, at most size of them, and are
+    reused by the following queries. A connection which failed (e.g.
+    because the server closed it) is dropped and the query is retried
+    once with a new one.
+
+    """
+
+    def __init__(self, user, password, host, port, db, size=POOL_SIZE):
+        self._args = dict(user=user, passwd=password, host=host,
+                          port=int(port), db=db)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = MySQLdb.connect(**self._args)
+        # no transaction snapshot may hide changes of other clients
+        conn.autocommit(True)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """ borrow a connection, it is given back afterwards """
+        with self._slots:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # the connections of the parent must not be used
+                    self._idle = []
+                    self._pid = os.getpid()
+                conn = self._idle and self._idle.pop() or None
+
+            if conn is None:
+                conn = self._connect()
+            broken = False
+            try:
+                yield conn
+            except MySQLdb.OperationalError:
+                broken = True
+                conn.close()
+                raise
+            finally:
+                if not broken:
+                    with self._lock:
+                        self._idle.append(conn)
+
+    def execute(self, qry, args=None):
+        """ run a query with parameters and return all rows """
+        for retry in (False, True):
+            try:
+                with self.connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(qry, args)
+                        return cursor.fetchall()
+                    finally:
+                        cursor.close()
+            except MySQLdb.OperationalError:
+                if retry:
+                    raise
+                log.info('Reconnecting to MySQL')
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(user, password, host, port, db, size=POOL_SIZE):
+    """ return the process wide pool of connections to a database """
+    key = (user, password, host, int(port), db)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(user, password, host, port,
+                                                db, size)
+    return pool
+
+
 class Mconn:
     def connect(self,username,userpasswd,host,port,db):
         try: connection = MySQLdb.connect(host=host, port=int(port), user=username, passwd=userpasswd,db=db)
@@ -22,9 +110,9 @@ class Mconn:
 
             return 1
 
-    def execute(self,qry):
+    def execute(self,qry,args=None):
         if self.db:
-            try: res=self.db.execute(qry)
+            try: res=self.db.execute(qry,args)
             except MySQLdb.OperationalError as message:
                 log.error("Error %d:\n%s" % (message[ 0 ], message[ 1 ] ))
                 return 0
@@ -38,11 +126,11 @@ class Mconn:
                 return self.db.fetchall()
 
     def create_user(self,user,passwd):
-        qry="select * from Users where User='%s'"%(user)
-        res=self.execute(qry)
+        qry="select * from Users where User=%s"
+        res=self.execute(qry,(user,))
         if not res or len(res) ==0:
-            qry="insert into Users (User,Pass) values('%s','%s')"%(user,passwd)
-            res=self.execute(qry)
+            qry="insert into Users (User,Pass) values(%s,%s)"
+            res=self.execute(qry,(user,passwd))
         else:
             log.debug("Username already in use")
 
@@ -41,6 +41,23 @@ class dav_interface:
     M_NS={"DAV:" : "_get_dav",
           "NS2"  : "ns2" }
 
+    # put() may get the pieces of a chunked body as memoryviews of one
+    # reused buffer, see put()
+    put_accepts_views = False
+
+    def begin_request(self):
+        """ called by the server before a request is handled
+
+        Interface classes may set up per request state here, e.g.
+        a cache which must not outlive the request.
+
+        """
+        pass
+
+    def end_request(self):
+        """ called by the server after a request has been handled """
+        pass
+
     def get_propnames(self,uri):
         """ return the property names allowed for the given URI
 
@@ -80,6 +97,50 @@ class dav_interface:
         except AttributeError:
             raise DAV_NotFound
 
+    def get_props(self,uris,proplist,infos=None):
+        """ return the values of many properties of many resources
+
+        uris        -- list of uris to get the properties of
+        proplist    -- dict of the form {namespace: [propname, ...]}
+        infos       -- optional dict of uri:info with the info
+                       returned by get_childs_info()
+
+        The result is a dict of the form
+        {uri: {namespace: {propname: value}}}
+        where value is the DAV_Error raised for properties which
+        could not be read.
+
+        This default simply calls get_prop() for each property.
+        Override it if your backend can fetch all the properties
+        of a resource at once (e.g. with one stat or one query).
+
+        """
+        result={}
+        for uri in uris:
+            props=result[uri]={}
+            for ns,plist in proplist.items():
+                values=props[ns]={}
+                for prop in plist:
+                    try:
+                        values[prop]=self.get_prop(uri,ns,prop)
+                    except DAV_Error as error:
+                        values[prop]=error
+        return result
+
+    def get_childs_info(self,uri):
+        """ yield (uri, is_collection, info) for the childs of uri
+
+        info is any backend specific data about the child (e.g. its
+        stat result) which is handed back to get_props() in order to
+        not fetch it twice. The tree walkers use is_collection to
+        decide where to descend.
+
+        This default is based on get_childs() and is_collection().
+
+        """
+        for child in self.get_childs(uri):
+            yield child, self.is_collection(child), None
+
     ###
     ### DATA methods (for GET and PUT)
     ###
@@ -92,9 +153,17 @@ class dav_interface:
         """
         raise DAV_NotFound
 
-    def put(self, uri, data, content_type=None):
+    def put(self, uri, data, content_type=None, content_length=None):
         """ write an object to the repository
 
+        data is bytes or a generator of bytes, content_length the
+        size of the data if it is known beforehand.
+
+        If put_accepts_views is True the generator of a chunked body
+        yields memoryviews of one buffer instead, each is only valid
+        until the next one is taken, thus they have to be written out
+        (or copied) right away.
+
         return the location uri or raise an exception
         """
 
@@ -1,4 +1,6 @@
 from __future__ import absolute_import
+import heapq
+import threading
 import time
 from six.moves import urllib
 import uuid
@@ -13,41 +15,301 @@ from xml.dom import minidom
 from .utils import rfc1123_date, IfParser, tokenFinder
 from .errors import *
 
-tokens_to_lock = {}
-uris_to_token = {}
+# locks asking for an infinite timeout (or none at all) expire after
+# this many seconds, may be overridden by the lock_max_timeout option
+# (0 allows infinite locks)
+LOCK_MAX_TIMEOUT = 7 * 24 * 3600
+
+
+def parse_timeout(header, maximum=LOCK_MAX_TIMEOUT):
+    """ return the timeout in seconds asked for by a Timeout header
+
+    The first supported value is used, it is limited to maximum
+    (if maximum is 0, 'Infinite' is returned for infinite timeouts).
+
+    """
+    for value in (header or '').split(','):
+        value = value.strip().lower()
+        if value == 'infinite':
+            break
+        if value.startswith('second-'):
+            try:
+                seconds = int(value[7:])
+            except ValueError:
+                continue
+            if maximum:
+                return min(seconds, maximum)
+            return seconds
+
+    return maximum or 'Infinite'
+
+
+def _segments(uri):
+    """ return the path segments of an URI, the host is not relevant """
+    path = urllib.parse.urlparse(uri)[2]
+    return [s for s in path.split('/') if s]
+
+
+class _LockNode(object):
+    """ node of the lock trie, one per path segment """
+
+    __slots__ = ('children', 'locks', 'count')
+
+    def __init__(self):
+        self.children = {}
+        self.locks = {}     # token: lock on exactly this path
+        self.count = 0      # number of locks in this subtree
+
+
+class LockTable(object):
+    """ in memory table of the active locks
+
+    This is the default lock backend. A backend has to implement
+    add(), acquire(), remove(), refresh(), get(), covering(), below(),
+    has_below(), begin_request() and end_request(), see sqlitelocks.py
+    for one which is shared by several processes.
+
+    The locks are indexed by token and by a trie of the path
+    segments of the locked URIs, thus finding the locks of the
+    ancestors or descendants of a resource needs O(depth) steps.
+
+    Locks with a timeout are kept in a heap ordered by expiry. They
+    are removed whenever the table is used and, so the table does
+    not grow while nobody asks, by a background sweeper thread.
+
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._root = _LockNode()
+        self._tokens = {}
+        self._heap = []
+        self._sweeper = None
+
+    def __len__(self):
+        with self._cond:
+            self._expire()
+            return len(self._tokens)
+
+    ### internal helpers, the caller holds self._cond
+
+    def _expire(self, now=None):
+        """ remove the locks whose timeout has passed """
+        now = now or time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, token = heapq.heappop(heap)
+            lock = self._tokens.get(token)
+            # a refreshed lock has got a newer heap entry
+            if lock is not None and lock.expires() == expires:
+                log.info('Lock %s on %s expired' % (token, lock.uri))
+                self._remove(lock)
+
+    def _schedule(self, lock):
+        expires = lock.expires()
+        if expires is None:
+            return
+
+        if not self._heap or expires < self._heap[0][0]:
+            self._cond.notify()
+        heapq.heappush(self._heap, (expires, lock.token))
+
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep,
+                                             name='LockSweeper')
+            self._sweeper.daemon = True
+            self._sweeper.start()
+
+    def _sweep(self):
+        with self._cond:
+            while True:
+                self._expire()
+                timeout = None
+                if self._heap:
+                    timeout = max(self._heap[0][0] - time.time(), 0.01)
+                self._cond.wait(timeout)
+
+    def _node(self, uri, create=False):
+        node = self._root
+        for seg in _segments(uri):
+            child = node.children.get(seg)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[seg] = _LockNode()
+            node = child
+        return node
+
+    def _remove(self, lock):
+        del self._tokens[lock.token]
+        path = [self._root]
+        for seg in _segments(lock.uri):
+            path.append(path[-1].children[seg])
+        del path[-1].locks[lock.token]
+
+        for node in path:
+            node.count -= 1
+
+        # prune the branches without locks
+        segs = _segments(lock.uri)
+        for i in range(len(segs), 0, -1):
+            if path[i].count:
+                break
+            del path[i - 1].children[segs[i - 1]]
+
+    def _add(self, lock):
+        node = self._root
+        node.count += 1
+        for seg in _segments(lock.uri):
+            child = node.children.get(seg)
+            if child is None:
+                child = node.children[seg] = _LockNode()
+            node = child
+            node.count += 1
+        node.locks[lock.token] = lock
+        self._tokens[lock.token] = lock
+        self._schedule(lock)
+
+    def _covering(self, uri):
+        found = []
+        node = self._root
+        for seg in _segments(uri):
+            found.extend(l for l in node.locks.values()
+                         if l.depth == 'infinity')
+            node = node.children.get(seg)
+            if node is None:
+                break
+        else:
+            found.extend(node.locks.values())
+        found.reverse()
+        return found
+
+    def _below(self, uri):
+        node = self._node(uri)
+        if node is None or node.count == len(node.locks):
+            return []
+
+        found = []
+        stack = list(node.children.values())
+        while stack:
+            node = stack.pop()
+            found.extend(node.locks.values())
+            stack.extend(node.children.values())
+        return found
+
+    ### public interface
+
+    def begin_request(self):
+        """ called before a request is handled """
+
+    def end_request(self):
+        """ called after a request was handled """
+
+    def add(self, lock):
+        with self._cond:
+            self._expire()
+            self._add(lock)
+
+    def acquire(self, lock):
+        """ add lock unless it conflicts with the locks of its resource,
+        of its ancestors or (for depth infinity) of its descendants
+
+        Returns the conflicting locks, the lock was added if there are
+        none. The test and the addition are atomic.
+
+        """
+        with self._cond:
+            self._expire()
+            locks = self._covering(lock.uri)
+            if lock.depth == 'infinity':
+                locks.extend(self._below(lock.uri))
+            conflicts = [l for l in locks if lock.conflicts(l)]
+            if not conflicts:
+                self._add(lock)
+            return conflicts
+
+    def remove(self, token):
+        with self._cond:
+            self._expire()
+            lock = self._tokens.get(token)
+            if lock is not None:
+                self._remove(lock)
+            return lock
+
+    def refresh(self, lock, timeout):
+        with self._cond:
+            lock.setTimeout(timeout)
+            if self._tokens.get(lock.token) is lock:
+                self._schedule(lock)
+
+    def get(self, token):
+        with self._cond:
+            self._expire()
+            return self._tokens.get(token)
+
+    def covering(self, uri):
+        """ return the locks of uri and the depth infinity locks of
+        its ancestors, the nearest ones first """
+        with self._cond:
+            self._expire()
+            return self._covering(uri)
+
+    def below(self, uri):
+        """ return the locks of the descendants of uri """
+        with self._cond:
+            self._expire()
+            return self._below(uri)
+
+    def has_below(self, uri):
+        """ test if any descendant of uri is locked """
+        with self._cond:
+            self._expire()
+            node = self._node(uri)
+            return node is not None and node.count > len(node.locks)
+
+
+lock_table = LockTable()
+
+def set_lock_table(table):
+    """ replace the lock backend used by all LockManagers """
+    global lock_table
+    lock_table = table
+
 
 class LockManager:
     """ Implements the locking backend and serves as MixIn for DAVRequestHandler """
 
     def _init_locks(self):
-        return tokens_to_lock, uris_to_token
+        """ return the lock backend """
+        return lock_table
 
     def _l_isLocked(self, uri):
-        tokens, uris = self._init_locks()
-        return uri in uris
+        """ test if uri is locked, by itself or by a parent collection """
+        return bool(self._init_locks().covering(uri))
+
+    def _l_isLockedBelow(self, uri):
+        """ test if a resource below the collection uri is locked """
+        return self._init_locks().has_below(uri)
 
     def _l_hasLock(self, token):
-        tokens, uris = self._init_locks()
-        return token in tokens
+        return self._init_locks().get(token) is not None
 
     def _l_getLockForUri(self, uri):
-        tokens, uris = self._init_locks()
-        return uris.get(uri, None)
+        """ return the lock of uri or the nearest lock of a parent """
+        locks = self._init_locks().covering(uri)
+        return locks and locks[0] or None
 
     def _l_getLock(self, token):
-        tokens, uris = self._init_locks()
-        return tokens.get(token, None)
+        return self._init_locks().get(token)
 
     def _l_delLock(self, token):
-        tokens, uris = self._init_locks()
-        if token in tokens:
-            del uris[tokens[token].uri]
-            del tokens[token]
+        self._init_locks().remove(token)
 
     def _l_setLock(self, lock):
-        tokens, uris = self._init_locks()
-        tokens[lock.token] = lock
-        uris[lock.uri] = lock
+        self._init_locks().add(lock)
+
+    def _l_maxTimeout(self):
+        return int(self._config.DAV.get('lock_max_timeout', LOCK_MAX_TIMEOUT))
 
     def _lock_unlock_parse(self, body):
         doc = minidom.parseString(body)
@@ -62,19 +324,52 @@ class LockManager:
         return data
 
     def _lock_unlock_create(self, uri, creator, depth, data):
-        lock = LockItem(uri, creator, **data)
-        iscollection = uri[-1] == '/' # very dumb collection check
-
-        result = ''
-        if depth == 'infinity' and iscollection:
-            # locking of children/collections not yet supported
-            pass
-
-        if not self._l_isLocked(uri):
-            self._l_setLock(lock)
-
-        # because we do not handle children we leave result empty
-        return lock.token, result
+        """ create a new lock, returns (token, result)
+
+        If the lock conflicts with another one the token is None,
+        result is None if the resource or a parent is locked or a
+        multistatus document if locked descendants prevent a depth
+        infinity lock of a collection.
+
+        """
+        if depth != 'infinity' or not self.IFACE_CLASS.is_collection(uri):
+            depth = '0'
+        timeout = parse_timeout(self.headers.get('Timeout'),
+                                self._l_maxTimeout())
+        lock = LockItem(uri, creator, depth=depth, timeout=timeout, **data)
+
+        conflicts = self._init_locks().acquire(lock)
+        if not conflicts:
+            return lock.token, ''
+
+        level = len(_segments(uri))
+        below = [l for l in conflicts if len(_segments(l.uri)) > level]
+        if len(below) < len(conflicts):
+            return None, None
+        return None, self._lock_conflict_result(uri, below)
+
+    def _lock_conflict_result(self, uri, conflicts):
+        """ multistatus document for a LOCK failing because of
+        locked descendants (RFC 4918, 9.10.9) """
+        dc = self.IFACE_CLASS
+        baseuri = self.get_baseuri(dc)
+
+        def href(u):
+            path = urllib.parse.urlparse(u)[2]
+            return urllib.parse.quote(urllib.parse.urljoin(baseuri, path),
+                                      safe=':/')
+
+        out = ['<?xml version="1.0" encoding="utf-8" ?>\n'
+               '<D:multistatus xmlns:D="DAV:">\n']
+        for lock in conflicts:
+            out.append('<D:response><D:href>%s</D:href>'
+                       '<D:status>HTTP/1.1 423 Locked</D:status>'
+                       '</D:response>\n' % href(lock.uri))
+        out.append('<D:response><D:href>%s</D:href>'
+                   '<D:status>HTTP/1.1 424 Failed Dependency</D:status>'
+                   '</D:response>\n' % href(uri))
+        out.append('</D:multistatus>')
+        return ''.join(out)
 
     def do_UNLOCK(self):
         """ Unlocks given resource """
@@ -92,7 +387,10 @@ class LockManager:
             return self.send_status(400)
 
         token = tokenFinder(self.headers.get('Lock-Token'))
-        if self._l_isLocked(uri):
+        lock = self._l_getLock(token)
+        if lock is not None and lock in self._init_locks().covering(uri):
+            # this also removes the lock from all members of a
+            # locked collection
             self._l_delLock(token)
 
         self.send_body(None, 204, 'OK', 'OK')
@@ -104,10 +402,7 @@ class LockManager:
 
         log.info('LOCKing resource %s' % self.headers)
 
-        body = None
-        if 'Content-Length' in self.headers:
-            l = self.headers['Content-Length']
-            body = self.rfile.read(int(l))
+        body = self._read_request_body()
 
         depth = self.headers.get('Depth', 'infinity')
 
@@ -116,19 +411,29 @@ class LockManager:
         log.info('do_LOCK: uri = %s' % uri)
 
         ifheader = self.headers.get('If')
-        alreadylocked = self._l_isLocked(uri)
+
+        data = None
+        alreadylocked = False
+        if body:
+            data = self._lock_unlock_parse(body)
+            if ifheader:
+                scope = data['lockscope']
+                alreadylocked = any(l.lockscope == 'exclusive' or scope == 'exclusive'
+                                    for l in self._init_locks().covering(uri))
         log.info('do_LOCK: alreadylocked = %s' % alreadylocked)
 
+        if body and not ifheader:
+            # LOCK with XML information, the conflicts are checked
+            # when the lock is added
+            token, result = self._lock_unlock_create(uri, 'unknown', depth, data)
+            alreadylocked = result is None
+
         if body and alreadylocked:
             # Full LOCK request but resource already locked
             self.responses[423] = ('Locked', 'Already locked')
             return self.send_status(423)
 
         elif body and not ifheader:
-            # LOCK with XML information
-            data = self._lock_unlock_parse(body)
-            token, result = self._lock_unlock_create(uri, 'unknown', depth, data)
-
             if result:
                 self.send_body(bytes(result, 'utf-8'), 207, 'Error', 'Error',
                                 'text/xml; charset="utf-8"')
@@ -149,8 +454,9 @@ class LockManager:
                     token = tokenFinder(listitem)
                     if token and self._l_hasLock(token):
                         lock = self._l_getLock(token)
-                        timeout = self.headers.get('Timeout', 'Infinite')
-                        lock.setTimeout(timeout) # automatically refreshes
+                        timeout = parse_timeout(self.headers.get('Timeout'),
+                                                self._l_maxTimeout())
+                        self._init_locks().refresh(lock, timeout)
                         found = 1
 
                         self.send_body(bytes(lock.asXML(), 'utf-8'),
@@ -181,22 +487,42 @@ class LockItem:
         self.token = token and token or self.generateToken()
         self.modified = time.time()
 
+    def __eq__(self, other):
+        # backends may hand out several objects for one lock
+        return isinstance(other, LockItem) and other.token == self.token
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.token)
+
     def getModifiedTime(self):
         return self.modified
 
     def refresh(self):
         self.modified = time.time()
 
+    def expires(self):
+        """ return the time the lock expires or None if it never does """
+        if self.timeout == 'Infinite':
+            return None
+        return self.modified + self.timeout
+
     def isValid(self):
-        now = time.time()
-        modified = self.modified
-        timeout = self.timeout
-        return (modified + timeout) > now
+        expires = self.expires()
+        return expires is None or expires > time.time()
+
+    def conflicts(self, other):
+        """ test if this lock cannot coexist with the other one """
+        return self.lockscope == 'exclusive' or other.lockscope == 'exclusive'
 
     def generateToken(self):
         return str(uuid.uuid4())
 
     def getTimeoutString(self):
+        if self.timeout == 'Infinite':
+            return 'Infinite'
         t = str(self.timeout)
         if t[-1] == 'L': t = t[:-1]
         return 'Second-%s' % t
@@ -205,12 +531,17 @@ class LockItem:
         self.timeout = timeout
         self.modified = time.time()
 
-    def asXML(self, namespace='d', discover=False):
+    def getOwnerXML(self):
+        """ return the content of the owner element as string """
         owner_str = ''
         if isinstance(self.owner, str):
             owner_str = self.owner
         elif isinstance(self.owner, xml.dom.minicompat.NodeList) and len(self.owner):
             owner_str = "".join([node.toxml() for node in self.owner[0].childNodes])
+        return owner_str
+
+    def asXML(self, namespace='d', discover=False):
+        owner_str = self.getOwnerXML()
 
         token = self.token
         base = ('<%(ns)s:activelock>\n'
@@ -0,0 +1,165 @@
+"""
+    Request metrics
+
+    Counts the requests handled by a DAVRequestHandler: latency
+    histograms by method and status, the bytes read and written and
+    the number of resources visited by PROPFIND, COPY, MOVE and DELETE.
+    render() returns them in the Prometheus text format, the handler
+    serves them on the metrics_path.
+
+    Recording a request takes one lock, the histograms are only
+    summed up when they are rendered.
+
+"""
+
+from __future__ import absolute_import
+import bisect
+import threading
+
+# upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30)
+
+# upper bounds of the buckets of visited resources
+RESOURCE_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+# methods whose visited resources are counted
+TREE_METHODS = ('PROPFIND', 'COPY', 'MOVE', 'DELETE')
+
+_local = threading.local()
+
+
+def visit(count=1):
+    """ count resources visited by the request of the current thread """
+    _local.visited = getattr(_local, 'visited', 0) + count
+
+
+def take_visited():
+    """ return and reset the count of visit() """
+    visited = getattr(_local, 'visited', 0)
+    _local.visited = 0
+    return visited
+
+
+class CountingFile(object):
+    """ wraps the rfile or wfile of a handler to count the bytes """
+
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self.count += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._fp.readline(*args)
+        self.count += len(data)
+        return data
+
+    def readinto(self, buf):
+        if not hasattr(self._fp, 'readinto'):
+            data = self.read(len(buf))
+            buf[:len(data)] = data
+            return len(data)
+        count = self._fp.readinto(buf)
+        self.count += count or 0
+        return count
+
+    def write(self, data):
+        self.count += len(data)
+        return self._fp.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield '%s_bucket{%sle="%s"} %d' % (name, labels, bound, total)
+        yield '%s_sum{%s} %s' % (name, labels.rstrip(','), self.sum)
+        yield '%s_count{%s} %d' % (name, labels.rstrip(','), total)
+
+
+class Metrics(object):
+    """ process wide request metrics """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}       # (method, status): Histogram
+        self.bytes_read = {}    # method: bytes
+        self.bytes_written = {}
+        self.resources = {}     # method: Histogram
+
+    def observe(self, method, status, seconds, bytes_read, bytes_written,
+                visited):
+        key = (method, status)
+        with self._lock:
+            hist = self.latency.get(key)
+            if hist is None:
+                hist = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            hist.observe(seconds)
+
+            self.bytes_read[method] = self.bytes_read.get(method, 0) + bytes_read
+            self.bytes_written[method] = \
+                self.bytes_written.get(method, 0) + bytes_written
+
+            if method in TREE_METHODS:
+                hist = self.resources.get(method)
+                if hist is None:
+                    hist = self.resources[method] = Histogram(RESOURCE_BUCKETS)
+                hist.observe(max(visited, 1))
+
+    def render(self, extra=()):
+        """ return the metrics in the Prometheus text format
+
+        extra are more metrics as (name, type, help, value) tuples.
+
+        """
+        out = []
+        with self._lock:
+            out.append('# HELP pywebdav_request_duration_seconds '
+                       'Time to handle a request')
+            out.append('# TYPE pywebdav_request_duration_seconds histogram')
+            for (method, status), hist in sorted(self.latency.items()):
+                out.extend(hist.lines(
+                    'pywebdav_request_duration_seconds',
+                    'method="%s",status="%s",' % (method, status)))
+
+            for name, help, values in (
+                    ('pywebdav_read_bytes_total',
+                     'Bytes read from the clients', self.bytes_read),
+                    ('pywebdav_written_bytes_total',
+                     'Bytes written to the clients', self.bytes_written)):
+                out.append('# HELP %s %s' % (name, help))
+                out.append('# TYPE %s counter' % name)
+                for method, value in sorted(values.items()):
+                    out.append('%s{method="%s"} %d' % (name, method, value))
+
+            out.append('# HELP pywebdav_visited_resources '
+                       'Resources visited by a request')
+            out.append('# TYPE pywebdav_visited_resources histogram')
+            for method, hist in sorted(self.resources.items()):
+                out.extend(hist.lines('pywebdav_visited_resources',
+                                      'method="%s",' % method))
+
+        for name, type, help, value in extra:
+            out.append('# HELP %s %s' % (name, help))
+            out.append('# TYPE %s %s' % (name, type))
+            out.append('%s %s' % (name, value))
+        out.append('')
+        return '\n'.join(out)
@@ -1,16 +1,25 @@
 from __future__ import absolute_import
+import itertools
 import xml.dom.minidom
-domimpl = xml.dom.minidom.getDOMImplementation()
+from xml.sax.saxutils import escape, quoteattr
 
 import logging
 from six.moves import urllib
 
 from . import utils
+from .metrics import visit
 from .constants import RT_ALLPROP, RT_PROPNAME, RT_PROP
 from .errors import DAV_Error, DAV_NotFound
 
 log = logging.getLogger(__name__)
 
+MULTISTATUS_START = b'<?xml version="1.0" encoding="utf-8"?><D:multistatus xmlns:D="DAV:">'
+MULTISTATUS_END = b'</D:multistatus>\n'
+
+# number of resources whose properties are fetched with one
+# get_props() call of the interface class
+PROPS_BATCH_SIZE = 100
+
 
 class PROPFIND:
     """ parse a propfind xml element and extract props
@@ -58,6 +67,12 @@ class PROPFIND:
         If we get an ALLPROP we first get the list of properties and then
         we do the same as with a PROP method.
 
+        The response of the requested resource is generated before
+        the document is returned, thus an error of that resource is
+        still raised here and can become the status of the response.
+        Errors of the other resources become a <status> of their
+        <response>.
+
         """
 
         # check if resource exists
@@ -74,49 +89,32 @@ class PROPFIND:
         if self.request_type == RT_PROP:
             df = self.create_prop()
 
-        if df is not None:
-            return df
+        if df is None:
+            # no body means ALLPROP!
+            df = self.create_allprop()
 
-        # no body means ALLPROP!
-        df = self.create_allprop()
-        return df
+        # the start of the document and the first <response>
+        head = [next(df), next(df)]
+        return itertools.chain(head, df)
 
     def create_propname(self):
-        """ create a multistatus response for the prop names """
+        """ create a multistatus response for the prop names
+
+        The response is generated lazily, see create_prop().
 
+        """
         dc = self._dataclass
-        # create the document generator
-        doc = domimpl.createDocument(None, "multistatus", None)
-        ms = doc.documentElement
-        ms.setAttribute("xmlns:D", "DAV:")
-        ms.tagName = 'D:multistatus'
-
-        if self._depth == "0":
-            pnames = dc.get_propnames(self._uri)
-            re = self.mk_propname_response(self._uri, pnames, doc)
-            ms.appendChild(re)
-
-        elif self._depth == "1":
-            pnames = dc.get_propnames(self._uri)
-            re = self.mk_propname_response(self._uri, pnames, doc)
-            ms.appendChild(re)
-
-            for newuri in dc.get_childs(self._uri):
-                pnames = dc.get_propnames(newuri)
-                re = self.mk_propname_response(newuri, pnames, doc)
-                ms.appendChild(re)
-        elif self._depth == 'infinity':
-            uri_list = [self._uri]
-            while uri_list:
-                uri = uri_list.pop()
+        yield MULTISTATUS_START
+        for uri, info in self.get_uris():
+            try:
                 pnames = dc.get_propnames(uri)
-                re = self.mk_propname_response(uri, pnames, doc)
-                ms.appendChild(re)
-                uri_childs = self._dataclass.get_childs(uri)
-                if uri_childs:
-                    uri_list.extend(uri_childs)
-
-        return doc.toxml(encoding="utf-8") + b"\n"
+            except DAV_Error as error:
+                if uri == self._uri:
+                    raise
+                yield self.mk_status_response(uri, error.args[0])
+                continue
+            yield self.mk_propname_response(uri, pnames)
+        yield MULTISTATUS_END
 
     def create_allprop(self):
         """ return a list of all properties """
@@ -139,93 +137,141 @@ class PROPFIND:
            (which is dependant on the Depth header)
            This is done by the get_propvalues() method.
 
-        3. For each URI call the append_result() method
-           to append the actual <result>-Tag to the result
-           document.
+        3. For each URI call the mk_prop_response() method
+           to serialize the actual <response>-Tag.
+
+        The property values are fetched in batches of URIs with the
+        get_props() method of the interface class.
 
         We differ between "good" properties, which have been
         assigned a value by the interface class and "bad"
         properties, which resulted in an error, either 404
         (Not Found) or 403 (Forbidden).
 
+        The document is returned as a generator which yields the
+        serialized <response> of each resource as soon as its
+        properties are known, so the response can be streamed
+        without building the whole tree in memory.
+
         """
-        # create the document generator
-        doc = domimpl.createDocument(None, "multistatus", None)
-        ms = doc.documentElement
-        ms.setAttribute("xmlns:D", "DAV:")
-        ms.tagName = 'D:multistatus'
-
-        if self._depth == "0":
-            gp, bp = self.get_propvalues(self._uri)
-            res = self.mk_prop_response(self._uri, gp, bp, doc)
-            ms.appendChild(res)
-
-        elif self._depth == "1":
-            gp, bp = self.get_propvalues(self._uri)
-            res = self.mk_prop_response(self._uri, gp, bp, doc)
-            ms.appendChild(res)
-
-            for newuri in self._dataclass.get_childs(self._uri):
-                gp, bp = self.get_propvalues(newuri)
-                res = self.mk_prop_response(newuri, gp, bp, doc)
-                ms.appendChild(res)
-        elif self._depth == 'infinity':
-            uri_list = [self._uri]
-            while uri_list:
-                uri = uri_list.pop()
-                gp, bp = self.get_propvalues(uri)
-                res = self.mk_prop_response(uri, gp, bp, doc)
-                ms.appendChild(res)
-                uri_childs = self._dataclass.get_childs(uri)
-                if uri_childs:
-                    uri_list.extend(uri_childs)
-
-        return doc.toxml(encoding="utf-8") + b"\n"
-
-    def mk_propname_response(self, uri, propnames, doc):
-        """ make a new <prop> result element for a PROPNAME request
+        yield MULTISTATUS_START
+        uris = []
+        infos = {}
+        for uri, info in self.get_uris():
+            uris.append(uri)
+            if info is not None:
+                infos[uri] = info
+            if len(uris) >= PROPS_BATCH_SIZE:
+                for res in self.mk_prop_responses(uris, infos):
+                    yield res
+                uris = []
+                infos = {}
+
+        for res in self.mk_prop_responses(uris, infos):
+            yield res
+        yield MULTISTATUS_END
+
+    def mk_prop_responses(self, uris, infos=None):
+        """ fetch the properties of a batch of URIs and serialize them """
+        if not uris:
+            return
 
-        This will simply format the propnames list.
-        propnames should have the format {NS1 : [prop1, prop2, ...], NS2: ...}
+        dc = self._dataclass
+        try:
+            values = dc.get_props(uris, self.proplist, infos)
+        except DAV_Error:
+            if len(uris) == 1 and uris[0] == self._uri:
+                raise
+            # find the resources which failed
+            values = {}
+            for uri in uris:
+                try:
+                    values.update(dc.get_props([uri], self.proplist, infos))
+                except DAV_Error as error:
+                    if uri == self._uri:
+                        raise
+                    values[uri] = error
+
+        for uri in uris:
+            if isinstance(values[uri], DAV_Error):
+                yield self.mk_status_response(uri, values[uri].args[0])
+                continue
+            gp, bp = self.sort_propvalues(values[uri])
+            yield self.mk_prop_response(uri, gp, bp)
+
+    def get_uris(self):
+        """ yield (uri, info) for the resources the request applies to
+
+        Which resources these are depends on the Depth header.
+        info is the data returned by get_childs_info() of the
+        interface class (None for the requested resource itself).
 
         """
-        re = doc.createElement("D:response")
-
+        dc = self._dataclass
+        if self._depth == 'infinity':
+            for uri, iscol, info in utils.walk_tree(
+                    dc, self._uri, onerror=self._listing_failed):
+                yield uri, info
+            return
+
+        visit()
+        yield self._uri, None
+
+        if self._depth == "1":
+            for newuri, iscol, info in dc.get_childs_info(self._uri):
+                visit()
+                yield newuri, info
+
+    def _listing_failed(self, uri, error):
+        """ the members of a collection below the requested one could
+        not be listed, they are left out """
+        if uri == self._uri:
+            raise error
+        log.warning('PROPFIND: cannot list %s: %s' % (uri, error))
+
+    def mk_href(self, uri):
+        """ return the serialized <href> element of an URI """
         if self._dataclass.baseurl:
             uri = self._dataclass.baseurl + '/' + '/'.join(uri.split('/')[3:])
 
-        # write href information
         uparts = urllib.parse.urlparse(uri)
         fileloc = uparts[2]
-        href = doc.createElement("D:href")
+        href = (uparts[0] + '://' + '/'.join(uparts[1:2]) +
+                urllib.parse.quote(fileloc))
+        return '<D:href>%s</D:href>' % escape(href)
+
+    def mk_status_response(self, uri, ecode):
+        """ make a <response> element with the status of a resource
+        whose properties could not be read """
+        return ('<D:response>%s<D:status>%s</D:status></D:response>' %
+                (self.mk_href(uri), utils.gen_estring(ecode))).encode('utf-8')
 
-        huri = doc.createTextNode(uparts[0] + '://' +
-                                  '/'.join(uparts[1:2]) +
-                                  urllib.parse.quote(fileloc))
-        href.appendChild(huri)
-        re.appendChild(href)
+    def mk_propname_response(self, uri, propnames):
+        """ make a new <prop> result element for a PROPNAME request
+
+        This will simply format the propnames list.
+        propnames should have the format {NS1 : [prop1, prop2, ...], NS2: ...}
 
-        ps = doc.createElement("D:propstat")
+        """
+        out = ['<D:response>', self.mk_href(uri), '<D:propstat>']
         nsnum = 0
 
         for ns, plist in propnames.items():
             # write prop element
-            pr = doc.createElement("D:prop")
             nsp = "ns" + str(nsnum)
-            pr.setAttribute("xmlns:" + nsp, ns)
+            out.append('<D:prop xmlns:%s=%s>' % (nsp, quoteattr(ns)))
             nsnum += 1
 
             # write propertynames
             for p in plist:
-                pe = doc.createElement(nsp + ":" + p)
-                pr.appendChild(pe)
+                out.append('<%s:%s/>' % (nsp, p))
 
-            ps.appendChild(pr)
-        re.appendChild(ps)
+            out.append('</D:prop>')
+        out.append('</D:propstat></D:response>')
 
-        return re
+        return ''.join(out).encode('utf-8')
 
-    def mk_prop_response(self, uri, good_props, bad_props, doc):
+    def mk_prop_response(self, uri, good_props, bad_props):
         """ make a new <prop> result element
 
         We differ between the good props and the bad ones for
@@ -233,93 +279,62 @@ class PROPFIND:
         one, that means).
 
         """
-        re = doc.createElement("D:response")
+        out = ['<D:response']
         # append namespaces to response
         nsnum = 0
         for nsname in self.namespaces:
             if nsname != 'DAV:':
-                re.setAttribute("xmlns:ns" + str(nsnum), nsname)
+                out.append(' xmlns:ns%d=%s' % (nsnum, quoteattr(nsname)))
             nsnum += 1
-
-        if self._dataclass.baseurl:
-            uri = self._dataclass.baseurl + '/' + '/'.join(uri.split('/')[3:])
+        out.append('>')
 
         # write href information
-        uparts = urllib.parse.urlparse(uri)
-        fileloc = uparts[2]
-        href = doc.createElement("D:href")
-
-        huri = doc.createTextNode(uparts[0] + '://' +
-                                  '/'.join(uparts[1:2]) +
-                                  urllib.parse.quote(fileloc))
-        href.appendChild(huri)
-        re.appendChild(href)
+        out.append(self.mk_href(uri))
 
         # write good properties
-        ps = doc.createElement("D:propstat")
-        if good_props:
-            re.appendChild(ps)
-
-        gp = doc.createElement("D:prop")
+        out.append('<D:propstat><D:prop>')
         for ns in good_props.keys():
-            if ns != 'DAV:':
-                ns_prefix = "ns" + str(self.namespaces.index(ns)) + ":"
-            else:
-                ns_prefix = 'D:'
+            ns_prefix = self._ns_prefix(ns)
             for p, v in good_props[ns].items():
-
-                pe = doc.createElement(ns_prefix + str(p))
+                tag = ns_prefix + str(p)
                 if isinstance(v, xml.dom.minidom.Element):
-                    pe.appendChild(v)
+                    value = v.toxml()
                 elif isinstance(v, list):
-                    for val in v:
-                        pe.appendChild(val)
+                    value = ''.join(val.toxml() for val in v)
+                elif p == "resourcetype":
+                    value = v == 1 and '<D:collection/>' or ''
                 else:
-                    if p == "resourcetype":
-                        if v == 1:
-                            ve = doc.createElement("D:collection")
-                            pe.appendChild(ve)
-                    else:
-                        ve = doc.createTextNode(v)
-                        pe.appendChild(ve)
+                    value = escape(str(v), {'"': '&quot;'})
 
-                gp.appendChild(pe)
+                if value:
+                    out.append('<%s>%s</%s>' % (tag, value, tag))
+                else:
+                    out.append('<%s/>' % tag)
 
-        ps.appendChild(gp)
-        s = doc.createElement("D:status")
-        t = doc.createTextNode("HTTP/1.1 200 OK")
-        s.appendChild(t)
-        ps.appendChild(s)
-        re.appendChild(ps)
+        out.append('</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>')
 
         # now write the errors!
-        if len(list(bad_props.items())):
-
-            # write a propstat for each error code
-            for ecode in bad_props.keys():
-                ps = doc.createElement("D:propstat")
-                re.appendChild(ps)
-                bp = doc.createElement("D:prop")
-                ps.appendChild(bp)
-
-                for ns in bad_props[ecode].keys():
-                    if ns != 'DAV:':
-                        ns_prefix = "ns" + str(self.namespaces.index(ns)) + ":"
-                    else:
-                        ns_prefix = 'D:'
+        # (a propstat for each error code)
+        for ecode in bad_props.keys():
+            out.append('<D:propstat><D:prop>')
+
+            for ns in bad_props[ecode].keys():
+                ns_prefix = self._ns_prefix(ns)
+                for p in bad_props[ecode][ns]:
+                    out.append('<%s%s/>' % (ns_prefix, p))
 
-                    for p in bad_props[ecode][ns]:
-                        pe = doc.createElement(ns_prefix + str(p))
-                        bp.appendChild(pe)
+            out.append('</D:prop><D:status>%s</D:status></D:propstat>' %
+                       utils.gen_estring(ecode))
 
-                s = doc.createElement("D:status")
-                t = doc.createTextNode(utils.gen_estring(ecode))
-                s.appendChild(t)
-                ps.appendChild(s)
-                re.appendChild(ps)
+        out.append('</D:response>')
 
         # return the new response element
-        return re
+        return ''.join(out).encode('utf-8')
+
+    def _ns_prefix(self, ns):
+        if ns == 'DAV:':
+            return 'D:'
+        return "ns" + str(self.namespaces.index(ns)) + ":"
 
     def get_propvalues(self, uri):
         """ create lists of property values for an URI
@@ -329,21 +344,28 @@ class PROPFIND:
         only got an error, either because they haven't been
         found or the user is not allowed to read them.
 
+        """
+        values = self._dataclass.get_props([uri], self.proplist)
+        return self.sort_propvalues(values[uri])
+
+    def sort_propvalues(self, values):
+        """ split the result of get_props() for one URI
+
+        returns the good properties as {ns: {prop: value}} and the
+        bad ones as {error_code: {ns: [prop, ...]}}
+
         """
         good_props = {}
         bad_props = {}
 
-        ddc = self._dataclass
-        for ns, plist in self.proplist.items():
+        for ns, pvalues in values.items():
             good_props[ns] = {}
-            for prop in plist:
-                ec = 0
-                try:
-                    r = ddc.get_prop(uri, ns, prop)
+            for prop, r in pvalues.items():
+                if not isinstance(r, DAV_Error):
                     good_props[ns][prop] = r
-                except DAV_Error as error_code:
-                    ec = error_code.args[0]
+                    continue
 
+                ec = r.args[0]
                 # ignore props with error_code if 0 (invisible)
                 if ec == 0:
                     continue
@@ -0,0 +1,247 @@
+"""
+
+SQLite lock backend
+
+Keeps the locks in an SQLite database in WAL mode, thus several
+server processes on one host share their locks and the locks survive
+a restart of the server. Use it with
+
+    locks.set_lock_table(SQLiteLockTable('/var/lib/pywebdav/locks.db'))
+
+or the lock_backend and lock_database options of the server.
+
+"""
+
+from __future__ import absolute_import
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+from .locks import LockItem, _segments
+
+log = logging.getLogger(__name__)
+
+# expired locks are deleted from the database at most this often
+# (they are never returned by a query anyway)
+CLEANUP_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locks (
+    token       TEXT PRIMARY KEY,
+    uri         TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    depth       TEXT NOT NULL,
+    creator     TEXT,
+    owner       TEXT,
+    locktype    TEXT,
+    lockscope   TEXT,
+    timeout     INTEGER,
+    modified    REAL NOT NULL,
+    expires     REAL
+);
+CREATE INDEX IF NOT EXISTS locks_path ON locks (path);
+CREATE INDEX IF NOT EXISTS locks_expires ON locks (expires);
+"""
+
+COLUMNS = ('token, uri, path, depth, creator, owner, locktype, lockscope, '
+           'timeout, modified, expires')
+
+VALID = '(expires IS NULL OR expires > ?)'
+
+
+def _path(uri):
+    """ return the normalized path of an URI as stored in the table """
+    segs = _segments(uri)
+    if not segs:
+        return '/'
+    return '/' + '/'.join(segs) + '/'
+
+
+def _ancestors(uri):
+    """ return the paths of uri and all its parents """
+    paths = ['/']
+    for seg in _segments(uri):
+        paths.append(paths[-1] + seg + '/')
+    return paths
+
+
+class SQLiteLockTable(object):
+    """ lock backend storing the locks in an SQLite database
+
+    Every thread uses its own connection. The results of lookups are
+    cached per connection until the database is changed, which is
+    detected with PRAGMA data_version for the changes of other
+    connections (and processes). Within a request (see
+    begin_request()) this is checked by the first lookup only.
+
+    acquire() checks for conflicting locks and adds the lock in one
+    transaction, thus two processes cannot both get a lock.
+
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        self._last_cleanup = 0
+        self._connect()
+        log.info('Using lock database %s' % database)
+
+    def __len__(self):
+        conn = self._connect()
+        return conn.execute('SELECT COUNT(*) FROM locks WHERE ' + VALID,
+                            (time.time(),)).fetchone()[0]
+
+    ### internal helpers
+
+    def _connect(self):
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        # a connection must not be used by a forked child
+        if conn is None or local.pid != os.getpid():
+            conn = sqlite3.connect(self.database, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            local.conn = conn
+            local.pid = os.getpid()
+            local.cache = {}
+            local.version = None
+            local.checked = False
+            local.in_request = False
+        return conn
+
+    def _lock(self, row):
+        token, uri, path, depth, creator, owner, locktype, lockscope, \
+            timeout, modified, expires = row
+        lock = LockItem(uri, creator, owner, depth=depth,
+                        timeout=timeout is None and 'Infinite' or timeout,
+                        locktype=locktype, lockscope=lockscope, token=token)
+        lock.modified = modified
+        return lock
+
+    def _select(self, conn, sql, args):
+        rows = conn.execute('SELECT %s FROM locks WHERE %s AND %s' % (
+            COLUMNS, sql, VALID), args + (time.time(),))
+        return [self._lock(row) for row in rows]
+
+    def _query(self, key, sql, args):
+        """ return the (cached) locks selected by sql """
+        conn = self._connect()
+        local = self._local
+
+        if not local.checked:
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != local.version:
+                local.cache.clear()
+                local.version = version
+            local.checked = local.in_request
+
+        locks = local.cache.get(key)
+        if locks is None:
+            locks = local.cache[key] = self._select(conn, sql, args)
+
+        # cached locks may have expired meanwhile
+        return [l for l in locks if l.isValid()]
+
+    def _cleanup(self, conn, now):
+        if now - self._last_cleanup > CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            cur = conn.execute('DELETE FROM locks WHERE expires <= ?', (now,))
+            if cur.rowcount:
+                log.info('Removed %d expired locks' % cur.rowcount)
+
+    def _write(self, sql, args):
+        conn = self._connect()
+        with conn:
+            conn.execute(sql, args)
+            self._cleanup(conn, time.time())
+
+        # our own changes do not show up in data_version
+        self._local.cache.clear()
+
+    def _insert(self, lock):
+        timeout = lock.timeout
+        if timeout == 'Infinite':
+            timeout = None
+        return ('INSERT INTO locks (%s) VALUES (?,?,?,?,?,?,?,?,?,?,?)'
+                % COLUMNS,
+                (lock.token, lock.uri, _path(lock.uri), str(lock.depth),
+                 lock.creator, lock.getOwnerXML(), lock.locktype,
+                 lock.lockscope, timeout, lock.modified, lock.expires()))
+
+    def _covering_sql(self, uri):
+        paths = _ancestors(uri)
+        return ("path IN (%s) AND (depth = 'infinity' OR path = ?)" %
+                ','.join('?' * len(paths)), tuple(paths) + (paths[-1],))
+
+    ### public interface, see locks.LockTable
+
+    def begin_request(self):
+        self._connect()
+        self._local.checked = False
+        self._local.in_request = True
+
+    def end_request(self):
+        self._local.checked = False
+        self._local.in_request = False
+
+    def add(self, lock):
+        self._write(*self._insert(lock))
+
+    def acquire(self, lock):
+        conn = self._connect()
+        # the write lock of the database is taken before the check
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            locks = self._select(conn, *self._covering_sql(lock.uri))
+            if lock.depth == 'infinity':
+                locks.extend(self._select(conn, *self._below(lock.uri)))
+            conflicts = [l for l in locks if lock.conflicts(l)]
+            if not conflicts:
+                conn.execute(*self._insert(lock))
+                self._cleanup(conn, time.time())
+
+        self._local.cache.clear()
+        return conflicts
+
+    def remove(self, token):
+        lock = self.get(token)
+        if lock is not None:
+            self._write('DELETE FROM locks WHERE token = ?', (token,))
+        return lock
+
+    def refresh(self, lock, timeout):
+        lock.setTimeout(timeout)
+        if timeout == 'Infinite':
+            timeout = None
+        self._write('UPDATE locks SET timeout = ?, modified = ?, expires = ? '
+                    'WHERE token = ?',
+                    (timeout, lock.modified, lock.expires(), lock.token))
+
+    def get(self, token):
+        locks = self._query(('get', token), 'token = ?', (token,))
+        return locks and locks[0] or None
+
+    def covering(self, uri):
+        sql, args = self._covering_sql(uri)
+        locks = self._query(('covering', args[-1]), sql, args)
+
+        # the nearest ones first
+        return sorted(locks, key=lambda l: -len(_path(l.uri)))
+
+    def _below(self, uri):
+        # all paths starting with prefix, '0' follows '/'
+        prefix = _path(uri)
+        return 'path > ? AND path < ?', (prefix, prefix[:-1] + '0')
+
+    def below(self, uri):
+        sql, args = self._below(uri)
+        return self._query(('below', args[0]), sql, args)
+
+    def has_below(self, uri):
+        sql, args = self._below(uri)
+        conn = self._connect()
+        return conn.execute('SELECT 1 FROM locks WHERE %s AND %s LIMIT 1' % (
+            sql, VALID), args + (time.time(),)).fetchone() is not None
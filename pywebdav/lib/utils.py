@@ -2,10 +2,13 @@ from __future__ import absolute_import
 import time
 import re
 import os
+import email.utils
 
 from xml.dom import minidom
 from six.moves import urllib
 from .constants import RT_ALLPROP, RT_PROPNAME, RT_PROP
+from .metrics import visit
+from .errors import DAV_Error
 from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
 
 def gen_estring(ecode):
@@ -48,6 +51,57 @@ def parse_propfind(xml_doc):
     return request_type,props,namespaces
 
 
+def walk_tree(dataclass, uri, post_order=False, prune=None, onerror=None):
+    """ yield (uri, is_collection, info) for uri and the resources below it
+
+    In pre-order (the default) a collection comes before its members,
+    that is the order to copy a tree, in post-order after them, that
+    is the order to delete it. info is what get_childs_info() of the
+    dataclass returned for the resource (None for uri itself).
+
+    prune(uri) is called before the members of a collection are
+    listed, they are skipped if it returns True. In pre-order the
+    collection was already yielded, thus a caller can prune the
+    subtree of a collection it failed to copy.
+
+    If onerror is given, a DAV_Error raised while listing the members
+    of a collection is passed to onerror(uri, error) and the members
+    are skipped, otherwise it is raised.
+
+    Only the path to the current resource and the pending members of
+    its parents are kept in memory.
+
+    """
+    # items are (uri, is_collection, info, members_listed)
+    stack=[(uri, dataclass.is_collection(uri), None, False)]
+    while stack:
+        element, iscol, info, listed = stack.pop()
+
+        if not iscol or listed:
+            visit()
+            yield element, iscol, info
+            continue
+
+        if post_order:
+            stack.append((element, iscol, info, True))
+        else:
+            visit()
+            yield element, iscol, info
+
+        if prune is not None and prune(element):
+            continue
+
+        # reversed as the stack is taken from the end
+        try:
+            childs=list(dataclass.get_childs_info(element))
+        except DAV_Error as error:
+            if onerror is None:
+                raise
+            onerror(element, error)
+            continue
+        for child, childcol, childinfo in reversed(childs):
+            stack.append((child, childcol, childinfo, False))
+
 def create_treelist(dataclass,uri):
     """ create a list of resources out of a tree
 
@@ -58,27 +112,23 @@ def create_treelist(dataclass,uri):
     It will return the flattened tree as list
 
     """
-    queue=[uri]
-    list=[uri]
-    while len(queue):
-        element=queue[-1]
-        if dataclass.is_collection(element):
-            childs=dataclass.get_childs(element)
-        else:
-            childs=[]
-        if len(childs):
-            list=list+childs
-        # update queue
-        del queue[-1]
-        if len(childs):
-            queue=queue+childs
-    return list
+    return [element for element, iscol, info in walk_tree(dataclass, uri)]
+
+def create_treeinfo(dataclass,uri):
+    """ create a list of (uri, is_collection) tuples out of a tree
+
+    Same as create_treelist() but with the type of the resources,
+    see walk_tree() for a walk which does not build the list.
+
+    """
+    return [(element, iscol) for element, iscol, info
+            in walk_tree(dataclass, uri)]
 
 def is_prefix(uri1,uri2):
     """ returns True if uri1 is a prefix of uri2 """
     path1 = urllib.parse.urlparse(uri1).path
     path2 = urllib.parse.urlparse(uri2).path
-    return os.path.commonpath([path1, path2]) == path1
+    return os.path.commonpath([path1, path2]) == os.path.normpath(path1)
 
 def quote_uri(uri):
     """ quote an URL but not the protocol part """
@@ -111,9 +161,9 @@ def make_xmlresponse(result):
     doc.documentElement.tagName = "D:multistatus"
 
     for el,ec in result.items():
-        re=doc.createElementNS("DAV:","response")
-        hr=doc.createElementNS("DAV:","href")
-        st=doc.createElementNS("DAV:","status")
+        re=doc.createElementNS("DAV:","D:response")
+        hr=doc.createElementNS("DAV:","D:href")
+        st=doc.createElementNS("DAV:","D:status")
         huri=doc.createTextNode(quote_uri(el))
         t=doc.createTextNode(gen_estring(ec))
         st.appendChild(t)
@@ -160,6 +210,125 @@ def rfc850_date(ts=None):
             str(year)[2:],
             hh, mm, ss)
 
+def parse_http_date(value):
+    """ return the timestamp of an HTTP-date or None if it is invalid """
+    if not value:
+        return None
+    try:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        # parsedate_tz() does not check the fields, mktime_tz() would
+        # carry over e.g. day 99 into the next months
+        year, month, day, hh, mm, ss = date[:6]
+        if not (1 <= month <= 12 and 1 <= day <= 31 and
+                0 <= hh <= 23 and 0 <= mm <= 59 and 0 <= ss <= 60):
+            return None
+        return email.utils.mktime_tz(date)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+# a Range header with more ranges is ignored
+MAX_RANGES = 100
+
+def parse_byte_ranges(header, size):
+    """ parse the byte ranges of a Range header (RFC 7233)
+
+    Returns a sorted list of (start, end) tuples, end being exclusive,
+    in which overlapping and adjacent ranges have been coalesced. An
+    empty list means that none of the ranges can be satisfied, None
+    that the header has to be ignored: it is invalid, has more than
+    MAX_RANGES ranges or several ranges which cover the whole resource.
+
+    """
+    unit, sep, specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+
+    ranges = []
+    count = 0
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+
+        first, sep, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or first == '') or \
+                not (last.isdigit() or last == ''):
+            return None
+        count += 1
+        if count > MAX_RANGES:
+            return None
+
+        if first == '':
+            # suffix range: the last bytes of the resource
+            if last == '':
+                return None
+            start = max(0, size - int(last))
+            end = size
+        else:
+            start = int(first)
+            end = size if last == '' else int(last) + 1
+            if end <= start and last != '':
+                return None
+            end = min(end, size)
+
+        if start < end:
+            ranges.append((start, end))
+
+    if not count:
+        return None
+
+    ranges.sort()
+    result = []
+    for start, end in ranges:
+        if result and start <= result[-1][1]:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((start, end))
+
+    # e.g. bytes=0-,0-,... which would send the resource many times
+    # as multipart/byteranges, the whole resource is sent once instead
+    if count > 1 and result == [(0, size)]:
+        return None
+    return result
+
+def etag_matches(header, etag, weak=True):
+    """ test if one of the entity tags of an If-(None-)Match header
+    matches etag
+
+    With weak comparison the W/ prefix is ignored, with strong
+    comparison weak tags never match. '*' matches any existing etag.
+
+    """
+    if etag is None:
+        return False
+
+    if weak:
+        etag = etag[2:] if etag.startswith('W/') else etag
+    elif etag.startswith('W/'):
+        return False
+
+    for match in header.split(','):
+        match = match.strip()
+        if match == '*':
+            return True
+        if match.startswith('W/'):
+            if not weak:
+                continue
+            match = match[2:]
+        if match == etag:
+            return True
+
+    return False
+
+def gzip_etag(etag):
+    """ return the entity tag of the gzip encoded variant of etag """
+    if etag.endswith('"'):
+        return etag[:-1] + '-gzip"'
+    return etag + '-gzip'
+
 ### If: header handling support.  IfParser returns a sequence of
 ### TagList objects in the order they were parsed which can then
 ### be used in WebDAV methods to decide whether an operation can
@@ -177,6 +346,8 @@ class TagList:
         self.resource = None
         self.list = []
         self.NOTTED = 0
+        # (notted, listitem) for every condition of the list
+        self.conditions = []
 
 def IfParser(hdr):
     out = []
@@ -192,6 +363,8 @@ def IfParser(hdr):
             tag.resource = tag.resource[1:-1]
         listitem = m.group('listitem')
         tag.NOTTED, tag.list = ListParser(listitem)
+        tag.conditions = [(bool(c.group('not')), c.group('listitem'))
+                          for c in ListItem.finditer(listitem)]
         out.append(tag)
 
     return out
@@ -0,0 +1,336 @@
+"""
+    WSGI adapter
+
+    Runs the methods of a DAVRequestHandler class (and its interface
+    class) as a WSGI application, thus PyWebDAV can be served by any
+    WSGI server. The request is handed to the handler like it was read
+    from a socket, the response is collected from the handler and
+    given back to the server as an iterable:
+
+    - chunked bodies (e.g. PROPFIND multistatus documents) are streamed
+      from their generators while the server sends them
+    - file bodies are given to wsgi.file_wrapper where possible so
+      that the server can use sendfile(), else they are read piece by
+      piece
+
+    The framing of the messages (chunked transfer coding, persistent
+    connections, 100 Continue) is done by the WSGI server.
+
+"""
+
+from __future__ import absolute_import
+import io
+import os
+import tempfile
+import logging
+
+from six.moves import urllib
+from six.moves import http_client
+
+from . import AuthServer
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = 128 * 1000
+
+# request bodies without a Content-Length (chunked ones) are read
+# before the request is handled, they are kept in memory up to
+# this size and in a temporary file beyond
+SPOOL_SIZE = 1024 * 1024
+
+# headers concerning the connection, they are up to the WSGI server
+HOP_BY_HOP = ('connection', 'keep-alive', 'proxy-authenticate',
+              'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
+              'upgrade', 'expect')
+
+
+class _RequestReader(object):
+    """ rfile of a handler: the rebuilt request head, then the body """
+
+    def __init__(self, head, body):
+        self._head = io.BytesIO(head)
+        self._body = body
+
+    def readline(self, limit=-1):
+        line = self._head.readline(limit)
+        if line:
+            return line
+        if limit is None or limit < 0:
+            return self._body.readline()
+        return self._body.readline(limit)
+
+    def read(self, size=-1):
+        data = self._head.read(size)
+        if data:
+            return data
+        if size is None or size < 0:
+            return self._body.read()
+        return self._body.read(size)
+
+    def close(self):
+        pass
+
+
+class _FileSegment(object):
+    """ count bytes of a file starting at offset
+
+    The file descriptor is duplicated as the handler closes its file
+    right after it was "sent".
+
+    """
+
+    def __init__(self, fp, offset, count):
+        self.fp = os.fdopen(os.dup(fp.fileno()), 'rb')
+        self.offset = offset
+        self.count = count
+        self._left = None
+
+    def to_eof(self):
+        return self.offset + self.count == os.fstat(self.fp.fileno()).st_size
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def read(self, size=-1):
+        if self._left is None:
+            self.fp.seek(self.offset)
+            self._left = self.count
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self.fp.read(size)
+        self._left -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(BUFFER_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.fp.close()
+
+
+class _ResponseWriter(object):
+    """ wfile of a handler, it collects the parts of the body
+
+    A part is either bytes or an iterable (a chunked body or a file
+    segment) which is consumed when the response is sent.
+
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        if data:
+            self.parts.append(bytes(data))
+
+    def add(self, part):
+        self.parts.append(part)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+    """ stands in for the socket of a handler """
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def sendfile(self, fp, offset=0, count=None):
+        if count is None:
+            count = os.fstat(fp.fileno()).st_size - offset
+        self._writer.add(_FileSegment(fp, offset, count))
+        return count
+
+
+class _Response(object):
+    """ the iterable returned to the WSGI server """
+
+    def __init__(self, handler, parts):
+        self._handler = handler
+        self._parts = parts
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            for buf in part:
+                if buf:
+                    yield buf
+
+    def close(self):
+        for part in self._parts:
+            if hasattr(part, 'close'):
+                part.close()
+        self._parts = []
+        self._handler.end_wsgi_request()
+
+
+class WSGIRequestHandlerMixin(object):
+    """ mixed into a DAVRequestHandler class by DAVApplication
+
+    It keeps the status and the headers of the response instead of
+    writing them and defers the end of the request until the body
+    was sent (a multistatus document is generated while it is sent).
+
+    """
+
+    def send_response_only(self, code, message=None):
+        if code < 200:
+            # interim responses are up to the WSGI server
+            return
+        if not message:
+            message = (self.responses.get(code, ('',))[0] or
+                       http_client.responses.get(code, ''))
+        self.wsgi_status = '%d %s' % (code, message)
+        self.wsgi_headers = []
+
+    def send_header(self, keyword, value):
+        if self.wsgi_status is None:
+            return
+        name = keyword.lower()
+        if name in HOP_BY_HOP:
+            return
+        if name == 'date' and any(k.lower() == 'date'
+                                  for k, v in self.wsgi_headers):
+            return
+        self.wsgi_headers.append((str(keyword), str(value)))
+
+    def end_headers(self):
+        pass
+
+    def send_connection_header(self):
+        pass
+
+    def write_chunks(self, pieces):
+        # no chunked transfer coding here, the server streams the pieces
+        self.wfile.add(pieces)
+
+    def log_message(self, format, *args):
+        self.wsgi_errors.write('%s - - [%s] %s\n' % (
+            self.address_string(), self.log_date_time_string(),
+            format % args))
+
+    def address_string(self):
+        return self.client_address[0]
+
+    def handle_one_request(self):
+        self._begin_request()
+        try:
+            AuthServer.AuthRequestHandler.handle_one_request(self)
+        except Exception:
+            self.end_wsgi_request()
+            raise
+
+    def end_wsgi_request(self):
+        """ called when the response was sent """
+        self._end_request()
+
+
+class DAVApplication(object):
+    """ WSGI application running a DAVRequestHandler class
+
+    handler_class must be set up like for a server (IFACE_CLASS,
+    _config, ...). The application should be mounted at the root of
+    the URL space, else the baseurl option has to be set so that the
+    PROPFIND responses carry the correct URLs.
+
+    """
+
+    def __init__(self, handler_class):
+        self.handler_class = type('WSGI' + handler_class.__name__,
+                                  (WSGIRequestHandlerMixin, handler_class),
+                                  {})
+
+    def __call__(self, environ, start_response):
+        body, length = self._request_body(environ)
+        head = self._request_head(environ, length)
+
+        writer = _ResponseWriter()
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.request = None
+        handler.client_address = (environ.get('REMOTE_ADDR', ''),
+                                  int(environ.get('REMOTE_PORT') or 0))
+        handler.rfile = _RequestReader(head, body)
+        handler.wfile = writer
+        handler.connection = _Connection(writer)
+        handler.close_connection = True
+        handler._requests_handled = 0
+        handler.wsgi_status = None
+        handler.wsgi_headers = []
+        handler.wsgi_errors = environ['wsgi.errors']
+
+        handler.handle_one_request()
+        if handler.wsgi_status is None:
+            handler.end_wsgi_request()
+            handler.wsgi_status = '500 Internal Server Error'
+
+        start_response(handler.wsgi_status, handler.wsgi_headers)
+
+        parts = writer.parts
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if (file_wrapper is not None and len(parts) == 1 and
+                isinstance(parts[0], _FileSegment) and parts[0].to_eof()):
+            # the server may send it with sendfile(), the file
+            # position is where the segment starts
+            handler.end_wsgi_request()
+            segment = parts[0]
+            segment.fp.seek(segment.offset)
+            return file_wrapper(segment, BUFFER_SIZE)
+
+        return _Response(handler, parts)
+
+    def _request_body(self, environ):
+        """ return the request body and its length (None if unknown) """
+        body = environ['wsgi.input']
+        length = environ.get('CONTENT_LENGTH')
+        if length:
+            return body, int(length)
+
+        chunked = environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked'
+        if not chunked and not environ.get('wsgi.input_terminated'):
+            return body, None
+
+        # the handler needs a Content-Length
+        spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        while True:
+            buf = body.read(BUFFER_SIZE)
+            if not buf:
+                break
+            spool.write(buf)
+        length = spool.tell()
+        spool.seek(0)
+        return spool, length or None
+
+    def _request_head(self, environ, length):
+        """ rebuild the request line and the headers """
+        path = urllib.parse.quote(
+            environ.get('PATH_INFO', '').encode('latin-1') or b'/',
+            safe="/;:@&=+$,!~*'()")
+        if environ.get('QUERY_STRING'):
+            path += '?' + environ['QUERY_STRING']
+
+        # the handler talks HTTP/1.1 to the WSGI server, whatever the
+        # client uses
+        lines = ['%s %s HTTP/1.1' % (environ['REQUEST_METHOD'], path)]
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').title()
+                if name.lower() in HOP_BY_HOP or name == 'Content-Length':
+                    continue
+                lines.append('%s: %s' % (name, value))
+        if environ.get('CONTENT_TYPE'):
+            lines.append('Content-Type: %s' % environ['CONTENT_TYPE'])
+        if length is not None:
+            lines.append('Content-Length: %d' % length)
+        lines.append('\r\n')
+        return '\r\n'.join(lines).encode('latin-1')
@@ -0,0 +1,341 @@
+"""
+    asyncio based server engine
+
+    An alternative to ThreadedHTTPServer which does not need a thread
+    per connection. The connections are handled by an asyncio event
+    loop, which reads the request head (and small request bodies)
+    without blocking. Only a complete request is given to one of a
+    bounded number of threads running the usual DAVRequestHandler,
+    thus idle keep-alive connections and slow clients cost no thread.
+
+    The handler talks to the connection through a socket like object
+    whose reads and writes are done by the event loop, bigger request
+    and response bodies are streamed that way.
+
+"""
+
+from __future__ import absolute_import
+import asyncio
+import concurrent.futures
+import logging
+import socket
+import threading
+
+log = logging.getLogger(__name__)
+
+# number of threads running request handlers
+EXECUTOR_THREADS = 32
+
+# request bodies up to this size are read by the event loop before
+# the request is handled, bigger ones are streamed
+PREREAD_SIZE = 64 * 1024
+
+# maximum size of a request head
+MAX_HEAD_SIZE = 64 * 1024
+
+# seconds to wait for a request if the handler has no keep-alive timeout
+REQUEST_TIMEOUT = 60
+
+BUFFER_SIZE = 128 * 1000
+
+ERROR_RESPONSE = ('HTTP/1.1 %d %s\r\n'
+                  'Content-Length: 0\r\n'
+                  'Connection: close\r\n\r\n')
+
+
+class HeadTooLong(ValueError):
+    """ the request line (414) or the header fields (431) are too long """
+
+    def __init__(self, code, reason):
+        ValueError.__init__(self, reason)
+        self.code = code
+        self.reason = reason
+
+
+class _LoopReader(object):
+    """ file like object reading from an asyncio StreamReader
+
+    It is used by a handler thread, the data which was already read by
+    the event loop is served first.
+
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._buf = bytearray()
+        self.closed = False
+
+    def feed(self, data):
+        self._buf += data
+
+    def _fill(self, size):
+        data = self._conn.call(self._conn.reader.read(min(size, BUFFER_SIZE)))
+        self._buf += data
+        return len(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill(BUFFER_SIZE):
+                pass
+            size = len(self._buf)
+        else:
+            # like a buffered file only return less at the end
+            while len(self._buf) < size and self._fill(size - len(self._buf)):
+                pass
+
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def readline(self, limit=-1):
+        while b'\n' not in self._buf and (limit < 0 or len(self._buf) < limit):
+            # not beyond the end of the line, the next request may follow
+            data = self._conn.call(_read_line(self._conn.reader))
+            if not data:
+                break
+            self._buf += data
+        end = self._buf.find(b'\n') + 1 or len(self._buf)
+
+        if 0 <= limit < end:
+            end = limit
+        data = bytes(self._buf[:end])
+        del self._buf[:end]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class _LoopConnection(object):
+    """ socket like object of a connection handled by the event loop """
+
+    def __init__(self, loop, reader, writer):
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+        self.timeout = None
+        self.rfile = _LoopReader(self)
+
+    def call(self, coro):
+        """ run coro in the event loop and wait for its result """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise socket.timeout('timed out')
+
+    async def _send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _sendfile(self, fp, offset, count):
+        await self.writer.drain()
+        await self.loop.sendfile(self.writer.transport, fp, offset, count)
+
+    ### the socket methods used by the handler
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setsockopt(self, *args):
+        pass
+
+    def makefile(self, mode='rb', bufsize=-1):
+        return self.rfile
+
+    def sendall(self, data):
+        self.call(self._send(bytes(data)))
+
+    def sendfile(self, fp, offset=0, count=None):
+        return self.call(self._sendfile(fp, offset, count))
+
+
+class AsyncHTTPServer(object):
+    """ HTTP server running the request handlers of an event loop
+
+    It has the serve_forever(), shutdown() and server_close() methods
+    of the socketserver classes, the socket is bound when the server
+    is created (so the prefork mode can share it).
+
+    """
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 threads=EXECUTOR_THREADS):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.threads = threads
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(socket.SOMAXCONN)
+        self.server_address = self.socket.getsockname()
+        self._loop = None
+        self._stopped = None
+        self._stopping = False
+        self._idle = set()      # writers of connections waiting for a request
+        self._done = threading.Event()
+
+    def serve_forever(self):
+        self._done.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._done.set()
+
+    def shutdown(self):
+        """ stop serve_forever(), must be called from another thread """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+            self._done.wait()
+
+    def server_close(self):
+        self.socket.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._stopping = False
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.threads, thread_name_prefix='DAVHandler')
+        server = await asyncio.start_server(self._connection,
+                                            sock=self.socket,
+                                            limit=MAX_HEAD_SIZE)
+        try:
+            await self._stopped.wait()
+        finally:
+            # no new connections and requests, close the idle connections
+            # and let the requests in progress finish (their I/O needs
+            # the loop, thus the executor is shut down in a thread)
+            server.close()
+            self._stopping = True
+            for writer in list(self._idle):
+                writer.close()
+            await self._loop.run_in_executor(None, self._executor.shutdown)
+            await server.wait_closed()
+            self._loop = None
+
+    async def _connection(self, reader, writer):
+        conn = _LoopConnection(self._loop, reader, writer)
+        client_address = writer.get_extra_info('peername')
+
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = conn
+        handler.client_address = client_address
+        handler.server = self
+        try:
+            handler.setup()
+            handler.close_connection = True
+            first = True
+            while first or not handler.close_connection:
+                # an idle connection waits here without a thread
+                self._idle.add(writer)
+                try:
+                    if not await self._read_request(conn, handler):
+                        break
+                finally:
+                    self._idle.discard(writer)
+                if self._stopping:
+                    break
+                first = False
+                await self._loop.run_in_executor(self._executor,
+                                                 handler.handle_one_request)
+            handler.finish()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            log.exception('Error handling request of %s' % (client_address,))
+        finally:
+            writer.close()
+
+    async def _read_request(self, conn, handler):
+        """ read the head (and a small body) of the next request """
+        timeout = handler.timeout or REQUEST_TIMEOUT
+        try:
+            head = await asyncio.wait_for(reader_head(conn.reader), timeout)
+        except HeadTooLong as ex:
+            log.info('Rejecting request of %s: %s' % (
+                conn.writer.get_extra_info('peername'), ex.reason))
+            conn.writer.write((ERROR_RESPONSE % (ex.code, ex.reason))
+                              .encode('ascii'))
+            await conn.writer.drain()
+            return False
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+        if not head:
+            return False
+        conn.rfile.feed(head)
+
+        length, expect = _body_info(head)
+        if 0 < length <= PREREAD_SIZE and not expect:
+            try:
+                body = await asyncio.wait_for(
+                    conn.reader.readexactly(length), timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                return False
+            conn.rfile.feed(body)
+        return True
+
+
+async def _read_line(reader):
+    """ read the rest of a line, at most the limit of the reader
+
+    Nothing beyond the end of the line is read, a longer line is
+    returned in pieces.
+
+    """
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as ex:
+        return ex.partial
+    except asyncio.LimitOverrunError as ex:
+        # the first ex.consumed bytes do not end the line
+        return await reader.read(max(ex.consumed, 1))
+
+
+async def reader_head(reader):
+    """ read a request head, empty lines in front of it are skipped """
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise HeadTooLong(414, 'Request-URI Too Long')
+        if not line:
+            return b''
+        if line not in (b'\r\n', b'\n'):
+            break
+
+    lines = [line]
+    size = len(line)
+    while line not in (b'\r\n', b'\n'):
+        try:
+            line = await reader.readline()
+        except ValueError:
+            raise HeadTooLong(431, 'Request Header Fields Too Large')
+        if not line:
+            return b''
+        size += len(line)
+        if size > MAX_HEAD_SIZE:
+            raise HeadTooLong(431, 'Request Header Fields Too Large')
+        lines.append(line)
+    return b''.join(lines)
+
+
+def _body_info(head):
+    """ return the Content-Length and whether a 100 Continue is expected """
+    length = 0
+    expect = False
+    for line in head.split(b'\n')[1:]:
+        name, sep, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            try:
+                length = int(value.strip())
+            except ValueError:
+                pass
+        elif name == b'expect':
+            expect = value.strip().lower() == b'100-continue'
+        elif name == b'transfer-encoding':
+            # a chunked body is always streamed
+            length = -1
+    return length, expect
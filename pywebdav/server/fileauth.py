@@ -25,9 +25,12 @@ This is an example implementation of a DAVserver using the DAV package.
 from __future__ import absolute_import
 import sys
 import logging
+import threading
 
 from pywebdav.lib.WebDAVServer import DAVRequestHandler
 from pywebdav.lib.dbconn import Mconn
+from pywebdav.lib.authcache import AuthCache
+from pywebdav.lib.credentials import CredentialFile
 
 from .fshandler import FilesystemHandler
 
@@ -38,23 +41,79 @@ class DAVAuthHandler(DAVRequestHandler):
     Provides authentication based on parameters. The calling
     class has to inject password and username into this.
     (Variables: auth_user and auth_pass)
+
+    If the credentials option is set the users are read from that
+    file instead (see pywebdav.lib.credentials), their password
+    hashes are checked once per auth_cache_ttl seconds.
     """
 
     # Do not forget to set IFACE_CLASS by caller
     # ex.: IFACE_CLASS = FilesystemHandler('/tmp', 'http://localhost/')
     verbose = False
 
+    # Commands that don't need write access
+    nowrite=['OPTIONS','PROPFIND','GET','HEAD','REPORT']
+
+    _auth_cache=None
+    _auth_cache_lock=threading.Lock()
+    _credentials=None
+
     def _log(self, message):
         if self.verbose:
             log.info(message)
 
+    def _get_auth_cache(self, options):
+        """ the cache of checked credentials, configured by options """
+        cls=self.__class__
+        if cls._auth_cache is None:
+            with cls._auth_cache_lock:
+                if cls._auth_cache is None:
+                    cls._auth_cache=AuthCache(
+                        float(options.get('auth_cache_ttl', 60)),
+                        float(options.get('auth_cache_negative_ttl', 5)),
+                        int(options.get('auth_cache_size', 1024)))
+        return cls._auth_cache
+
+    def _get_credentials(self, path):
+        cls=self.__class__
+        if cls._credentials is None or cls._credentials.path != path:
+            with cls._auth_cache_lock:
+                if cls._credentials is None or cls._credentials.path != path:
+                    cls._credentials=CredentialFile(path)
+        return cls._credentials
+
+    def _check_permissions(self, user, perms, command):
+        """ return 1 if perms allow user to run command """
+        if not perms:
+            self._log('Authentication failed for user %s' % user)
+            return 0
+
+        can_write='w' in perms
+        if not can_write and not command in self.nowrite:
+            self._log('Authentication failed for user %s using command %s' %(user,command))
+            return 0
+
+        self._log('Successfully authenticated user %s writable=%s' % (user,can_write))
+        return 1
+
     def get_userinfo(self,user,pw,command):
         """ authenticate user """
 
+        path = self._config.DAV.get('credentials', '')
+        if path:
+            credentials = self._get_credentials(path)
+            cache = self._get_auth_cache(self._config.DAV)
+            if credentials.reload_if_changed():
+                cache.clear()
+            perms = cache.get(user, pw)
+            if perms is None:
+                perms = credentials.check(user, pw)
+                cache.put(user, pw, perms)
+            return self._check_permissions(user, perms, command)
+
         if user == self._config.DAV.user and pw == self._config.DAV.password:
             log.info('Successfully authenticated user %s' % user)
             return 1
 
         log.info('Authentication failed for user %s' % user)
         return 0
-
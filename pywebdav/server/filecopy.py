@@ -0,0 +1,122 @@
+"""
+    Copying files in the kernel
+
+    copy_file() copies the content of a file without moving it through
+    the process where the system allows it, the first one that works
+    is used:
+
+        FICLONE         a reflink sharing the blocks of the source on
+                        copy on write filesystems (btrfs, xfs), which
+                        is instant whatever the size of the file
+        copy_file_range the kernel copies the data (or the filesystem,
+                        e.g. NFS server side copy)
+        sendfile        the kernel copies the data
+        read/write      anything else
+
+    The permissions and the times of the source are copied as well.
+
+"""
+
+from __future__ import absolute_import
+import os
+import stat
+import errno
+import shutil
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# ioctl of linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# bytes per copy_file_range or sendfile call
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# errors meaning that a method does not work for these files, the
+# next one is tried
+UNSUPPORTED = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+               errno.EOPNOTSUPP, errno.EPERM, errno.EBADF,
+               getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP))
+
+
+def _clone(src, dst, size):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst, FICLONE, src)
+    except (IOError, OSError) as ex:
+        if ex.errno in UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def _copy_range(src, dst, size):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(src, dst, min(CHUNK_SIZE, size - copied))
+        except OSError as ex:
+            # nothing written yet, another method can start over
+            if copied == 0 and ex.errno in UNSUPPORTED:
+                return False
+            raise
+        if n == 0:
+            # the source got shorter
+            break
+        copied += n
+    return True
+
+
+def _sendfile(src, dst, size):
+    if not hasattr(os, 'sendfile'):
+        return False
+    copied = 0
+    while copied < size:
+        try:
+            n = os.sendfile(dst, src, copied, min(CHUNK_SIZE, size - copied))
+        except OSError as ex:
+            if copied == 0 and ex.errno in UNSUPPORTED:
+                return False
+            raise
+        if n == 0:
+            break
+        copied += n
+    return True
+
+
+METHODS = (_clone, _copy_range, _sendfile)
+
+
+def copy_file(src, dst):
+    """ copy the file src to dst, which is replaced if it exists
+
+    Returns the name of the method that copied the data.
+
+    """
+    with open(src, 'rb') as fsrc:
+        st = os.fstat(fsrc.fileno())
+        with open(dst, 'wb') as fdst:
+            size = st.st_size
+            for method in METHODS:
+                if size and method(fsrc.fileno(), fdst.fileno(), size):
+                    used = method.__name__[1:]
+                    break
+            else:
+                shutil.copyfileobj(fsrc, fdst)
+                used = 'copyfileobj'
+
+    os.chmod(dst, stat.S_IMODE(st.st_mode))
+    if hasattr(st, 'st_mtime_ns'):
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    else:
+        os.utime(dst, (st.st_atime, st.st_mtime))
+    log.debug('copy_file: %s to %s (%s)' % (src, dst, used))
+    return used
@@ -1,16 +1,27 @@
 from __future__ import absolute_import
+import io
 import os
+import re
+import stat
 import textwrap
 import six
 import logging
 import types
+import errno
 import shutil
-from io import StringIO
+import binascii
+import threading
+from io import BytesIO
+from collections import OrderedDict
 from six.moves import urllib
 from pywebdav.lib.constants import COLLECTION, OBJECT
 from pywebdav.lib.errors import *
 from pywebdav.lib.iface import *
 from pywebdav.lib.davcmd import copyone, copytree, moveone, movetree, delone, deltree
+from pywebdav.lib.utils import rfc1123_date, iso8601_date
+
+from .filecopy import copy_file
+
 if six.PY2:
     from cgi import escape
 else:
@@ -19,6 +30,24 @@ else:
 log = logging.getLogger(__name__)
 
 BUFFER_SIZE = 128 * 1000 
+
+# number of stat results cached per request
+STAT_CACHE_SIZE = 1024
+
+# errors of a full disk or exceeded quota
+NO_SPACE = (errno.ENOSPC, getattr(errno, 'EDQUOT', errno.ENOSPC))
+
+# atomic rename, replacing the target
+_replace = getattr(os, 'replace', os.rename)
+
+# name of the temporary file of an upload
+PART_FILE = '.%s.%s.part'
+_part_file = re.compile(r'\..+\.[0-9a-f]{8}\.part\Z', re.S)
+
+
+def _is_part_file(name):
+    return name.endswith('.part') and _part_file.match(name) is not None
+
 # include magic support to correctly determine mimetypes
 MAGIC_AVAILABLE = False
 try:
@@ -39,12 +68,13 @@ class Resource(object):
         return self.__file_size
 
     def __iter__(self):
-        while 1:
-            data = self.__fp.read(BUFFER_SIZE)
+        left = self.__file_size
+        while left > 0:
+            data = self.__fp.read(min(left, BUFFER_SIZE))
             if not data:
                 break
+            left -= len(data)
             yield data
-            time.sleep(0.005)
         self.__fp.close()
 
     def read(self, length = 0):
@@ -53,7 +83,94 @@ class Resource(object):
 
         data = self.__fp.read(length)
         return data
-        
+
+    def get_file(self):
+        """ return the open file if it can be sent by the kernel, else None """
+        try:
+            self.__fp.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return None
+        return self.__fp
+
+    def close(self):
+        self.__fp.close()
+
+
+class StatCache(object):
+    """ the stat results of the least recently used paths
+
+    The cached paths are indexed by their directory (directories with
+    cached descendants are indexed as well), thus a path can be
+    forgotten together with its descendants without looking at the
+    other entries.
+
+    """
+
+    def __init__(self, size=STAT_CACHE_SIZE):
+        self.size = size
+        self._stats = OrderedDict()
+        self._childs = {}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def __contains__(self, path):
+        return path in self._stats
+
+    def get(self, path):
+        st = self._stats[path]
+        self._stats.move_to_end(path)
+        return st
+
+    def set(self, path, st):
+        if path in self._stats:
+            self._stats[path] = st
+            self._stats.move_to_end(path)
+            return
+
+        self._stats[path] = st
+        self._link(path)
+        if len(self._stats) > self.size:
+            old, st = self._stats.popitem(last=False)
+            self._unlink(old)
+
+    def invalidate(self, path):
+        """ forget path, its parent and its descendants """
+        todo = [path]
+        while todo:
+            p = todo.pop()
+            self._stats.pop(p, None)
+            todo.extend(self._childs.pop(p, ()))
+        self._unlink(path)
+
+        parent = os.path.dirname(path)
+        if self._stats.pop(parent, False) is not False:
+            self._unlink(parent)
+
+    def _link(self, path):
+        """ index path in its directory and the directory in its parent """
+        parent = os.path.dirname(path)
+        while parent != path:
+            childs = self._childs.get(parent)
+            if childs is not None:
+                childs.add(path)
+                return
+            self._childs[parent] = set([path])
+            path, parent = parent, os.path.dirname(parent)
+
+    def _unlink(self, path):
+        """ drop path from the index if nothing below it is cached """
+        while path not in self._stats and path not in self._childs:
+            parent = os.path.dirname(path)
+            childs = self._childs.get(parent)
+            if parent == path or childs is None:
+                return
+            childs.discard(path)
+            if childs:
+                return
+            del self._childs[parent]
+            path = parent
+
 
 class FilesystemHandler(dav_interface):
     """ 
@@ -69,12 +186,24 @@ class FilesystemHandler(dav_interface):
 
     """
 
+    # put() writes every piece of the data before taking the next one
+    put_accepts_views = True
+
     def __init__(self, directory, uri, verbose=False):
         self.setDirectory(directory)
         self.setBaseURI(uri)
 
         # should we be verbose?
         self.verbose = verbose
+
+        # what put() syncs to disk: off, file or full
+        self.put_fsync = 'off'
+
+        # number of threads deleting the files of a tree
+        self.delete_workers = 1
+
+        # per thread state, see begin_request()
+        self._local = threading.local()
         log.info('Initialized with %s %s' % (directory, uri))
 
     def setDirectory(self, path):
@@ -111,23 +240,39 @@ class FilesystemHandler(dav_interface):
     def get_childs(self, uri, filter=None):
         """ return the child objects as self.baseuris for the given URI """
 
-        fileloc=self.uri2local(uri)
-        filelist=[]
+        filelist=[child for child, iscol, info in self.get_childs_info(uri)]
+        log.info('get_childs: Childs %s' % filelist)
 
-        if os.path.exists(fileloc):
-            if os.path.isdir(fileloc):
-                try:
-                    files=os.listdir(fileloc)
-                except:
-                    raise DAV_NotFound
+        return filelist
 
-                for file in files:
-                    newloc=os.path.join(fileloc,file)
-                    filelist.append(self.local2uri(newloc))
+    def get_childs_info(self, uri):
+        """ yield (uri, is_collection, DirEntry) for the childs of uri
 
-                log.info('get_childs: Childs %s' % filelist)
+        The directory is read with os.scandir() which tells the type
+        of every child without another syscall. The DirEntry caches
+        its stat result, get_props() uses it instead of stating the
+        file again.
 
-        return filelist
+        """
+        fileloc=self.uri2local(uri)
+        try:
+            entries=os.scandir(fileloc)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        except OSError:
+            raise DAV_NotFound
+
+        prefix=self.local2uri(fileloc).rstrip('/')+'/'
+        with entries:
+            for entry in entries:
+                # uploads in progress, see put()
+                if _is_part_file(entry.name):
+                    continue
+                try:
+                    iscol=entry.is_dir()
+                except OSError:
+                    iscol=False
+                yield prefix+entry.name, iscol, entry
 
     def _get_listing(self, path):
         """Return a directory listing similar to http.server's"""
@@ -145,7 +290,8 @@ class FilesystemHandler(dav_interface):
                 </body>
             </html>
             """)
-        escapeditems = (escape(i) + ('/' if os.path.isdir(os.path.join(path, i)) else '') for i in os.listdir(path) if not i.startswith('.'))
+        with os.scandir(path) as entries:
+            escapeditems = [escape(e.name) + ('/' if e.is_dir() else '') for e in entries if not e.name.startswith('.')]
         htmlitems = "\n".join('<li><a href="{i}">{i}</a></li>'.format(i=i) for i in escapeditems)
 
         return template.format(items=htmlitems, path=path)
@@ -154,25 +300,28 @@ class FilesystemHandler(dav_interface):
         """ return the content of an object """
 
         path=self.uri2local(uri)
-        if os.path.exists(path):
-            if os.path.isfile(path):
-                file_size = os.path.getsize(path)
+        st=self._stat(path)
+        if st is not None:
+            if stat.S_ISREG(st.st_mode):
+                file_size = st.st_size
                 if range is None:
                     fp=open(path,"rb")
                     log.info('Serving content of %s' % uri)
                     return Resource(fp, file_size)
                 else:
-                    if range[1] == '':
-                        range[1] = file_size
-                    else:
-                        range[1] = int(range[1])
-
                     if range[0] == '':
-                        range[0] = file_size - range[1]
+                        # suffix range, the last bytes of the file
+                        range[0] = max(0, file_size - int(range[1]))
+                        range[1] = file_size
                     else:
                         range[0] = int(range[0])
+                        if range[1] == '':
+                            range[1] = file_size
+                        else:
+                            # the last byte position is inclusive
+                            range[1] = int(range[1]) + 1
 
-                    if range[0] > file_size:
+                    if range[0] >= file_size:
                         raise DAV_Requested_Range_Not_Satisfiable
 
                     if range[1] > file_size:
@@ -182,9 +331,9 @@ class FilesystemHandler(dav_interface):
                     fp.seek(range[0])
                     log.info('Serving range %s -> %s content of %s' % (range[0], range[1], uri))
                     return Resource(fp, range[1] - range[0])
-            elif os.path.isdir(path):
-                msg = self._get_listing(path)
-                return Resource(StringIO(msg), len(msg))
+            elif stat.S_ISDIR(st.st_mode):
+                msg = self._get_listing(path).encode('utf-8')
+                return Resource(BytesIO(msg), len(msg))
             else:
                 # also raise an error for collections
                 # don't know what should happen then..
@@ -192,14 +341,107 @@ class FilesystemHandler(dav_interface):
 
         raise DAV_NotFound
 
+    ###
+    ### Stat cache
+    ### While a request is handled the stat results are cached by
+    ### local path, so all the property getters of a resource share
+    ### one syscall. The cache lives in a thread local and is thrown
+    ### away at the end of the request, it only keeps the most recently
+    ### used STAT_CACHE_SIZE paths (a Depth: infinity PROPFIND visits
+    ### them once). Every method changing the filesystem invalidates
+    ### the paths it touches.
+    ###
+
+    def begin_request(self):
+        self._local.stats = StatCache()
+
+    def end_request(self):
+        self._local.stats = None
+
+    def _stat(self, path):
+        """ return the stat result of path or None if it does not exist """
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None and path in stats:
+            return stats.get(path)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+
+        if stats is not None:
+            stats.set(path, st)
+        return st
+
+    def _cache_stat(self, path, st):
+        """ remember a stat result obtained elsewhere (e.g. a DirEntry) """
+        stats = getattr(self._local, 'stats', None)
+        if stats is not None:
+            stats.set(path, st)
+
+    def _invalidate(self, path):
+        """ forget the stat results of path, its parent and its childs """
+        stats = getattr(self._local, 'stats', None)
+        if stats:
+            stats.invalidate(path.rstrip(os.sep) or os.sep)
+
+    ###
+    ### Properties
+    ### The _stat_dav_<propname> methods compute a DAV property from
+    ### the stat result of a file (None if it does not exist). They
+    ### are used by the single property getters as well as by
+    ### get_props() which needs only one stat per resource.
+    ###
+
+    def get_props(self, uris, proplist, infos=None):
+        """ return the values of many properties of many resources
+
+        Properties which can be computed from the stat result are
+        served from a single os.stat() per resource, all others are
+        looked up with get_prop(). The stat results cached in the
+        DirEntry objects of get_childs_info() are reused.
+
+        """
+        result = {}
+        for uri in uris:
+            path = self.uri2local(uri)
+            info = infos.get(uri) if infos else None
+            if info is not None:
+                try:
+                    st = info.stat()
+                except OSError:
+                    st = None
+                self._cache_stat(path, st)
+            else:
+                st = self._stat(path)
+            result[uri] = props = {}
+            for ns, plist in proplist.items():
+                values = props[ns] = {}
+                for prop in plist:
+                    try:
+                        m = None
+                        if ns == 'DAV:':
+                            m = getattr(self, '_stat_dav_' + prop.replace('-', '_'), None)
+                        if m is not None:
+                            values[prop] = m(path, st)
+                        else:
+                            values[prop] = self.get_prop(uri, ns, prop)
+                    except DAV_Error as error:
+                        values[prop] = error
+        return result
+
     def _get_dav_resourcetype(self,uri):
         """ return type of object """
         path=self.uri2local(uri)
-        if os.path.isfile(path):
-            return OBJECT
+        return self._stat_dav_resourcetype(path, self._stat(path))
 
-        elif os.path.isdir(path):
-            return COLLECTION
+    def _stat_dav_resourcetype(self, path, st):
+        if st is not None:
+            if stat.S_ISREG(st.st_mode):
+                return OBJECT
+
+            elif stat.S_ISDIR(st.st_mode):
+                return COLLECTION
 
         raise DAV_NotFound
 
@@ -209,30 +451,50 @@ class FilesystemHandler(dav_interface):
     def _get_dav_getcontentlength(self,uri):
         """ return the content length of an object """
         path=self.uri2local(uri)
-        if os.path.exists(path):
-            if os.path.isfile(path):
-                s=os.stat(path)
-                return str(s[6])
+        return self._stat_dav_getcontentlength(path, self._stat(path))
+
+    def _stat_dav_getcontentlength(self, path, st):
+        if st is not None and stat.S_ISREG(st.st_mode):
+            return str(st.st_size)
 
         return '0'
 
     def get_lastmodified(self,uri):
         """ return the last modified date of the object """
+        st=self._stat(self.uri2local(uri))
+        if st is not None:
+            return st.st_mtime
+
+        raise DAV_NotFound
+
+    def _stat_dav_getlastmodified(self, path, st):
+        if st is not None:
+            return rfc1123_date(st.st_mtime)
+
+        raise DAV_NotFound
+
+    def _get_dav_getetag(self, uri):
+        """ return a strong entity tag built from the stat data """
         path=self.uri2local(uri)
-        if os.path.exists(path):
-            s=os.stat(path)
-            date=s[8]
-            return date
+        return self._stat_dav_getetag(path, self._stat(path))
+
+    def _stat_dav_getetag(self, path, st):
+        if st is not None:
+            return '"%x-%x-%x"' % (st.st_ino, st.st_size, st.st_mtime_ns)
 
         raise DAV_NotFound
 
     def get_creationdate(self,uri):
         """ return the last modified date of the object """
-        path=self.uri2local(uri)
-        if os.path.exists(path):
-            s=os.stat(path)
-            date=s[9]
-            return date
+        st=self._stat(self.uri2local(uri))
+        if st is not None:
+            return st.st_ctime
+
+        raise DAV_NotFound
+
+    def _stat_dav_creationdate(self, path, st):
+        if st is not None:
+            return iso8601_date(st.st_ctime)
 
         raise DAV_NotFound
 
@@ -240,13 +502,18 @@ class FilesystemHandler(dav_interface):
         """ find out yourself! """
 
         path=self.uri2local(uri)
-        if os.path.exists(path):
-            if os.path.isfile(path):
+        return self._stat_dav_getcontenttype(path, self._stat(path))
+
+    def _stat_dav_getcontenttype(self, path, st):
+        if st is not None:
+            if stat.S_ISREG(st.st_mode):
                 if MAGIC_AVAILABLE is False \
                         or self.mimecheck is False:
                     return 'application/octet-stream'
                 else:
                     ret, encoding = mimetypes.guess_type(path)
+                    if ret is None:
+                        raise DAV_NotFound('Unknown type of %s' % path)
 
                     # for non mimetype related result we
                     # simply return an appropriate type
@@ -258,29 +525,94 @@ class FilesystemHandler(dav_interface):
                     else:
                         return ret
 
-            elif os.path.isdir(path):
+            elif stat.S_ISDIR(st.st_mode):
                 return "httpd/unix-directory"
 
         raise DAV_NotFound('Could not find %s' % path)
 
-    def put(self, uri, data, content_type=None):
-        """ put the object into the filesystem """
+    def put(self, uri, data, content_type=None, content_length=None):
+        """ put the object into the filesystem
+
+        The data is written to a temporary file in the same directory
+        which replaces the target when it is complete, readers see
+        either the old or the new content. The temporary file is not
+        listed by get_childs_info(). A body shorter than content_length
+        raises DAV_Error(400) and keeps the old content.
+
+        """
         path=self.uri2local(uri)
+        self._invalidate(path)
+        directory, name = os.path.split(path)
+        tmp = os.path.join(directory, PART_FILE % (
+            name, binascii.hexlify(os.urandom(4)).decode('ascii')))
+
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except OSError as e:
+            log.info('put: Could not create %s, %r', uri, e)
+            raise DAV_Error(424)
+
         try:
-            with open(path, "bw+") as fp:
+            with os.fdopen(fd, 'wb') as fp:
+                if content_length and hasattr(os, 'posix_fallocate'):
+                    self._preallocate(fd, content_length)
+
                 if isinstance(data, types.GeneratorType):
                     for d in data:
                         fp.write(d)
                 else:
                     if data:
                         fp.write(data)
+
+                # a short body must not replace the old content
+                if content_length and fp.tell() != content_length:
+                    raise DAV_Error(400, 'Incomplete request body')
+                fp.flush()
+                if self.put_fsync != 'off':
+                    os.fsync(fd)
+
+            # keep the permissions of a replaced file
+            st = self._stat(path)
+            if st is not None:
+                os.chmod(tmp, stat.S_IMODE(st.st_mode))
+
+            _replace(tmp, path)
+            if self.put_fsync == 'full':
+                self._fsync_directory(directory)
             log.info('put: Created %s' % uri)
         except Exception as e:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
             log.info('put: Could not create %s, %r', uri, e)
+            if isinstance(e, DAV_Error):
+                raise
+            if getattr(e, 'errno', None) in NO_SPACE:
+                raise DAV_Error(507)
             raise DAV_Error(424)
+        finally:
+            self._invalidate(path)
 
         return None
 
+    def _preallocate(self, fd, length):
+        """ reserve the space of an upload, it fails early if the disk is full """
+        try:
+            os.posix_fallocate(fd, 0, length)
+        except OSError as e:
+            if e.errno in NO_SPACE:
+                raise
+            # not supported by the filesystem, the space is allocated
+            # while writing
+
+    def _fsync_directory(self, directory):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
     def mkcol(self,uri):
         """ create a new collection """
         path=self.uri2local(uri)
@@ -298,6 +630,7 @@ class FilesystemHandler(dav_interface):
             raise DAV_Error(409)
 
         # test, if we are allowed to create it
+        self._invalidate(path)
         try:
             os.mkdir(path)
             log.info('mkcol: Created new collection %s' % path)
@@ -312,9 +645,10 @@ class FilesystemHandler(dav_interface):
     def rmcol(self,uri):
         """ delete a collection """
         path=self.uri2local(uri)
-        if not os.path.exists(path):
+        if self._stat(path) is None:
             raise DAV_NotFound
 
+        self._invalidate(path)
         try:
             shutil.rmtree(path)
         except OSError:
@@ -325,9 +659,10 @@ class FilesystemHandler(dav_interface):
     def rm(self,uri):
         """ delete a normal resource """
         path=self.uri2local(uri)
-        if not os.path.exists(path):
+        if self._stat(path) is None:
             raise DAV_NotFound
 
+        self._invalidate(path)
         try:
             os.unlink(path)
         except OSError as ex:
@@ -360,7 +695,11 @@ class FilesystemHandler(dav_interface):
         or None if everything's ok
         """
 
-        return deltree(self,uri)
+        res = deltree(self,uri,workers=self.delete_workers)
+
+        # the resources may have been deleted by other threads
+        self._invalidate(self.uri2local(uri))
+        return res
 
 
     ###
@@ -371,14 +710,84 @@ class FilesystemHandler(dav_interface):
         """ move one resource with Depth=0
         """
 
+        if self._rename(src, dst, overwrite):
+            return None
+
         return moveone(self,src,dst,overwrite)
 
     def movetree(self,src,dst,overwrite):
         """ move a collection with Depth=infinity
         """
 
+        res = self._rename(src, dst, overwrite)
+        if isinstance(res, dict):
+            return res
+        if res:
+            return {}
+
         return movetree(self,src,dst,overwrite)
 
+    def _rename(self, src, dst, overwrite):
+        """ move src to dst by renaming it
+
+        Returns True if it was renamed or False if src and dst are on
+        different devices, then it has to be copied and deleted. If
+        the destination cannot be deleted the result of deltree is
+        returned.
+
+        """
+        srcpath=self.uri2local(src)
+        dstpath=self.uri2local(dst)
+
+        src_st = self._stat(srcpath)
+        if src_st is None:
+            raise DAV_NotFound
+
+        parent_st = self._stat(os.path.dirname(dstpath))
+        if parent_st is None or not stat.S_ISDIR(parent_st.st_mode):
+            raise DAV_Error(409)
+        if parent_st.st_dev != src_st.st_dev:
+            return False
+
+        # neither onto itself nor into itself, the delete of the
+        # destination would destroy the source
+        if stat.S_ISDIR(src_st.st_mode):
+            real_src = os.path.realpath(srcpath)
+            real_dst = os.path.realpath(dstpath)
+            if real_dst == real_src or real_dst.startswith(real_src + os.sep):
+                raise DAV_Forbidden
+
+        dst_st = self._stat(dstpath)
+        if dst_st is not None:
+            if os.path.samestat(src_st, dst_st):
+                raise DAV_Forbidden
+            if not overwrite:
+                raise DAV_Error(412)
+
+            # a file replaces a file at once, anything else has to
+            # be deleted first
+            if stat.S_ISDIR(src_st.st_mode) or stat.S_ISDIR(dst_st.st_mode):
+                delres = self.deltree(dst)
+                if delres:
+                    if stat.S_ISDIR(src_st.st_mode):
+                        return delres
+                    raise DAV_Error(424)
+
+        self._invalidate(srcpath)
+        self._invalidate(dstpath)
+        try:
+            _replace(srcpath, dstpath)
+        except OSError as ex:
+            if ex.errno == errno.EXDEV:
+                return False
+            log.info('move: %s to %s failed (%s)' % (src, dst, ex))
+            if ex.errno in (errno.EACCES, errno.EPERM):
+                raise DAV_Forbidden
+            raise DAV_Error(409)
+
+        log.info('move: Renamed %s to %s' % (src, dst))
+        return True
+
     ###
     ### COPY handlers
     ###
@@ -404,14 +813,21 @@ class FilesystemHandler(dav_interface):
     ###
 
     def copy(self,src,dst):
-        """ copy a resource from src to dst """
+        """ copy a resource from src to dst
+
+        The data is copied by the kernel (or shared by a reflink) if
+        possible, see filecopy.py.
+        """
 
         srcfile=self.uri2local(src)
         dstfile=self.uri2local(dst)
+        self._invalidate(dstfile)
         try:
-            shutil.copy(srcfile, dstfile)
-        except (OSError, IOError):
-            log.info('copy: forbidden')
+            copy_file(srcfile, dstfile)
+        except (OSError, IOError) as ex:
+            log.info('copy: %s to %s failed (%s)' % (src, dst, ex))
+            if ex.errno in NO_SPACE:
+                raise DAV_Error(507)
             raise DAV_Error(409)
 
     def copycol(self, src, dst):
@@ -428,14 +844,14 @@ class FilesystemHandler(dav_interface):
     def exists(self,uri):
         """ test if a resource exists """
         path=self.uri2local(uri)
-        if os.path.exists(path):
+        if self._stat(path) is not None:
             return 1
         return None
 
     def is_collection(self,uri):
         """ test if the given uri is a collection """
-        path=self.uri2local(uri)
-        if os.path.isdir(path):
+        st=self._stat(self.uri2local(uri))
+        if st is not None and stat.S_ISDIR(st.st_mode):
             return 1
         else:
             return 0
@@ -18,39 +18,50 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from .fileauth import DAVAuthHandler
+from pywebdav.lib.dbconn import get_pool, POOL_SIZE
 import sys
+import logging
+
+log = logging.getLogger(__name__)
 
 class MySQLAuthHandler(DAVAuthHandler):
     """
     Provides authentication based on a mysql table
+
+    The queries use a connection pool shared by all handlers and the
+    results are cached for auth_cache_ttl seconds (failures for
+    auth_cache_negative_ttl seconds), see the [MySQL] section of
+    config.ini.
     """
 
+    def _lookup_user(self,user,pw):
+        """ return the permissions of user from the database """
+        Mysql=self._config.MySQL
+        pool=get_pool(Mysql.user,Mysql.passwd,Mysql.host,Mysql.port,
+                      Mysql.dbtable,int(Mysql.get('pool_size', POOL_SIZE)))
+
+        Auth=pool.execute('select `Write` from Users where User=%s and Pass=%s',
+                          (user,pw))
+        if len(Auth) != 1:
+            return ''
+        return Auth[0][0] and 'rw' or 'r'
+
     def get_userinfo(self,user,pw,command):
         """ authenticate user """
 
-        # Commands that need write access
-        nowrite=['OPTIONS','PROPFIND','GET']
-
-        Mysql=self._config.MySQL
-        DB=Mconn(Mysql.user,Mysql.passwd,Mysql.host,Mysql.port,Mysql.dbtable)
         if self.verbose:
             print(user,command, file=sys.stderr)
 
-        qry="select * from %s.Users where User='%s' and Pass='%s'"%(Mysql.dbtable,user,pw)
-        Auth=DB.execute(qry)
-
-        if len(Auth) == 1:
-            can_write=Auth[0][3]
-            if not can_write and not command in nowrite:
-                self._log('Authentication failed for user %s using command %s' %(user,command))
+        cache=self._get_auth_cache(self._config.MySQL)
+        perms=cache.get(user,pw)
+        if perms is None:
+            try:
+                perms=self._lookup_user(user,pw)
+            except Exception as ex:
+                # the failure is not cached, the next request tries again
+                log.error('Authentication query failed: %s' % ex)
                 return 0
-            else:
-                self._log('Successfully authenticated user %s writable=%s' % (user,can_write))
-                return 1
-        else:
-            self._log('Authentication failed for user %s' % user)
-            return 0
-
-        self._log('Authentication failed for user %s' % user)
-        return 0
+            cache.put(user,pw,perms)
+
+        return self._check_permissions(user,perms,command)
 
@@ -0,0 +1,164 @@
+"""
+    Bounded thread pool server
+
+    An alternative to ThreadedHTTPServer which does not start a thread
+    for every connection. The accepted connections are put into a
+    bounded queue and handled by a fixed number of threads. When the
+    queue is full a new connection is answered with a short 503
+    (Service Unavailable) and a Retry-After header right away, thus an
+    overloaded server sheds load quickly instead of starting more and
+    more threads until it runs out of memory.
+
+    While connections are waiting in the queue the handlers close their
+    keep-alive connections after the current response. A handler
+    waiting for the next request of an idle keep-alive connection
+    closes it as soon as connections are waiting, thus idle clients do
+    not hold the threads.
+
+"""
+
+from __future__ import absolute_import
+import time
+import socket
+import select
+import logging
+import threading
+
+from six.moves import queue
+from six.moves.BaseHTTPServer import HTTPServer
+
+log = logging.getLogger(__name__)
+
+# number of threads handling connections
+POOL_THREADS = 16
+
+# number of accepted connections waiting for a thread
+POOL_QUEUE = 64
+
+# seconds a rejected client is asked to wait before retrying
+RETRY_AFTER = 5
+
+# seconds between two checks of the queue while a connection is idle
+IDLE_POLL = 0.05
+
+OVERLOADED_RESPONSE = ('HTTP/1.1 503 Service Unavailable\r\n'
+                       'Retry-After: %d\r\n'
+                       'Content-Length: 0\r\n'
+                       'Connection: close\r\n\r\n')
+
+
+class PooledHTTPServer(HTTPServer):
+    """ HTTP server handling the connections with a fixed thread pool
+
+    The threads are started by serve_forever() (thus after a fork of
+    the prefork mode), they finish the queued connections when the
+    server is shut down.
+
+    """
+
+    def __init__(self, server_address, RequestHandlerClass,
+                 threads=POOL_THREADS, queue_size=POOL_QUEUE,
+                 retry_after=RETRY_AFTER):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.threads = threads
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._queue = queue.Queue(queue_size)
+        self._workers = []
+
+    @property
+    def saturated(self):
+        """ True if connections are waiting for a thread """
+        return not self._queue.empty()
+
+    def wait_for_request(self, connection, rfile, timeout=None):
+        """ wait for the next request of a keep-alive connection
+
+        Returns False if the connection should be closed: it was idle
+        for timeout seconds or connections are waiting for a thread.
+
+        """
+        if self._buffered(connection, rfile):
+            return True
+
+        deadline = timeout and time.time() + timeout
+        while not self.saturated:
+            wait = IDLE_POLL
+            if deadline:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                wait = min(left, IDLE_POLL)
+            if _readable(connection, wait):
+                return True
+
+        log.debug('Closing an idle connection, the pool is busy')
+        return False
+
+    def _buffered(self, connection, rfile):
+        """ test if rfile holds data already (e.g. a pipelined request) """
+        timeout = connection.gettimeout()
+        connection.settimeout(0)
+        try:
+            return bool(rfile.peek(1))
+        except (socket.error, IOError):
+            # let the handler read the error
+            return True
+        finally:
+            connection.settimeout(timeout)
+
+    def serve_forever(self, poll_interval=0.5):
+        self._workers = [threading.Thread(target=self._work,
+                                          name='DAVHandler-%d' % i)
+                         for i in range(self.threads)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            HTTPServer.serve_forever(self, poll_interval)
+        finally:
+            for worker in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self._workers = []
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """ answer a connection with 503 as the pool is overloaded """
+        self.rejected += 1
+        log.warning('Server overloaded, rejecting %s' % (client_address,))
+        try:
+            request.settimeout(1)
+            request.sendall((OVERLOADED_RESPONSE % self.retry_after)
+                            .encode('ascii'))
+        except (OSError, IOError):
+            pass
+        self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def _readable(sock, timeout):
+    """ wait up to timeout seconds for sock to become readable """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+    return bool(select.select([sock], [], [], timeout)[0])
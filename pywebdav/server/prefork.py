@@ -0,0 +1,130 @@
+"""
+    Pre-forking process supervisor
+
+    The master process binds the listening socket and forks a number
+    of workers which all accept connections on that socket and run the
+    usual threaded server, thus the requests are spread over several
+    processes (and CPU cores).
+
+    The master restarts workers which die and handles the following
+    signals:
+
+        SIGTERM, SIGINT - stop the workers (they finish the requests
+                          in progress) and exit
+        SIGHUP          - graceful reload: start new workers, then stop
+                          the old ones
+
+    When started as daemon (see daemonize.py) the pidfile holds the
+    pid of the master, thus stopping the daemon stops all workers.
+
+"""
+
+from __future__ import absolute_import
+import os
+import signal
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# workers dying faster than this after their start are restarted
+# with a delay so that a broken setup does not fork all the time
+RESPAWN_DELAY = 1
+
+# how often the master looks after its workers (in seconds)
+POLL_INTERVAL = 0.5
+
+
+def _serve_worker(runner):
+    """ run the server in a worker process, never returns """
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, it must
+        # not be called from the thread running it
+        threading.Thread(target=runner.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    status = 0
+    try:
+        runner.serve_forever()
+        runner.server_close()
+    except Exception:
+        log.exception('Worker %d failed' % os.getpid())
+        status = 1
+    os._exit(status)
+
+
+def serve_forever(runner, workers):
+    """ serve runner (a bound server) with workers processes """
+    children = {}       # pid: start time
+    retiring = set()    # pids of old workers stopped by a reload
+    state = {'running': True, 'reload': False}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(runner)
+        children[pid] = time.time()
+        log.info('Started worker %d' % pid)
+
+    def stop(signum, frame):
+        state['running'] = False
+
+    def reload(signum, frame):
+        state['reload'] = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+
+    for i in range(workers):
+        spawn()
+
+    while state['running']:
+        if state['reload']:
+            state['reload'] = False
+            log.info('Reloading workers')
+            old = list(children)
+            for i in range(workers):
+                spawn()
+            for pid in old:
+                del children[pid]
+                retiring.add(pid)
+                os.kill(pid, signal.SIGTERM)
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            pid = 0
+
+        if not pid:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        if pid in retiring:
+            retiring.discard(pid)
+        elif pid in children:
+            started = children.pop(pid)
+            log.warning('Worker %d died (status %d), restarting' % (pid, status))
+            if time.time() - started < RESPAWN_DELAY:
+                time.sleep(RESPAWN_DELAY)
+            if state['running']:
+                spawn()
+
+    log.info('Stopping workers')
+    for pid in list(children) + list(retiring):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    for pid in list(children) + list(retiring):
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+
+    runner.server_close()
@@ -29,8 +29,13 @@ from pywebdav.server.fileauth import DAVAuthHandler
 from pywebdav.server.mysqlauth import MySQLAuthHandler
 from pywebdav.server.fshandler import FilesystemHandler
 from pywebdav.server.daemonize import startstop
+from pywebdav.server import prefork
+from pywebdav.server.poolserver import PooledHTTPServer
 
 from pywebdav.lib.INI_Parse import Configuration
+from pywebdav.lib.locks import set_lock_table
+from pywebdav.lib.WebDAVServer import ConcurrencyLimits
+from pywebdav.lib.metrics import Metrics
 from pywebdav import __version__, __author__
 
 LEVELS = {'debug': logging.DEBUG,
@@ -42,6 +47,66 @@ LEVELS = {'debug': logging.DEBUG,
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle requests in a separate thread."""
 
+def configure_handler(handler, directory, host, port,
+                      verbose=False, noauth=False):
+    """ set up a request handler class serving directory
+
+    The options are read from handler._config, this is shared by
+    runserver() and the WSGI application (see wsgiapp.py).
+
+    """
+    # dispatch directory and host to the filesystem handler
+    # This handler is responsible from where to take the data
+    handler.IFACE_CLASS = FilesystemHandler(directory, 'http://%s:%s/' % (host, port), verbose )
+
+    # put some extra vars
+    handler.verbose = verbose
+    if noauth:
+        log.warning('Authentication disabled!')
+        handler.DO_AUTH = False
+
+    log.info('Serving data from %s' % directory)
+
+    if handler._config.DAV.getboolean('lockemulation') is False:
+        log.info('Deactivated LOCK, UNLOCK (WebDAV level 2) support')
+
+    if handler._config.DAV.get('lock_backend', 'memory') == 'sqlite':
+        lock_database = handler._config.DAV.get('lock_database', '')
+        if not lock_database:
+            log.error('The sqlite lock backend needs a lock_database!')
+            sys.exit(3)
+
+        from pywebdav.lib.sqlitelocks import SQLiteLockTable
+        set_lock_table(SQLiteLockTable(lock_database))
+
+    handler.IFACE_CLASS.mimecheck = True
+    if handler._config.DAV.getboolean('mimecheck') is False:
+        handler.IFACE_CLASS.mimecheck = False
+        log.info('Disabled mimetype sniffing (All files will have type application/octet-stream)')
+
+    put_fsync = handler._config.DAV.get('put_fsync', 'off').strip().lower()
+    if put_fsync not in ('off', 'file', 'full'):
+        log.error('put_fsync must be off, file or full')
+        sys.exit(3)
+    handler.IFACE_CLASS.put_fsync = put_fsync
+    handler.IFACE_CLASS.delete_workers = int(
+        handler._config.DAV.get('delete_workers', 1))
+
+    if handler._config.DAV.baseurl:
+        log.info('Using %s as base url for PROPFIND requests' % handler._config.DAV.baseurl)
+    handler.IFACE_CLASS.baseurl = handler._config.DAV.baseurl
+
+    concurrency_limits = handler._config.DAV.get('concurrency_limits', '')
+    if concurrency_limits:
+        log.info('Limiting concurrent requests: %s' % concurrency_limits)
+        handler.concurrency_limits = ConcurrencyLimits(concurrency_limits)
+
+    metrics_path = handler._config.DAV.get('metrics_path', '')
+    if metrics_path:
+        log.info('Serving metrics on %s' % metrics_path)
+        handler.metrics = Metrics()
+        handler.metrics_path = metrics_path
+
 def runserver(
          port = 8008, host='localhost',
          directory='/tmp',
@@ -50,7 +115,9 @@ def runserver(
          user = '',
          password = '',
          handler = DAVAuthHandler,
-         server = ThreadedHTTPServer):
+         server = ThreadedHTTPServer,
+         workers = 1,
+         engine = 'threads'):
 
     directory = directory.strip()
     directory = directory.rstrip('/')
@@ -71,32 +138,43 @@ def runserver(
         log.error('Root directory not allowed!')
         sys.exit(233)
 
-    # dispatch directory and host to the filesystem handler
-    # This handler is responsible from where to take the data
-    handler.IFACE_CLASS = FilesystemHandler(directory, 'http://%s:%s/' % (host, port), verbose )
+    configure_handler(handler, directory, host, port, verbose, noauth)
 
-    # put some extra vars
-    handler.verbose = verbose
-    if noauth:
-        log.warning('Authentication disabled!')
-        handler.DO_AUTH = False
-
-    log.info('Serving data from %s' % directory)
+    if workers > 1 and not hasattr(os, 'fork'):
+        log.error('Multiple workers are not supported on this platform!')
+        sys.exit(3)
 
-    if handler._config.DAV.getboolean('lockemulation') is False:
-        log.info('Deactivated LOCK, UNLOCK (WebDAV level 2) support')
+    if (workers > 1 and
+            handler._config.DAV.getboolean('lockemulation') is not False and
+            handler._config.DAV.get('lock_backend', 'memory') == 'memory'):
+        log.warning('The workers do not share their locks, '
+                    'use the sqlite lock_backend!')
 
-    handler.IFACE_CLASS.mimecheck = True
-    if handler._config.DAV.getboolean('mimecheck') is False:
-        handler.IFACE_CLASS.mimecheck = False
-        log.info('Disabled mimetype sniffing (All files will have type application/octet-stream)')
+    # initialize server on specified port
+    if engine == 'asyncio':
+        from pywebdav.server.asyncserver import AsyncHTTPServer
+        threads = int(handler._config.DAV.get('engine_threads', 32))
+        log.info('Using the asyncio engine with %d handler threads' % threads)
+        runner = AsyncHTTPServer( (host, port), handler, threads )
+    elif engine == 'pool':
+        threads = int(handler._config.DAV.get('pool_threads', 16))
+        queue_size = int(handler._config.DAV.get('pool_queue', 64))
+        retry_after = int(handler._config.DAV.get('retry_after', 5))
+        log.info('Using a pool of %d threads for up to %d queued connections'
+                 % (threads, queue_size))
+        runner = PooledHTTPServer( (host, port), handler,
+                                   threads, queue_size, retry_after )
+    elif engine == 'threads':
+        runner = server( (host, port), handler )
+    else:
+        log.error('Unknown engine %s!' % engine)
+        sys.exit(3)
 
-    if handler._config.DAV.baseurl:
-        log.info('Using %s as base url for PROPFIND requests' % handler._config.DAV.baseurl)
-    handler.IFACE_CLASS.baseurl = handler._config.DAV.baseurl
+    if workers > 1:
+        print(('Listening on %s (%i) with %i workers' % (host, port, workers)))
+        prefork.serve_forever(runner, workers)
+        return
 
-    # initialize server on specified port
-    runner = server( (host, port), handler )
     print(('Listening on %s (%i)' % (host, port)))
 
     try:
@@ -137,8 +215,18 @@ Parameters:
     -M, --nomime    Deactivate mimetype sniffing. Sniffing is based on magic numbers
                     detection but can be slow under heavy load. If you are experiencing
                     speed problems try to use this parameter.
+    -w, --workers   Number of server processes accepting connections on the
+                    same socket (default: 1). Crashed workers are restarted,
+                    SIGHUP replaces all workers by new ones.
+    -e, --engine    Server engine: threads (default) runs a thread per
+                    connection, pool handles the connections with a fixed
+                    number of threads and rejects connections with 503
+                    when its queue is full, asyncio handles the connections
+                    in an event loop and only requests in a bounded thread
+                    pool.
     -T, --noiter    Deactivate iterator. Use this if you encounter file corruption during 
-                    download. Also disables chunked body response.
+                    download or upload. Also disables chunked body response
+                    and zero-copy file sending.
     -i, --icounter  If you want to run multiple instances then you have to
                     give each instance it own number so that logfiles and such
                     can be identified. Default is 0
@@ -168,6 +256,9 @@ def setupDummyConfig(**kw):
         def getboolean(self, name):
             return (str(getattr(self, name, 0)) in ('1', "yes", "true", "on", "True"))
 
+        def get(self, name, default):
+            return getattr(self, name, default)
+
     class DummyConfig:
         DAV = DummyConfigDAV(**kw)
 
@@ -186,20 +277,27 @@ def run():
     counter = 0
     mysql = False
     lockemulation = True
+    http_request_use_iterator = True
     http_response_use_iterator = True
     chunked_http_response = True
     configfile = ''
     mimecheck = True
     loglevel = 'warning'
     baseurl = ''
+    http_response_use_sendfile = True
+    keepalive = True
+    keepalive_timeout = 15
+    keepalive_max_requests = 100
+    workers = 1
+    engine = 'threads'
 
     # parse commandline
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'P:D:H:d:u:p:nvhmJi:c:Ml:TB:',
+        opts, args = getopt.getopt(sys.argv[1:], 'P:D:H:d:u:p:nvhmJi:c:Ml:TB:w:e:',
                 ['host=', 'port=', 'directory=', 'user=', 'password=',
                  'daemon=', 'noauth', 'help', 'verbose', 'mysql', 
                  'icounter=', 'config=', 'nolock', 'nomime', 'loglevel', 'noiter',
-                 'baseurl='])
+                 'baseurl=', 'workers=', 'engine='])
     except getopt.GetoptError as e:
         print(usage)
         print('>>>> ERROR: %s' % str(e))
@@ -219,7 +317,9 @@ def run():
             lockemulation = False
 
         if o in ['-T', '--noiter']:
+            http_request_use_iterator = False
             http_response_use_iterator = False
+            http_response_use_sendfile = False
             chunked_http_response = False
 
         if o in ['-c', '--config']:
@@ -260,8 +360,11 @@ def run():
         if o in ['-B', '--baseurl']:
             baseurl = a.lower()
 
-    # This feature are disabled because they are unstable
-    http_request_use_iterator = 0
+        if o in ['-w', '--workers']:
+            workers = int(str(a).strip())
+
+        if o in ['-e', '--engine']:
+            engine = a.strip().lower()
 
     conf = None
     if configfile != '':
@@ -283,6 +386,8 @@ def run():
         counter = int(dv.counter)
         lockemulation = dv.lockemulation
         mimecheck = dv.mimecheck
+        workers = int(dv.get('workers', workers))
+        engine = dv.get('engine', engine).strip().lower()
 
         if 'chunked_http_response' not in dv:
             dv.set('chunked_http_response', chunked_http_response)
@@ -293,6 +398,12 @@ def run():
         if 'http_response_use_iterator' not in dv:
             dv.set('http_response_use_iterator', http_response_use_iterator)
 
+        if 'http_response_use_sendfile' not in dv:
+            dv.set('http_response_use_sendfile', http_response_use_sendfile)
+
+        if 'keepalive' not in dv:
+            dv.set('keepalive', keepalive)
+
     else:
 
         _dc = { 'verbose' : verbose,
@@ -310,7 +421,13 @@ def run():
                 'chunked_http_response': chunked_http_response,
                 'http_request_use_iterator': http_request_use_iterator,
                 'http_response_use_iterator': http_response_use_iterator,
-                'baseurl' : baseurl
+                'http_response_use_sendfile': http_response_use_sendfile,
+                'baseurl' : baseurl,
+                'keepalive' : keepalive,
+                'keepalive_timeout' : keepalive_timeout,
+                'keepalive_max_requests' : keepalive_max_requests,
+                'workers' : workers,
+                'engine' : engine
                 }
 
         conf = setupDummyConfig(**_dc)
@@ -334,7 +451,7 @@ def run():
         log.info('Stopping PyWebDAV server (version %s)' % __version__)
 
     if not noauth and daemonaction not in ['status', 'stop']:
-        if not user:
+        if not user and not conf.DAV.get('credentials', ''):
             print(usage)
             print('>> ERROR: No parameter specified!', file=sys.stderr)
             print('>> Example: davserver -D /tmp -n', file=sys.stderr)
@@ -349,6 +466,8 @@ def run():
     log.info('chunked_http_response feature %s' % (conf.DAV.getboolean('chunked_http_response') and 'ON' or 'OFF' ))
     log.info('http_request_use_iterator feature %s' % (conf.DAV.getboolean('http_request_use_iterator') and 'ON' or 'OFF' ))
     log.info('http_response_use_iterator feature %s' % (conf.DAV.getboolean('http_response_use_iterator') and 'ON' or 'OFF' ))
+    log.info('http_response_use_sendfile feature %s' % (conf.DAV.getboolean('http_response_use_sendfile') and 'ON' or 'OFF' ))
+    log.info('keepalive feature %s' % (conf.DAV.getboolean('keepalive') and 'ON' or 'OFF' ))
  
     if daemonize:
 
@@ -373,7 +492,7 @@ def run():
     handler._config = conf
 
     runserver(port, host, directory, verbose, noauth, user, password, 
-              handler=handler)
+              handler=handler, workers=workers, engine=engine)
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,81 @@
+"""
+    WSGI entry point
+
+    Serves the directory of a configuration file (see config.ini) with
+    any WSGI server, e.g.
+
+        PYWEBDAV_CONFIG=/etc/pywebdav.ini \
+            gunicorn -w 4 'pywebdav.server.wsgiapp:application'
+
+    or create the application with make_app(configfile). The server
+    options of the [DAV] section (host, port, workers, engine, ...) are
+    up to the WSGI server, host and port are only used to build the
+    URIs of the resources. Use the sqlite lock_backend when the WSGI
+    server runs several processes.
+
+"""
+
+from __future__ import absolute_import
+import os
+import threading
+import logging
+
+from pywebdav.lib.INI_Parse import Configuration
+from pywebdav.lib.wsgi import DAVApplication
+from pywebdav.server.fileauth import DAVAuthHandler
+from pywebdav.server.mysqlauth import MySQLAuthHandler
+from pywebdav.server.server import configure_handler
+
+log = logging.getLogger(__name__)
+
+# options read with getboolean() which need a value
+DEFAULTS = (('verbose', 0),
+            ('noauth', 0),
+            ('mysql_auth', 0),
+            ('lockemulation', 1),
+            ('mimecheck', 1),
+            ('chunked_http_response', 1),
+            ('http_request_use_iterator', 1),
+            ('http_response_use_iterator', 1),
+            ('http_response_use_sendfile', 1),
+            ('keepalive', 1),
+            ('baseurl', ''))
+
+
+def make_app(configfile):
+    """ return a WSGI application serving what configfile says """
+    conf = Configuration(configfile)
+    dv = conf.DAV
+    for name, value in DEFAULTS:
+        if name not in dv:
+            dv.set(name, value)
+
+    handler = DAVAuthHandler
+    if dv.getboolean('mysql_auth'):
+        handler = MySQLAuthHandler
+
+    # every application has its own configured handler class
+    handler = type(handler.__name__, (handler,), {'_config': conf})
+
+    directory = dv.directory.strip().rstrip('/')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    configure_handler(handler, directory, dv.get('host', 'localhost').strip(),
+                      int(dv.get('port', 8008)), dv.getboolean('verbose'),
+                      dv.getboolean('noauth'))
+    return DAVApplication(handler)
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def application(environ, start_response):
+    """ WSGI application configured by $PYWEBDAV_CONFIG """
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = make_app(os.environ['PYWEBDAV_CONFIG'])
+    return _app(environ, start_response)
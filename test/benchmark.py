@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+"""
+Load and latency benchmark of the DAV methods
+
+Starts davserver on a generated tree and drives concurrent requests of
+every scenario over real sockets. The report is written as JSON:
+
+    python test/benchmark.py --shape wide --output wide.json
+
+For every scenario it gives the number of requests and errors, the
+throughput (requests per second) and the p50/p99 latencies (in ms),
+plus the peak RSS of the server processes. Compare the reports of two
+versions to find regressions.
+
+Shapes of the tree (the sizes can be changed with --files, --depth
+and --size):
+
+    wide    one collection with many files
+    deep    a chain of nested collections with a few files each
+    small   many small files in collections of 100
+    huge    a few big files
+
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+from six.moves import http_client
+from six.moves import urllib
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+import pywebdav
+
+timer = getattr(time, 'perf_counter', time.time)
+
+SHAPES = {
+    'wide':  {'files': 2000, 'depth': 1, 'size': 4096},
+    'deep':  {'files': 500, 'depth': 50, 'size': 4096},
+    'small': {'files': 10000, 'depth': 2, 'size': 512},
+    'huge':  {'files': 4, 'depth': 1, 'size': 64 * 1024 * 1024},
+}
+
+# the subtree copied, moved and deleted by the tree scenarios
+OPS_FILES = 50
+
+PUT_SIZE = 64 * 1024
+RANGE_SIZE = 4096
+
+LOCK_BODY = b'''<?xml version="1.0" encoding="utf-8"?>
+<D:lockinfo xmlns:D="DAV:"><D:lockscope><D:exclusive/></D:lockscope>
+<D:locktype><D:write/></D:locktype><D:owner>benchmark</D:owner></D:lockinfo>'''
+
+
+### the tree
+
+def make_tree(root, shape, files, depth, size):
+    """ create the tree, return the paths of its files and collections """
+    paths = []
+    collections = []
+    chunk = os.urandom(min(size, 1024 * 1024))
+
+    def add_file(path):
+        with open(os.path.join(root, path), 'wb') as fp:
+            left = size
+            while left > 0:
+                fp.write(chunk[:left])
+                left -= len(chunk)
+        paths.append(path)
+
+    def add_collection(path):
+        os.makedirs(os.path.join(root, path))
+        collections.append(path)
+
+    add_collection('tree')
+    if shape == 'deep':
+        path = 'tree'
+        per_level = max(1, files // depth)
+        for level in range(depth):
+            path = '%s/level%d' % (path, level)
+            add_collection(path)
+            for i in range(per_level):
+                add_file('%s/file%d' % (path, i))
+    elif shape == 'small':
+        for i in range(files):
+            if i % 100 == 0:
+                path = 'tree/dir%d' % (i // 100)
+                add_collection(path)
+            add_file('%s/file%d' % (path, i))
+    else:
+        for i in range(files):
+            add_file('tree/file%d' % i)
+
+    # a fixed subtree for COPY, MOVE and DELETE
+    add_collection('ops')
+    add_collection('ops/sub')
+    for i in range(OPS_FILES):
+        with open(os.path.join(root, 'ops', 'sub' if i % 2 else '',
+                               'file%d' % i), 'wb') as fp:
+            fp.write(chunk[:1024])
+    add_collection('put')
+    add_collection('copies')
+    add_collection('moved')
+    return paths, collections
+
+
+### the server
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('localhost', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_server(directory, port, args):
+    cmd = [sys.executable, os.path.join(testdir, '..', 'pywebdav', 'server',
+                                        'server.py'),
+           '-D', directory, '-n', '-H', 'localhost', '-P', str(port)] + args
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(testdir, '..')] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            return proc
+        except socket.error:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('davserver did not start')
+
+
+def peak_rss(pid):
+    """ return the peak RSS in KB of pid and its children (Linux only) """
+    total = 0
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as fp:
+            pids.extend(int(p) for p in fp.read().split())
+    except (IOError, OSError):
+        pass
+
+    for p in pids:
+        try:
+            with open('/proc/%d/status' % p) as fp:
+                for line in fp:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except (IOError, OSError):
+            pass
+    return total or None
+
+
+### the scenarios
+
+class Scenario(object):
+    """ a kind of request, request() is called by the client threads """
+
+    name = None
+    expected = (200,)
+
+    def __init__(self, bench):
+        self.bench = bench
+
+    def request(self, conn, n):
+        raise NotImplementedError
+
+
+def _href(path):
+    return '/' + urllib.parse.quote(path)
+
+
+def _request(conn, method, path, body=None, headers={}):
+    conn.request(method, path, body=body, headers=headers)
+    res = conn.getresponse()
+    res.read()
+    return res
+
+
+class PropfindDepth0(Scenario):
+    name = 'propfind_depth0'
+    expected = (207,)
+
+    def request(self, conn, n):
+        path = random.choice(self.bench.paths)
+        return _request(conn, 'PROPFIND', _href(path), headers={'Depth': '0'})
+
+
+class PropfindDepth1(Scenario):
+    name = 'propfind_depth1'
+    expected = (207,)
+
+    def request(self, conn, n):
+        path = random.choice(self.bench.collections)
+        return _request(conn, 'PROPFIND', _href(path), headers={'Depth': '1'})
+
+
+class PropfindInfinity(Scenario):
+    name = 'propfind_infinity'
+    expected = (207,)
+
+    def request(self, conn, n):
+        return _request(conn, 'PROPFIND', '/tree',
+                        headers={'Depth': 'infinity'})
+
+
+class GetFull(Scenario):
+    name = 'get_full'
+
+    def request(self, conn, n):
+        return _request(conn, 'GET', _href(random.choice(self.bench.paths)))
+
+
+class GetRange(Scenario):
+    name = 'get_range'
+    expected = (206,)
+
+    def request(self, conn, n):
+        start = random.randrange(max(1, self.bench.size - RANGE_SIZE))
+        return _request(conn, 'GET', _href(random.choice(self.bench.paths)),
+                        headers={'Range': 'bytes=%d-%d' % (
+                            start, start + RANGE_SIZE - 1)})
+
+
+class PutFixed(Scenario):
+    name = 'put_fixed'
+    expected = (201, 204)
+
+    def request(self, conn, n):
+        return _request(conn, 'PUT', '/put/fixed%d' % n, self.bench.put_body)
+
+
+class PutChunked(Scenario):
+    name = 'put_chunked'
+    expected = (201, 204)
+
+    def request(self, conn, n):
+        body = self.bench.put_body
+        pieces = (body[i:i + 8192] for i in range(0, len(body), 8192))
+        conn.putrequest('PUT', '/put/chunked%d' % n)
+        conn.putheader('Transfer-Encoding', 'chunked')
+        conn.endheaders()
+        for piece in pieces:
+            conn.send(('%x\r\n' % len(piece)).encode() + piece + b'\r\n')
+        conn.send(b'0\r\n\r\n')
+        res = conn.getresponse()
+        res.read()
+        return res
+
+
+class CopyTree(Scenario):
+    name = 'copy_tree'
+    expected = (201, 204)
+
+    def request(self, conn, n):
+        return _request(conn, 'COPY', '/ops', headers={
+            'Destination': self.bench.url('/copies/ops%d' % n),
+            'Depth': 'infinity'})
+
+
+class MoveTree(Scenario):
+    name = 'move_tree'
+    expected = (201, 204)
+
+    def request(self, conn, n):
+        # moves what copy_tree created
+        return _request(conn, 'MOVE', '/copies/ops%d' % n, headers={
+            'Destination': self.bench.url('/moved/ops%d' % n)})
+
+
+class DeleteTree(Scenario):
+    name = 'delete_tree'
+    expected = (204,)
+
+    def request(self, conn, n):
+        # deletes what move_tree moved
+        return _request(conn, 'DELETE', '/moved/ops%d' % n)
+
+
+class LockUnlock(Scenario):
+    name = 'lock_unlock'
+    expected = (204,)
+
+    def request(self, conn, n):
+        path = _href(random.choice(self.bench.paths))
+        res = _request(conn, 'LOCK', path, LOCK_BODY, headers={
+            'Depth': '0', 'Timeout': 'Second-60',
+            'Content-Type': 'text/xml'})
+        token = res.getheader('Lock-Token')
+        if res.status != 200 or not token:
+            return res
+        return _request(conn, 'UNLOCK', path, headers={'Lock-Token': token})
+
+
+SCENARIOS = [PropfindDepth0, PropfindDepth1, PropfindInfinity, GetFull,
+             GetRange, PutFixed, PutChunked, CopyTree, MoveTree, DeleteTree,
+             LockUnlock]
+
+
+### the driver
+
+class Benchmark(object):
+
+    def __init__(self, port, paths, collections, size, concurrency,
+                 requests):
+        self.port = port
+        self.paths = paths
+        self.collections = collections
+        self.size = size
+        self.concurrency = concurrency
+        self.requests = requests
+        self.put_body = os.urandom(PUT_SIZE)
+
+    def url(self, path):
+        return 'http://localhost:%d%s' % (self.port, path)
+
+    def run(self, scenario):
+        """ run requests of scenario with concurrent clients """
+        counter = iter(range(self.requests))
+        counter_lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def client():
+            conn = http_client.HTTPConnection('localhost', self.port)
+            while True:
+                with counter_lock:
+                    n = next(counter, None)
+                if n is None:
+                    break
+
+                start = timer()
+                try:
+                    res = scenario.request(conn, n)
+                    ok = res.status in scenario.expected
+                    if res.will_close:
+                        conn.close()
+                except (socket.error, http_client.HTTPException):
+                    ok = False
+                    conn.close()
+                elapsed = timer() - start
+
+                with counter_lock:
+                    latencies.append(elapsed)
+                    if not ok:
+                        errors[0] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=client)
+                   for i in range(self.concurrency)]
+        start = timer()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = timer() - start
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+
+
+def percentile(values, p):
+    """ nearest rank percentile of sorted values """
+    if not values:
+        return 0
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the DAV methods of davserver')
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='wide')
+    parser.add_argument('--files', type=int, help='number of files')
+    parser.add_argument('--depth', type=int, help='depth of the deep tree')
+    parser.add_argument('--size', type=int, help='size of the files')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario (default 200)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients (default 8)')
+    parser.add_argument('--scenarios', default='',
+                        help='comma separated names, default all')
+    parser.add_argument('--directory', help='where to create the tree')
+    parser.add_argument('--output', help='JSON report file, default stdout')
+    parser.add_argument('server_args', nargs='*',
+                        help='more davserver options (after --), '
+                             'e.g. -- -e asyncio -w 4')
+    opts = parser.parse_args()
+
+    shape = dict(SHAPES[opts.shape])
+    for key in ('files', 'depth', 'size'):
+        if getattr(opts, key):
+            shape[key] = getattr(opts, key)
+
+    scenarios = SCENARIOS
+    if opts.scenarios:
+        names = [n.strip() for n in opts.scenarios.split(',')]
+        scenarios = [s for s in SCENARIOS if s.name in names]
+
+    root = tempfile.mkdtemp(dir=opts.directory)
+    proc = None
+    try:
+        print('Creating %s tree in %s' % (opts.shape, root), file=sys.stderr)
+        paths, collections = make_tree(root, opts.shape, **shape)
+
+        port = free_port()
+        proc = start_server(root, port, opts.server_args)
+        bench = Benchmark(port, paths, collections, shape['size'],
+                          opts.concurrency, opts.requests)
+
+        results = {}
+        for cls in scenarios:
+            print('Running %s' % cls.name, file=sys.stderr)
+            results[cls.name] = bench.run(cls(bench))
+
+        report = {
+            'version': pywebdav.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'shape': dict(shape, name=opts.shape),
+            'concurrency': opts.concurrency,
+            'server_args': opts.server_args,
+            'peak_rss_kb': peak_rss(proc.pid),
+            'results': results,
+        }
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as fp:
+            fp.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    main()
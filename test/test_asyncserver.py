@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+port = 38034
+
+
+class Test(unittest.TestCase):
+    """ requests against a davserver with the asyncio engine """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rundir = tempfile.mkdtemp()
+        env = dict(os.environ, PYTHONPATH=os.path.join(testdir, '..'))
+        cls.proc = subprocess.Popen(
+            [sys.executable, os.path.join(testdir, '..', 'pywebdav', 'server', 'server.py'),
+             '-D', cls.rundir, '-n', '-H', 'localhost', '--port', str(port),
+             '--engine', 'asyncio'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        for i in range(50):
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.kill()
+        cls.proc.wait()
+        shutil.rmtree(cls.rundir)
+
+    def exchange(self, data):
+        """ send data and return everything the server sends back """
+        sock = socket.create_connection(('localhost', port), timeout=5)
+        try:
+            sock.sendall(data)
+            out = []
+            while True:
+                buf = sock.recv(65536)
+                if not buf:
+                    return b''.join(out)
+                out.append(buf)
+        finally:
+            sock.close()
+
+    def test_request_line_too_long(self):
+        res = self.exchange(b'GET /' + b'a' * 70000 + b' HTTP/1.1\r\n\r\n')
+        self.assertTrue(res.startswith(b'HTTP/1.1 414 '), res[:40])
+
+    def test_header_too_long(self):
+        res = self.exchange(b'GET / HTTP/1.1\r\nX: ' + b'a' * 70000 +
+                            b'\r\n\r\n')
+        self.assertTrue(res.startswith(b'HTTP/1.1 431 '), res[:40])
+
+        res = self.exchange(b'GET / HTTP/1.1\r\n' + b'X: a\r\n' * 20000 +
+                            b'\r\n')
+        self.assertTrue(res.startswith(b'HTTP/1.1 431 '), res[:40])
+
+    def test_chunk_size_too_long(self):
+        res = self.exchange(b'PUT /long HTTP/1.1\r\nHost: localhost\r\n'
+                            b'Transfer-Encoding: chunked\r\n\r\n' +
+                            b'0' * 5000 + b'5\r\nhello\r\n0\r\n\r\n')
+        self.assertTrue(res.startswith(b'HTTP/1.1 400 '), res[:40])
+
+    def test_pipelined_after_chunked_body(self):
+        res = self.exchange(b'PUT /f HTTP/1.1\r\nHost: localhost\r\n'
+                            b'Transfer-Encoding: chunked\r\n\r\n'
+                            b'5\r\nhello\r\n0\r\n\r\n'
+                            b'GET /f HTTP/1.1\r\nHost: localhost\r\n'
+                            b'Connection: close\r\n\r\n')
+        self.assertTrue(res.startswith(b'HTTP/1.1 201 '), res[:40])
+        self.assertEqual(res.count(b'HTTP/1.1 200 '), 1)
+        self.assertTrue(res.endswith(b'hello'))
+
+
+if __name__ == '__main__':
+    unittest.main()
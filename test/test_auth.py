@@ -0,0 +1,334 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib import authcache, credentials, dbconn
+from pywebdav.lib.authcache import AuthCache
+from pywebdav.lib.credentials import CredentialFile, hash_password, \
+    verify_password, set_user
+from pywebdav.lib.INI_Parse import Configuration
+from pywebdav.server.fileauth import DAVAuthHandler
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestAuthCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(authcache, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get(self):
+        cache = AuthCache()
+        self.assertIsNone(cache.get('user', 'secret'))
+        cache.put('user', 'secret', 'rw')
+        self.assertEqual(cache.get('user', 'secret'), 'rw')
+        self.assertEqual(cache.get('user', u'secret'), 'rw')
+        # another password or user is not cached
+        self.assertIsNone(cache.get('user', 'other'))
+        self.assertIsNone(cache.get('other', 'secret'))
+
+    def test_no_passwords(self):
+        cache = AuthCache()
+        cache.put('user', 'secret', 'r')
+        for user, digest in cache._items:
+            self.assertNotIn(b'secret', digest)
+
+    def test_ttl(self):
+        cache = AuthCache(ttl=60, negative_ttl=5)
+        cache.put('user', 'secret', 'rw')
+        cache.put('user', 'wrong', '')
+        self.assertEqual(cache.get('user', 'wrong'), '')
+
+        self.clock.now += 5
+        self.assertIsNone(cache.get('user', 'wrong'))
+        self.assertEqual(cache.get('user', 'secret'), 'rw')
+
+        self.clock.now += 55
+        self.assertIsNone(cache.get('user', 'secret'))
+        # expired entries are dropped
+        self.assertEqual(len(cache._items), 0)
+
+    def test_disabled(self):
+        cache = AuthCache(ttl=0, negative_ttl=0)
+        cache.put('user', 'secret', 'rw')
+        cache.put('user', 'wrong', '')
+        self.assertIsNone(cache.get('user', 'secret'))
+        self.assertIsNone(cache.get('user', 'wrong'))
+
+        cache = AuthCache(size=0)
+        cache.put('user', 'secret', 'rw')
+        self.assertIsNone(cache.get('user', 'secret'))
+
+    def test_size(self):
+        cache = AuthCache(size=3)
+        for user in 'abc':
+            cache.put(user, 'pw', 'rw')
+        # a lookup makes an entry recent
+        cache.get('a', 'pw')
+        cache.put('d', 'pw', 'rw')
+        self.assertEqual(len(cache._items), 3)
+        self.assertEqual(cache.get('a', 'pw'), 'rw')
+        self.assertIsNone(cache.get('b', 'pw'))
+
+        # a new result replaces the old one
+        cache.put('a', 'pw', 'r')
+        self.assertEqual(cache.get('a', 'pw'), 'r')
+        self.assertEqual(len(cache._items), 3)
+
+    def test_clear(self):
+        cache = AuthCache()
+        cache.put('user', 'secret', 'rw')
+        cache.clear()
+        self.assertIsNone(cache.get('user', 'secret'))
+
+
+class OperationalError(Exception):
+    pass
+
+
+class FakeConnection(object):
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+
+    def autocommit(self, on):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, qry, args):
+        if self.conn.db.fail:
+            self.conn.db.fail -= 1
+            raise OperationalError(2006, 'MySQL server has gone away')
+        self.result = ((qry, args),)
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeMySQLdb(object):
+    OperationalError = OperationalError
+
+    def __init__(self):
+        self.connections = []
+        self.fail = 0
+
+    def connect(self, **args):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeMySQLdb()
+        patcher = mock.patch.object(dbconn, 'MySQLdb', self.db, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuse(self):
+        pool = dbconn.ConnectionPool('user', 'pw', 'localhost', '3306', 'db')
+        self.assertEqual(pool.execute('select %s', (1,)), (('select %s', (1,)),))
+        pool.execute('select 2')
+        self.assertEqual(len(self.db.connections), 1)
+
+    def test_size(self):
+        pool = dbconn.ConnectionPool('user', 'pw', 'localhost', 3306, 'db',
+                                     size=2)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+                # no third connection, the pool waits for a free one
+                self.assertFalse(pool._slots.acquire(False))
+        self.assertEqual(len(self.db.connections), 2)
+
+    def test_reconnect(self):
+        pool = dbconn.ConnectionPool('user', 'pw', 'localhost', 3306, 'db')
+        pool.execute('select 1')
+        self.db.fail = 1
+        self.assertEqual(pool.execute('select 2'), (('select 2', None),))
+        # the broken connection was closed and dropped
+        first, second = self.db.connections
+        self.assertTrue(first.closed)
+        self.assertEqual(pool._idle, [second])
+
+        self.db.fail = 2
+        self.assertRaises(OperationalError, pool.execute, 'select 3')
+
+    def test_get_pool(self):
+        args = ('user', 'pw', 'localhost', 3306, 'pooltest')
+        self.assertIs(dbconn.get_pool(*args), dbconn.get_pool(*args))
+        self.assertIsNot(dbconn.get_pool(*args),
+                         dbconn.get_pool('other', 'pw', 'localhost', 3306,
+                                         'pooltest'))
+
+
+class TestCredentials(unittest.TestCase):
+    def setUp(self):
+        # fast hashes, the iterations are stored with each hash
+        patcher = mock.patch.object(credentials, 'PBKDF2_ITERATIONS', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'users')
+
+    def test_hash(self):
+        for method in ('pbkdf2_sha256', 'scrypt'):
+            encoded = hash_password(u'p\xe4ss', method)
+            self.assertTrue(encoded.startswith(method + '$'))
+            self.assertNotIn('p\xe4ss', encoded)
+            self.assertTrue(verify_password(u'p\xe4ss', encoded))
+            self.assertTrue(verify_password(u'p\xe4ss'.encode('utf-8'),
+                                            encoded))
+            self.assertFalse(verify_password('pass', encoded))
+
+        # salted
+        self.assertNotEqual(hash_password('pw'), hash_password('pw'))
+        self.assertRaises(ValueError, hash_password, 'pw', 'md5')
+
+    def test_malformed(self):
+        for encoded in ('', 'md5$abc', 'pbkdf2_sha256$x$a$b',
+                        'pbkdf2_sha256$1000', 'scrypt$16384$8$1$!!$??'):
+            self.assertFalse(verify_password('pw', encoded), encoded)
+
+    def test_file(self):
+        with open(self.path, 'w') as fp:
+            fp.write('# comment\n\n'
+                     'writer:rw:%s\n'
+                     'reader:r:%s\n'
+                     'bad:x:%s\n'
+                     'malformed\n' % (hash_password('w'), hash_password('r'),
+                                       hash_password('b')))
+
+        users = CredentialFile(self.path)
+        self.assertEqual(users.check('writer', 'w'), 'rw')
+        self.assertEqual(users.check('reader', 'r'), 'r')
+        self.assertEqual(users.check('reader', 'w'), '')
+        self.assertEqual(users.check('bad', 'b'), '')
+        self.assertEqual(users.check('nobody', 'w'), '')
+
+    def test_set_user(self):
+        set_user(self.path, 'user', 'one')
+        set_user(self.path, 'other', 'two', 'r')
+        set_user(self.path, 'user', 'three', 'r', method='scrypt')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+        users = CredentialFile(self.path)
+        self.assertEqual(users.check('user', 'one'), '')
+        self.assertEqual(users.check('user', 'three'), 'r')
+        self.assertEqual(users.check('other', 'two'), 'r')
+        self.assertEqual(len(open(self.path).readlines()), 2)
+
+        self.assertRaises(ValueError, set_user, self.path, 'a:b', 'pw')
+
+    def test_reload(self):
+        set_user(self.path, 'user', 'one')
+        users = CredentialFile(self.path, check_interval=60)
+        set_user(self.path, 'user', 'two')
+
+        # not checked again within the interval
+        self.assertFalse(users.reload_if_changed())
+        self.assertEqual(users.check('user', 'two'), '')
+
+        users._checked -= 60
+        self.assertTrue(users.reload_if_changed())
+        self.assertEqual(users.check('user', 'two'), 'rw')
+
+        # unchanged
+        users._checked -= 60
+        self.assertFalse(users.reload_if_changed())
+
+        # the users are kept if the file cannot be read
+        os.unlink(self.path)
+        users._checked -= 60
+        self.assertFalse(users.reload_if_changed())
+        self.assertEqual(users.check('user', 'two'), 'rw')
+
+    def test_missing(self):
+        with mock.patch.object(credentials.log, 'error') as error:
+            users = CredentialFile(self.path, check_interval=60)
+        self.assertTrue(error.called)
+        self.assertEqual(users.check('user', 'one'), '')
+
+        # read once it is there
+        set_user(self.path, 'user', 'one')
+        users._checked -= 60
+        self.assertTrue(users.reload_if_changed())
+        self.assertEqual(users.check('user', 'one'), 'rw')
+
+    def test_unreadable(self):
+        os.mkdir(self.path)
+        with mock.patch.object(credentials.log, 'error') as error:
+            users = CredentialFile(self.path)
+        self.assertTrue(error.called)
+        self.assertEqual(users.check('user', 'one'), '')
+
+
+class TestFileAuth(unittest.TestCase):
+    """ the credentials option of the server """
+
+    def setUp(self):
+        patcher = mock.patch.object(credentials, 'PBKDF2_ITERATIONS', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'users')
+        config = os.path.join(self.dir, 'config.ini')
+        with open(config, 'w') as fp:
+            fp.write('[DAV]\ncredentials = %s\n' % self.path)
+
+        # a class of its own for the class wide credentials and cache
+        cls = type('Handler', (DAVAuthHandler,), {
+            '_config': Configuration(config)})
+        self.handler = cls.__new__(cls)
+
+    def test_permissions(self):
+        set_user(self.path, 'writer', 'w')
+        set_user(self.path, 'reader', 'r', 'r')
+        get_userinfo = self.handler.get_userinfo
+        for command in ('GET', 'HEAD', 'OPTIONS', 'PROPFIND', 'REPORT'):
+            self.assertEqual(get_userinfo('reader', 'r', command), 1, command)
+            self.assertEqual(get_userinfo('writer', 'w', command), 1, command)
+        for command in ('PUT', 'DELETE', 'MOVE', 'PROPPATCH', 'LOCK'):
+            self.assertEqual(get_userinfo('reader', 'r', command), 0, command)
+            self.assertEqual(get_userinfo('writer', 'w', command), 1, command)
+        self.assertEqual(get_userinfo('reader', 'w', 'GET'), 0)
+
+    def test_missing_file(self):
+        # refused instead of failing the request
+        with mock.patch.object(credentials.log, 'error'):
+            self.assertEqual(self.handler.get_userinfo('user', 'pw', 'GET'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
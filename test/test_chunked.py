@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.chunked import read_chunked, MAX_LINE, MAX_TRAILERS
+from pywebdav.lib.errors import DAV_Error
+
+
+class NoReadinto(object):
+    """ file without readinto(), like the reader of the asyncio engine """
+
+    def __init__(self, data):
+        self._fp = io.BytesIO(data)
+        self.read = self._fp.read
+        self.readline = self._fp.readline
+
+
+def chunked(*chunks):
+    return b''.join(b'%x\r\n%s\r\n' % (len(c), c) for c in chunks) + b'0\r\n\r\n'
+
+
+class TestReadChunked(unittest.TestCase):
+    def read(self, body, **kw):
+        rfile = io.BytesIO(body)
+        data = [bytes(piece) for piece in read_chunked(rfile, **kw)]
+        return data, rfile.read()
+
+    def assertError(self, code, body, **kw):
+        with self.assertRaises(DAV_Error) as cm:
+            self.read(body, **kw)
+        self.assertEqual(cm.exception.args[0], code)
+
+    def test_read(self):
+        data, rest = self.read(chunked(b'hello', b' ', b'world') + b'NEXT')
+        self.assertEqual(b''.join(data), b'hello world')
+        # the next request is not touched
+        self.assertEqual(rest, b'NEXT')
+
+    def test_empty(self):
+        self.assertEqual(self.read(b'0\r\n\r\n'), ([], b''))
+
+    def test_pieces(self):
+        # the pieces do not depend on the chunk sizes
+        body = chunked(b'a' * 3, b'b' * 10, b'c', b'd' * 7)
+        data, rest = self.read(body, piece_size=4)
+        self.assertEqual([len(d) for d in data], [4, 4, 4, 4, 4, 1])
+        self.assertEqual(b''.join(data), b'aaa' + b'b' * 10 + b'c' + b'd' * 7)
+
+    def test_views(self):
+        # the pieces share one buffer
+        pieces = list(read_chunked(io.BytesIO(chunked(b'abcdefgh')),
+                                   piece_size=4))
+        self.assertEqual(len(pieces), 2)
+        self.assertIsInstance(pieces[0], memoryview)
+        self.assertEqual(bytes(pieces[0]), b'efgh')
+
+    def test_no_readinto(self):
+        rfile = NoReadinto(chunked(b'x' * 10, b'y' * 5) + b'NEXT')
+        data = [bytes(piece) for piece in read_chunked(rfile, piece_size=4)]
+        self.assertEqual(b''.join(data), b'x' * 10 + b'y' * 5)
+        self.assertEqual(rfile.read(), b'NEXT')
+
+    def test_extensions(self):
+        body = b'5;name=value\r\nhello\r\n6 ; x="y"\r\n world\r\n0;end\r\n\r\n'
+        self.assertEqual(self.read(body), ([b'hello world'], b''))
+
+    def test_hex_size(self):
+        body = b'A\r\n0123456789\r\n0\r\n\r\n'
+        self.assertEqual(self.read(body), ([b'0123456789'], b''))
+
+    def test_bare_lf(self):
+        body = b'5\nhello\n0\n\n'
+        self.assertEqual(self.read(body), ([b'hello'], b''))
+
+    def test_trailers(self):
+        body = b'5\r\nhello\r\n0\r\nX-Sum: 1\r\nX-Other: 2\r\n\r\nNEXT'
+        self.assertEqual(self.read(body), ([b'hello'], b'NEXT'))
+
+    def test_bad_size(self):
+        for line in (b'x', b'-1', b'', b' 5', b'0x5', b'1' * 17):
+            self.assertError(400, line + b'\r\nhello\r\n0\r\n\r\n')
+
+    def test_size_too_long(self):
+        self.assertError(400, b'0' * (MAX_LINE + 10) + b'5\r\nhello\r\n0\r\n\r\n')
+
+    def test_missing_crlf(self):
+        self.assertError(400, b'5\r\nhelloX\r\n0\r\n\r\n')
+
+    def test_incomplete(self):
+        self.assertError(400, b'')
+        self.assertError(400, b'5\r\nhel')
+        self.assertError(400, b'5\r\nhello\r\n')
+        self.assertError(400, b'5\r\nhello\r\n0\r\n')
+        self.assertError(400, b'5\r\nhello\r\n0\r\nX-Sum: 1\r\n')
+
+    def test_trailers_limit(self):
+        trailers = b'X: 1\r\n' * (MAX_TRAILERS + 1)
+        self.assertError(400, b'0\r\n' + trailers + b'\r\n')
+        self.assertError(400, b'0\r\nX: ' + b'1' * MAX_LINE + b'\r\n\r\n')
+
+    def test_max_size(self):
+        body = chunked(b'a' * 10, b'b' * 10)
+        data, rest = self.read(body, max_size=20)
+        self.assertEqual(b''.join(data), b'a' * 10 + b'b' * 10)
+        self.assertError(413, body, max_size=19)
+
+    def test_max_size_early(self):
+        # a huge chunk size is refused before its data is read
+        rfile = io.BytesIO(b'ffffffff\r\n' + b'a' * 100)
+        with self.assertRaises(DAV_Error) as cm:
+            list(read_chunked(rfile, max_size=1000))
+        self.assertEqual(cm.exception.args[0], 413)
+        self.assertEqual(len(rfile.read()), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from xml.dom import minidom
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.davcopy import COPY
+from pywebdav.lib.davmove import MOVE
+from pywebdav.lib.davcmd import movetree, deltree
+from pywebdav.lib.delete import DELETE
+from pywebdav.lib.errors import DAV_Error, DAV_Forbidden
+from pywebdav.server.fshandler import FilesystemHandler
+
+BASE = 'http://localhost:8008/'
+
+
+class TestCopyTree(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dc = FilesystemHandler(self.root, BASE)
+        os.makedirs(os.path.join(self.root, 'src', 'sub'))
+        for name in ('a', os.path.join('sub', 'b')):
+            with open(os.path.join(self.root, 'src', name), 'wb') as fp:
+                fp.write(b'data of ' + name.encode('ascii'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_copy(self):
+        res = COPY(self.dc, BASE + 'src', BASE + 'dst', True).tree_action()
+        self.assertIsNone(res)
+        with open(os.path.join(self.root, 'dst', 'sub', 'b'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'data of sub/b')
+
+    def test_partial_failure(self):
+        # a dangling symlink cannot be copied
+        os.symlink(os.path.join(self.root, 'missing'),
+                   os.path.join(self.root, 'src', 'sub', 'broken'))
+
+        res = COPY(self.dc, BASE + 'src', BASE + 'dst', True).tree_action()
+
+        doc = minidom.parseString(res)
+        responses = doc.getElementsByTagNameNS('DAV:', 'response')
+        self.assertEqual(len(responses), 1)
+        href = responses[0].getElementsByTagNameNS('DAV:', 'href')[0]
+        status = responses[0].getElementsByTagNameNS('DAV:', 'status')[0]
+        self.assertEqual(href.firstChild.data, BASE + 'src/sub/broken')
+        self.assertIn(' 409 ', status.firstChild.data)
+
+        # the other members are copied anyway
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'dst', 'a')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'dst', 'sub', 'b')))
+
+
+class UndeletableHandler(FilesystemHandler):
+    """ a filesystem on which the files named keep cannot be deleted """
+
+    def rm(self, uri):
+        if uri.endswith('/keep'):
+            raise DAV_Forbidden
+        return FilesystemHandler.rm(self, uri)
+
+
+class TestMoveTree(unittest.TestCase):
+    """ davcmd.movetree(), used if a collection cannot be renamed """
+
+    tearDown = TestCopyTree.tearDown
+
+    def setUp(self):
+        TestCopyTree.setUp(self)
+        self.dc = UndeletableHandler(self.root, BASE)
+
+    def test_move(self):
+        self.assertEqual(movetree(self.dc, BASE + 'src', BASE + 'dst'), {})
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'src')))
+        with open(os.path.join(self.root, 'dst', 'sub', 'b'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'data of sub/b')
+
+    def test_member_not_copied(self):
+        os.symlink(os.path.join(self.root, 'missing'),
+                   os.path.join(self.root, 'src', 'sub', 'broken'))
+
+        res = movetree(self.dc, BASE + 'src', BASE + 'dst')
+        self.assertEqual(res, {BASE + 'src/sub/broken': 409})
+
+        # the member and its parents are kept, the others are moved
+        self.assertTrue(os.path.islink(os.path.join(self.root, 'src', 'sub', 'broken')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'src', 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'src', 'sub', 'b')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'dst', 'sub', 'b')))
+
+    def test_destination_not_deleted(self):
+        os.makedirs(os.path.join(self.root, 'dst'))
+        with open(os.path.join(self.root, 'dst', 'keep'), 'wb') as fp:
+            fp.write(b'old')
+
+        res = movetree(self.dc, BASE + 'src', BASE + 'dst', True)
+        self.assertEqual(res, {BASE + 'dst/keep': 403})
+
+        # nothing was copied, the source is kept
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'src', 'sub', 'b')))
+
+
+class LockedHandler(UndeletableHandler):
+    """ files named locked are locked, all files are deleted slowly """
+
+    def rm(self, uri):
+        self.threads.add(threading.current_thread())
+        time.sleep(0.01)
+        if uri.endswith('/locked'):
+            raise DAV_Error(423, 'Locked')
+        return UndeletableHandler.rm(self, uri)
+
+
+class TestDeltree(unittest.TestCase):
+    """ davcmd.deltree() with several workers """
+
+    tearDown = TestCopyTree.tearDown
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dc = LockedHandler(self.root, BASE)
+        self.dc.threads = set()
+        for name in ('a', 'sub/b', 'sub/keep', 'sub/deep/c', 'sub/deep/locked',
+                     'other/d', 'other/e'):
+            self.create(name)
+        for i in range(20):
+            self.create('many/f%02d' % i)
+
+    def create(self, name):
+        path = os.path.join(self.root, 'src', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fp:
+            fp.write(b'data')
+
+    def exists(self, name):
+        return os.path.lexists(os.path.join(self.root, 'src', name))
+
+    def test_delete(self):
+        for name in ('sub/keep', 'sub/deep/locked'):
+            os.remove(os.path.join(self.root, 'src', name))
+        self.assertEqual(deltree(self.dc, BASE + 'src', workers=4), {})
+        self.assertFalse(self.exists(''))
+        self.assertGreater(len(self.dc.threads), 1)
+
+    def test_undeletable_members(self):
+        for workers in (1, 4):
+            res = deltree(self.dc, BASE + 'src', workers=workers)
+            self.assertEqual(res, {BASE + 'src/sub/keep': 403,
+                                   BASE + 'src/sub/deep/locked': 423})
+
+            # the members and their parents are kept
+            for name in ('sub/keep', 'sub/deep/locked'):
+                self.assertTrue(self.exists(name))
+            # everything else is deleted
+            for name in ('a', 'sub/b', 'sub/deep/c', 'other', 'many'):
+                self.assertFalse(self.exists(name))
+
+            for name in ('a', 'sub/b', 'sub/deep/c', 'other/d', 'many/f00'):
+                self.create(name)
+
+    def test_file(self):
+        self.assertEqual(deltree(self.dc, BASE + 'src/a', workers=4), {})
+        self.assertFalse(self.exists('a'))
+        self.assertEqual(deltree(self.dc, BASE + 'src/sub/keep', workers=4),
+                         {BASE + 'src/sub/keep': 403})
+
+    def test_multistatus(self):
+        self.dc.delete_workers = 4
+        res = DELETE(BASE + 'src', self.dc).delcol()
+
+        doc = minidom.parseString(res)
+        statuses = {}
+        for response in doc.getElementsByTagNameNS('DAV:', 'response'):
+            href = response.getElementsByTagNameNS('DAV:', 'href')[0]
+            status = response.getElementsByTagNameNS('DAV:', 'status')[0]
+            statuses[href.firstChild.data] = status.firstChild.data
+        # the kept parents are not listed (see 9.6.1 of RFC 4918)
+        self.assertEqual(statuses, {
+            BASE + 'src/sub/keep': 'HTTP/1.1 403 Forbidden',
+            BASE + 'src/sub/deep/locked': 'HTTP/1.1 423 Locked'})
+        self.assertGreater(len(self.dc.threads), 1)
+
+
+class TestRename(unittest.TestCase):
+    """ FilesystemHandler.movetree() renaming the collection """
+
+    setUp = TestCopyTree.setUp
+    tearDown = TestCopyTree.tearDown
+
+    def assertForbidden(self, action, *args):
+        with self.assertRaises(DAV_Error) as cm:
+            action(*args)
+        self.assertEqual(cm.exception.args[0], 403)
+
+    def assertKept(self):
+        with open(os.path.join(self.root, 'src', 'sub', 'b'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'data of sub/b')
+
+    def test_rename(self):
+        self.assertIsNone(MOVE(self.dc, BASE + 'src', BASE + 'dst', True)
+                          .tree_action())
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'src')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'dst', 'sub', 'b')))
+
+    def test_onto_itself(self):
+        for src, dst in (('src/', 'src'), ('src', 'src/'), ('src', 'src')):
+            move = MOVE(self.dc, BASE + src, BASE + dst, True)
+            self.assertForbidden(move.tree_action)
+            # not even through the handler
+            self.assertForbidden(self.dc.movetree, BASE + src, BASE + dst, True)
+            self.assertKept()
+
+    def test_into_itself(self):
+        for dst in ('src/sub', 'src/sub/new'):
+            self.assertForbidden(self.dc.movetree, BASE + 'src', BASE + dst,
+                                 True)
+        self.assertKept()
+
+    def test_onto_itself_by_symlink(self):
+        os.symlink(os.path.join(self.root, 'src'),
+                   os.path.join(self.root, 'link'))
+        self.assertForbidden(self.dc.movetree, BASE + 'src', BASE + 'link',
+                             True)
+        self.assertKept()
+
+    def test_file_onto_itself(self):
+        self.assertForbidden(self.dc.moveone, BASE + 'src/a', BASE + 'src/a',
+                             True)
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'src', 'a')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,354 @@
+import os
+import sys
+import errno
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.errors import DAV_Error
+from pywebdav.lib.iface import dav_interface
+from pywebdav.server import fshandler
+from pywebdav.server.fshandler import FilesystemHandler
+
+BASE = 'http://localhost:8008/'
+
+
+class HandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.dc = FilesystemHandler(self.root, BASE)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as fp:
+            fp.write(data)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fp:
+            return fp.read()
+
+    def assertDAVError(self, code, action, *args, **kw):
+        with self.assertRaises(DAV_Error) as cm:
+            action(*args, **kw)
+        self.assertEqual(cm.exception.args[0], code)
+
+
+class TestPut(HandlerTestCase):
+    def pieces(self, *pieces, **kw):
+        for piece in pieces:
+            yield piece
+        if 'error' in kw:
+            raise kw['error']
+
+    def test_put(self):
+        self.dc.put(BASE + 'f', b'data', content_length=4)
+        self.assertEqual(self.read('f'), b'data')
+        self.dc.put(BASE + 'g', self.pieces(b'da', b'ta'))
+        self.assertEqual(self.read('g'), b'data')
+        self.dc.put(BASE + 'empty', None)
+        self.assertEqual(self.read('empty'), b'')
+        self.assertEqual(sorted(os.listdir(self.root)), ['empty', 'f', 'g'])
+
+    def test_atomic_replace(self):
+        self.write('f', b'old')
+        os.chmod(self.path('f'), 0o640)
+        with open(self.path('f'), 'rb') as reader:
+            self.dc.put(BASE + 'f', b'new content')
+            # a reader keeps the old content
+            self.assertEqual(reader.read(), b'old')
+        self.assertEqual(self.read('f'), b'new content')
+        # with the permissions of the replaced file
+        self.assertEqual(os.stat(self.path('f')).st_mode & 0o777, 0o640)
+
+    def test_failed_upload_keeps_old_content(self):
+        self.write('f', b'old')
+        error = DAV_Error(400, 'Incomplete request body')
+        self.assertDAVError(400, self.dc.put, BASE + 'f',
+                            self.pieces(b'new', error=error))
+        self.assertEqual(self.read('f'), b'old')
+        self.assertEqual(os.listdir(self.root), ['f'])
+
+    def test_short_body(self):
+        self.write('f', b'old')
+        self.assertDAVError(400, self.dc.put, BASE + 'f', b'new',
+                            content_length=10)
+        self.assertDAVError(400, self.dc.put, BASE + 'f',
+                            self.pieces(b'new'), content_length=10)
+        self.assertEqual(self.read('f'), b'old')
+        self.assertEqual(os.listdir(self.root), ['f'])
+
+    def test_part_file_hidden(self):
+        self.write('f', b'old')
+        listed = []
+
+        def pieces():
+            yield b'new'
+            # the upload in progress is not listed
+            listed.extend(os.path.basename(uri) for uri, iscol, info
+                          in self.dc.get_childs_info(BASE))
+            self.assertEqual(len(os.listdir(self.root)), 2)
+
+        self.dc.put(BASE + 'f', pieces())
+        self.assertEqual(listed, ['f'])
+        self.assertEqual(self.dc.get_childs(BASE), [BASE + 'f'])
+
+    def test_dot_files_listed(self):
+        for name in ('.hidden', '.f.part', '.f.xyz12345.part'):
+            self.write(name, b'')
+        names = sorted(os.path.basename(uri) for uri in self.dc.get_childs(BASE))
+        self.assertEqual(names, ['.f.part', '.f.xyz12345.part', '.hidden'])
+
+    def test_no_space(self):
+        self.write('f', b'old')
+        error = OSError(errno.ENOSPC, 'No space left on device')
+        self.assertDAVError(507, self.dc.put, BASE + 'f',
+                            self.pieces(b'new', error=error))
+        self.assertEqual(self.read('f'), b'old')
+        self.assertEqual(os.listdir(self.root), ['f'])
+
+    def test_other_errors(self):
+        # no parent collection
+        self.assertDAVError(424, self.dc.put, BASE + 'missing/f', b'data')
+
+        error = OSError(errno.EIO, 'Input/output error')
+        self.assertDAVError(424, self.dc.put, BASE + 'f',
+                            self.pieces(b'new', error=error))
+        self.assertEqual(os.listdir(self.root), [])
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'no fallocate')
+    def test_preallocate(self):
+        with mock.patch('os.posix_fallocate') as fallocate:
+            self.dc.put(BASE + 'f', b'data', content_length=4)
+        self.assertEqual(fallocate.call_args[0][1:], (0, 4))
+        self.assertEqual(self.read('f'), b'data')
+
+        # not without a length
+        with mock.patch('os.posix_fallocate') as fallocate:
+            self.dc.put(BASE + 'g', self.pieces(b'data'))
+        self.assertFalse(fallocate.called)
+
+    @unittest.skipUnless(hasattr(os, 'posix_fallocate'), 'no fallocate')
+    def test_preallocate_errors(self):
+        # an upload which does not fit fails before its data is read
+        self.write('f', b'old')
+        read = []
+        error = OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch('os.posix_fallocate', side_effect=error):
+            self.assertDAVError(507, self.dc.put, BASE + 'f',
+                                (read.append(d) or d for d in [b'data']),
+                                content_length=4)
+        self.assertEqual(read, [])
+        self.assertEqual(self.read('f'), b'old')
+
+        # a filesystem without fallocate allocates while writing
+        error = OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        with mock.patch('os.posix_fallocate', side_effect=error):
+            self.dc.put(BASE + 'f', b'data', content_length=4)
+        self.assertEqual(self.read('f'), b'data')
+
+    def fsyncs(self, policy):
+        self.dc.put_fsync = policy
+        synced = []
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            synced.append(os.path.isdir('/proc/self/fd/%d' % fd)
+                          and 'dir' or 'file')
+            real_fsync(fd)
+
+        with mock.patch('os.fsync', fsync):
+            self.dc.put(BASE + 'f', b'data')
+        return synced
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_fsync(self):
+        self.assertEqual(self.fsyncs('off'), [])
+        self.assertEqual(self.fsyncs('file'), ['file'])
+        self.assertEqual(self.fsyncs('full'), ['file', 'dir'])
+
+
+STAT_PROPS = {'DAV:': ['creationdate', 'getcontentlength', 'getcontenttype',
+                       'getetag', 'getlastmodified', 'resourcetype']}
+
+
+class TestChildsInfo(HandlerTestCase):
+    """ get_childs_info(), the listing with os.scandir() """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        os.mkdir(self.path('dir'))
+        self.write('f.txt', b'data')
+        self.write('dir/g', b'more data')
+
+    def childs(self, uri=BASE):
+        return dict((uri, (iscol, info))
+                    for uri, iscol, info in self.dc.get_childs_info(uri))
+
+    def test_listing(self):
+        childs = self.childs()
+        self.assertEqual(sorted(childs), [BASE + 'dir', BASE + 'f.txt'])
+        self.assertEqual(sorted(self.dc.get_childs(BASE)), sorted(childs))
+        self.assertTrue(childs[BASE + 'dir'][0])
+        self.assertFalse(childs[BASE + 'f.txt'][0])
+
+        # the DirEntry tells the stat result of the file
+        info = childs[BASE + 'f.txt'][1]
+        self.assertEqual(info.name, 'f.txt')
+        self.assertEqual(info.stat().st_size, 4)
+        self.assertEqual(info.stat().st_ino, os.stat(self.path('f.txt')).st_ino)
+
+        self.assertEqual(list(self.childs(BASE + 'dir')), [BASE + 'dir/g'])
+        self.assertEqual(self.childs(BASE + 'missing'), {})
+        self.assertEqual(self.childs(BASE + 'f.txt'), {})
+
+    def test_broken_symlink(self):
+        os.symlink(self.path('missing'), self.path('broken'))
+        iscol, info = self.childs()[BASE + 'broken']
+        self.assertFalse(iscol)
+
+        props = self.dc.get_props([BASE + 'broken'], STAT_PROPS,
+                                  {BASE + 'broken': info})
+        values = props[BASE + 'broken']['DAV:']
+        self.assertEqual(values['resourcetype'].args[0], 404)
+        self.assertEqual(values['getcontentlength'], '0')
+
+    def test_removed_after_listing(self):
+        childs = self.childs()
+        os.remove(self.path('f.txt'))
+        shutil.rmtree(self.path('dir'))
+
+        infos = dict((uri, info) for uri, (iscol, info) in childs.items())
+        props = self.dc.get_props(sorted(infos), STAT_PROPS, infos)
+        for uri in infos:
+            self.assertEqual(props[uri]['DAV:']['resourcetype'].args[0], 404)
+            self.assertEqual(props[uri]['DAV:']['getetag'].args[0], 404)
+
+        # nothing is listed below a removed collection
+        self.assertEqual(self.childs(BASE + 'dir'), {})
+
+
+class TestGetProps(HandlerTestCase):
+    """ the batched get_props() """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        self.dc.mimecheck = True
+        os.mkdir(self.path('dir'))
+        self.write('f.txt', b'data')
+        self.write('dir/g', b'more data')
+
+    def values(self, props):
+        """ the values with the errors replaced by their code """
+        return dict((uri, dict((ns, dict(
+            (p, v.args[0] if isinstance(v, DAV_Error) else v)
+            for p, v in values.items())) for ns, values in nsvalues.items()))
+            for uri, nsvalues in props.items())
+
+    def stated(self, stat):
+        # mimetypes reads its files on the first use
+        return sorted(c[0][0] for c in stat.call_args_list
+                      if c[0][0].startswith(self.root))
+
+    def test_same_as_get_prop(self):
+        uris = [BASE + 'f.txt', BASE + 'dir', BASE + 'dir/g']
+        proplist = dict(STAT_PROPS)
+        proplist['DAV:'] = proplist['DAV:'] + ['displayname', 'nosuchprop']
+        proplist['NS2'] = ['p1']
+        props = self.dc.get_props(uris, proplist)
+        self.assertEqual(sorted(props), sorted(uris))
+        # the default of the interface calls get_prop()
+        self.assertEqual(self.values(props), self.values(
+            dav_interface.get_props(self.dc, uris, proplist)))
+        self.assertEqual(props[BASE + 'dir/g']['DAV:']['getcontentlength'], '9')
+        self.assertEqual(props[BASE + 'f.txt']['DAV:']['nosuchprop'].args[0], 404)
+
+    def test_one_stat(self):
+        uris = [BASE + 'f.txt', BASE + 'dir']
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            self.dc.get_props(uris, STAT_PROPS)
+        self.assertEqual(self.stated(stat), [self.path('dir'), self.path('f.txt')])
+
+    def test_infos(self):
+        # the stat results of the listing are used
+        childs = list(self.dc.get_childs_info(BASE))
+        infos = dict((uri, info) for uri, iscol, info in childs)
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            props = self.dc.get_props(list(infos), STAT_PROPS, infos)
+        self.assertEqual(self.stated(stat), [])
+        self.assertEqual(self.values(props), self.values(
+            self.dc.get_props(list(infos), STAT_PROPS)))
+
+
+class TestRequestStats(HandlerTestCase):
+    """ the stat results cached for the time of a request """
+
+    def setUp(self):
+        HandlerTestCase.setUp(self)
+        self.dc.begin_request()
+        self.addCleanup(self.dc.end_request)
+        self.write('f', b'data')
+        os.mkdir(self.path('dir'))
+        self.write('dir/g', b'more data')
+
+    def length(self, name):
+        props = self.dc.get_props([BASE + name],
+                                  {'DAV:': ['getcontentlength']})
+        return props[BASE + name]['DAV:']['getcontentlength']
+
+    def test_cached(self):
+        self.assertEqual(self.length('f'), '4')
+        # changed behind the back of the handler
+        self.write('f', b'new data')
+        self.assertEqual(self.length('f'), '4')
+        self.dc.end_request()
+        self.dc.begin_request()
+        self.assertEqual(self.length('f'), '8')
+
+    def test_put(self):
+        self.assertEqual(self.length('f'), '4')
+        self.assertFalse(self.dc.exists(BASE + 'new'))
+        self.dc.put(BASE + 'f', b'new data')
+        self.dc.put(BASE + 'new', b'x')
+        self.assertEqual(self.length('f'), '8')
+        self.assertEqual(self.length('new'), '1')
+
+    def test_move(self):
+        self.assertEqual(self.length('f'), '4')
+        self.assertFalse(self.dc.exists(BASE + 'h'))
+        self.dc.moveone(BASE + 'f', BASE + 'h', True)
+        self.assertFalse(self.dc.exists(BASE + 'f'))
+        self.assertEqual(self.length('h'), '4')
+
+        # the members of a moved collection
+        self.assertEqual(self.length('dir/g'), '9')
+        self.assertFalse(self.dc.exists(BASE + 'moved/g'))
+        self.assertEqual(self.dc.movetree(BASE + 'dir', BASE + 'moved', True), {})
+        self.assertFalse(self.dc.exists(BASE + 'dir/g'))
+        self.assertFalse(self.dc.exists(BASE + 'dir'))
+        self.assertEqual(self.length('moved/g'), '9')
+
+    def test_delete(self):
+        self.assertTrue(self.dc.exists(BASE + 'f'))
+        self.dc.delone(BASE + 'f')
+        self.assertFalse(self.dc.exists(BASE + 'f'))
+
+        self.assertTrue(self.dc.exists(BASE + 'dir/g'))
+        self.assertTrue(self.dc.is_collection(BASE + 'dir'))
+        self.assertEqual(self.dc.deltree(BASE + 'dir'), {})
+        self.assertFalse(self.dc.exists(BASE + 'dir/g'))
+        self.assertFalse(self.dc.exists(BASE + 'dir'))
+
+        # the parent has another modification time now
+        self.dc.put(BASE + 'f', b'data')
+        self.assertTrue(self.dc.exists(BASE + 'f'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import zlib
+import gzip
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.INI_Parse import Configuration
+from pywebdav.lib.WebDAVServer import DAVRequestHandler
+
+CONTENT = b''.join(b'line %d\n' % i for i in range(2000))
+
+
+class Test(unittest.TestCase):
+    """ the compression helpers of the request handler """
+
+    def setUp(self):
+        config = Configuration(os.path.join(testdir, '..', 'pywebdav',
+                                            'server', 'config.ini'))
+        config.DAV.set('http_response_use_iterator', 1)
+        self.handler = DAVRequestHandler.__new__(DAVRequestHandler)
+        self.handler._config = config
+        self.handler.headers = {'Accept-Encoding': 'gzip'}
+
+    def accepts(self, value):
+        self.handler.headers = {'Accept-Encoding': value}
+        return self.handler._accepts_gzip()
+
+    def test_accepts(self):
+        self.assertTrue(self.accepts('gzip'))
+        self.assertTrue(self.accepts('x-gzip'))
+        self.assertTrue(self.accepts('deflate, GZIP;q=0.5'))
+        self.assertTrue(self.accepts('gzip ; Q=1'))
+        self.assertFalse(self.accepts(''))
+        self.assertFalse(self.accepts('deflate, br'))
+        self.assertFalse(self.accepts('gzip;q=0'))
+        self.assertFalse(self.accepts('gzip;q=0.000'))
+        self.assertFalse(self.accepts('gzip;q=x'))
+        self.handler.headers = {}
+        self.assertFalse(self.handler._accepts_gzip())
+
+    def test_use_gzip(self):
+        use = self.handler._use_gzip
+        self.assertTrue(use(CONTENT, 'text/plain'))
+        self.assertTrue(use(CONTENT, 'Application/XML; charset="utf-8"'))
+        self.assertTrue(use(iter([CONTENT]), 'text/html'))
+        self.assertFalse(use(CONTENT, 'image/png'))
+        self.assertFalse(use(CONTENT, 'application/octet-stream'))
+        # not worth it
+        self.assertFalse(use(b'short', 'text/plain'))
+        # partial responses
+        self.assertFalse(use(CONTENT, 'text/plain', 206))
+        self.assertFalse(use(CONTENT, 'text/plain', 416))
+
+    def test_use_gzip_options(self):
+        dav = self.handler._config.DAV
+        dav.set('gzip_mimetypes', 'image/png, ')
+        self.assertTrue(self.handler._use_gzip(CONTENT, 'image/png'))
+        self.assertFalse(self.handler._use_gzip(CONTENT, 'text/plain'))
+        dav.set('gzip_level', 0)
+        self.assertFalse(self.handler._use_gzip(CONTENT, 'image/png'))
+
+    def test_gzip_iter(self):
+        pieces = [CONTENT[i:i + 1000] for i in range(0, len(CONTENT), 1000)]
+        stream = self.handler._gzip_iter(iter(pieces))
+
+        # the data is compressed while it is taken
+        first = next(stream)
+        self.assertEqual(first[:2], b'\x1f\x8b')
+        data = first + b''.join(stream)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(data)).read(),
+                         CONTENT)
+
+    def test_gzip_iter_types(self):
+        text = CONTENT.decode('ascii')
+        for DATA in (CONTENT, text, text.splitlines(True)):
+            data = b''.join(self.handler._gzip_iter(DATA))
+            self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS),
+                             CONTENT)
+
+    def test_gzip_iter_file(self):
+        # a file is read at once without the iterator option
+        self.handler._config.DAV.set('http_response_use_iterator', 0)
+        data = b''.join(self.handler._gzip_iter(io.BytesIO(CONTENT)))
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS), CONTENT)
+
+
+if __name__ == '__main__':
+    unittest.main()
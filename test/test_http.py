@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import gzip
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from six.moves import http_client
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+port = 38032
+
+CONTENT = b''.join(b'line %d\n' % i for i in range(2000))
+
+
+class Test(unittest.TestCase):
+    """ requests against a running davserver """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rundir = tempfile.mkdtemp()
+        with open(os.path.join(cls.rundir, 'f.txt'), 'wb') as fp:
+            fp.write(CONTENT)
+
+        env = dict(os.environ, PYTHONPATH=os.path.join(testdir, '..'))
+        cls.proc = subprocess.Popen(
+            [sys.executable, os.path.join(testdir, '..', 'pywebdav', 'server', 'server.py'),
+             '-D', cls.rundir, '-n', '-H', 'localhost', '--port', str(port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # wait for the server to listen
+        for i in range(50):
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.kill()
+        cls.proc.wait()
+        shutil.rmtree(cls.rundir)
+
+    def request(self, method, path, headers={}):
+        conn = http_client.HTTPConnection('localhost', port)
+        try:
+            conn.request(method, path, headers=headers)
+            res = conn.getresponse()
+            return res, res.read()
+        finally:
+            conn.close()
+
+    def test_gzip(self):
+        res, body = self.request('GET', '/f.txt', {'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(body), CONTENT)
+
+        identity, body = self.request('GET', '/f.txt')
+        self.assertEqual(body, CONTENT)
+        self.assertIsNone(identity.getheader('Content-Encoding'))
+        self.assertNotEqual(res.getheader('ETag'), identity.getheader('ETag'))
+
+    def test_gzip_not_modified(self):
+        res, body = self.request('GET', '/f.txt', {'Accept-Encoding': 'gzip'})
+        etag = res.getheader('ETag')
+
+        res, body = self.request('GET', '/f.txt', {
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(res.status, 304)
+        self.assertEqual(res.getheader('ETag'), etag)
+
+        # the client cannot decode the cached variant
+        res, body = self.request('GET', '/f.txt', {'If-None-Match': etag})
+        self.assertEqual(res.status, 200)
+
+    def test_range_not_gzipped(self):
+        res, body = self.request('GET', '/f.txt', {
+            'Accept-Encoding': 'gzip', 'Range': 'bytes=100-5199'})
+        self.assertEqual(res.status, 206)
+        self.assertIsNone(res.getheader('Content-Encoding'))
+        self.assertEqual(res.getheader('Content-Range'),
+                         'bytes 100-5199/%d' % len(CONTENT))
+        self.assertEqual(body, CONTENT[100:5200])
+
+        identity, body = self.request('GET', '/f.txt')
+        self.assertEqual(res.getheader('ETag'), identity.getheader('ETag'))
+
+    def test_multiple_ranges_not_gzipped(self):
+        res, body = self.request('GET', '/f.txt', {
+            'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9,100-109'})
+        self.assertEqual(res.status, 206)
+        self.assertIsNone(res.getheader('Content-Encoding'))
+        self.assertIn(CONTENT[0:10], body)
+        self.assertIn(CONTENT[100:110], body)
+
+    def test_overlapping_ranges(self):
+        # the resource is sent once, not once per range
+        res, body = self.request('GET', '/f.txt', {
+            'Range': 'bytes=' + ','.join(['0-'] * 50)})
+        self.assertEqual(res.status, 200)
+        self.assertIsNone(res.getheader('Content-Range'))
+        self.assertEqual(body, CONTENT)
+
+    def test_if_range_gzip_etag(self):
+        res, body = self.request('GET', '/f.txt', {'Accept-Encoding': 'gzip'})
+
+        # a range of the gzip variant cannot be served
+        res, body = self.request('GET', '/f.txt', {
+            'Range': 'bytes=0-9', 'If-Range': res.getheader('ETag')})
+        self.assertEqual(res.status, 200)
+        self.assertEqual(body, CONTENT)
+
+    def assertSameHeaders(self, headers):
+        get, body = self.request('GET', '/f.txt', headers)
+        head, body = self.request('HEAD', '/f.txt', headers)
+        self.assertEqual(body, b'')
+        self.assertEqual(head.status, get.status)
+        for name in ('Content-Length', 'Content-Type', 'Content-Encoding',
+                     'Transfer-Encoding', 'ETag', 'Last-Modified'):
+            self.assertEqual(head.getheader(name), get.getheader(name), name)
+        return head
+
+    def test_head(self):
+        head = self.assertSameHeaders({})
+        self.assertEqual(head.getheader('Content-Length'), str(len(CONTENT)))
+
+    def test_head_gzip(self):
+        self.assertSameHeaders({'Accept-Encoding': 'gzip'})
+
+    def test_head_range(self):
+        head = self.assertSameHeaders({'Range': 'bytes=0-9'})
+        self.assertEqual(head.getheader('Content-Length'), '10')
+
+    def test_keepalive(self):
+        conn = http_client.HTTPConnection('localhost', port)
+        body = (b'<?xml version="1.0"?><D:propfind xmlns:D="DAV:">'
+                b'<D:prop><D:getcontentlength/></D:prop></D:propfind>')
+        try:
+            times = []
+            sockets = set()
+            for i in range(20):
+                started = time.time()
+                conn.request('PROPFIND', '/f.txt', body, {'Depth': '0'})
+                res = conn.getresponse()
+                self.assertEqual(res.status, 207)
+                self.assertIn(b'getcontentlength', res.read())
+                times.append(time.time() - started)
+                self.assertFalse(res.will_close)
+                sockets.add(conn.sock.getsockname())
+        finally:
+            conn.close()
+
+        # all requests were sent on the first connection
+        self.assertEqual(len(sockets), 1)
+
+        # a response split into small writes is stalled by Nagle's
+        # algorithm and delayed ACKs for about 40ms
+        times.sort()
+        self.assertLess(times[len(times) // 2], 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.locks import LockTable, LockItem, parse_timeout
+from pywebdav.lib.sqlitelocks import SQLiteLockTable
+
+BASE = 'http://localhost:8008'
+
+
+def lock(path, depth='0', scope='exclusive', timeout='Infinite'):
+    return LockItem(BASE + path, 'test', '', depth=depth, timeout=timeout,
+                    lockscope=scope)
+
+
+class LockTableTests(object):
+    """ tests shared by the lock backends """
+
+    def tokens(self, locks):
+        return sorted(l.token for l in locks)
+
+    def test_add_get_remove(self):
+        l = lock('/a')
+        self.table.add(l)
+        self.assertEqual(self.table.get(l.token), l)
+        self.assertEqual(len(self.table), 1)
+        self.assertEqual(self.table.remove(l.token), l)
+        self.assertIsNone(self.table.get(l.token))
+        self.assertEqual(len(self.table), 0)
+
+    def test_covering(self):
+        top = lock('/a', depth='infinity')
+        shallow = lock('/a/b')
+        own = lock('/a/b/c')
+        for l in (top, shallow, own):
+            self.table.add(l)
+
+        # the nearest lock first, depth 0 locks only cover themselves
+        self.assertEqual(self.table.covering(BASE + '/a/b/c'), [own, top])
+        self.assertEqual(self.table.covering(BASE + '/a/b/d'), [top])
+        self.assertEqual(self.table.covering(BASE + '/x'), [])
+
+    def test_below(self):
+        top = lock('/a')
+        deep = lock('/a/b/c')
+        other = lock('/ab')
+        for l in (top, deep, other):
+            self.table.add(l)
+
+        self.assertEqual(self.table.below(BASE + '/a'), [deep])
+        self.assertTrue(self.table.has_below(BASE + '/a'))
+        self.assertFalse(self.table.has_below(BASE + '/a/b/c'))
+        self.assertEqual(self.table.below(BASE + '/x'), [])
+
+    def test_expire(self):
+        l = lock('/a', timeout=1)
+        l.modified -= 2
+        self.table.add(l)
+        self.assertIsNone(self.table.get(l.token))
+        self.assertEqual(self.table.covering(BASE + '/a'), [])
+        self.assertEqual(len(self.table), 0)
+
+    def test_refresh(self):
+        l = lock('/a', timeout=1)
+        self.table.add(l)
+        self.table.refresh(l, 100)
+        self.assertEqual(self.table.get(l.token).timeout, 100)
+
+    def test_acquire(self):
+        first = lock('/a')
+        self.assertEqual(self.table.acquire(first), [])
+        self.assertEqual(self.table.acquire(lock('/a')), [first])
+        self.assertEqual(len(self.table), 1)
+
+    def test_acquire_shared(self):
+        first = lock('/a', scope='shared')
+        second = lock('/a', scope='shared')
+        self.assertEqual(self.table.acquire(first), [])
+        self.assertEqual(self.table.acquire(second), [])
+        self.assertEqual(self.tokens(self.table.acquire(lock('/a'))),
+                         self.tokens([first, second]))
+        self.assertEqual(len(self.table), 2)
+
+    def test_acquire_collection(self):
+        member = lock('/a/b')
+        self.table.add(member)
+        # the member is locked
+        self.assertEqual(self.table.acquire(lock('/a', depth='infinity')),
+                         [member])
+        self.assertEqual(self.table.acquire(lock('/a')), [])
+
+        top = lock('/x', depth='infinity')
+        self.table.add(top)
+        self.assertEqual(self.table.acquire(lock('/x/y/z')), [top])
+
+    def test_acquire_race(self):
+        results = []
+        barrier = threading.Barrier(8)
+
+        def run():
+            l = lock('/race')
+            barrier.wait()
+            if not self.table.acquire(l):
+                results.append(l)
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(self.table.covering(BASE + '/race'), results)
+
+
+class TestLockTable(LockTableTests, unittest.TestCase):
+    def setUp(self):
+        self.table = LockTable()
+
+    def test_trie_is_pruned(self):
+        l = lock('/a/b/c')
+        self.table.add(l)
+        self.table.remove(l.token)
+        self.assertEqual(self.table._root.children, {})
+        self.assertEqual(self.table._root.count, 0)
+
+    def test_sweeper(self):
+        l = lock('/a', timeout=1)
+        self.table.add(l)
+        time.sleep(1.2)
+        # expired locks are gone without a lookup
+        self.assertEqual(self.table._tokens, {})
+
+    def test_heap(self):
+        forever = lock('/a')
+        refreshed = lock('/b', timeout=10)
+        self.table.add(forever)
+        self.table.add(refreshed)
+        self.table.refresh(refreshed, 100)
+        # both timeouts of one lock, locks without timeout are not scheduled
+        self.assertEqual(len(self.table._heap), 2)
+
+        # the entry of the first timeout is stale
+        with self.table._cond:
+            self.table._expire(time.time() + 50)
+        self.assertEqual(self.table.get(refreshed.token), refreshed)
+        with self.table._cond:
+            self.table._expire(time.time() + 200)
+        self.assertIsNone(self.table.get(refreshed.token))
+        self.assertEqual(self.table._heap, [])
+        self.assertEqual(self.table.get(forever.token), forever)
+
+
+class TestSQLiteLockTable(LockTableTests, unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'locks.db')
+        self.table = SQLiteLockTable(self.database)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared_database(self):
+        other = SQLiteLockTable(self.database)
+        self.assertEqual(other.covering(BASE + '/a'), [])
+
+        l = lock('/a')
+        self.table.add(l)
+        self.assertEqual(other.covering(BASE + '/a'), [l])
+        self.assertEqual(other.acquire(lock('/a')), [l])
+
+        self.table.remove(l.token)
+        self.assertEqual(other.covering(BASE + '/a'), [])
+
+    def test_version_checked_once_per_request(self):
+        other = SQLiteLockTable(self.database)
+        other.begin_request()
+        self.assertEqual(other.covering(BASE + '/a'), [])
+
+        # changes of others are seen by the next request
+        l = lock('/a')
+        self.table.add(l)
+        self.assertEqual(other.covering(BASE + '/a'), [])
+        other.end_request()
+
+        other.begin_request()
+        self.assertEqual(other.covering(BASE + '/a'), [l])
+        other.end_request()
+
+    def test_persistent(self):
+        l = lock('/a', timeout=100)
+        self.table.add(l)
+        reopened = SQLiteLockTable(self.database)
+        found = reopened.get(l.token)
+        self.assertEqual(found, l)
+        self.assertEqual(found.timeout, 100)
+
+
+class TestParseTimeout(unittest.TestCase):
+    def test_parse_timeout(self):
+        self.assertEqual(parse_timeout('Second-100'), 100)
+        self.assertEqual(parse_timeout('Infinite, Second-100'), 7 * 24 * 3600)
+        self.assertEqual(parse_timeout('Second-x, Second-5'), 5)
+        self.assertEqual(parse_timeout('Second-100', maximum=10), 10)
+        self.assertEqual(parse_timeout(None, maximum=0), 'Infinite')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import io
+import os
+import re
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from six.moves import configparser, http_client
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.metrics import Histogram, Metrics, CountingFile, \
+    LATENCY_BUCKETS, visit, take_visited
+
+port = 38035
+
+SAMPLE = re.compile(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)\Z')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="([^"\\]*)"(?:,|\Z)')
+
+
+def samples(metrics, name, **labels):
+    return [(l, v) for l, v in metrics[name][1]
+            if all(l.get(k) == v for k, v in labels.items())]
+
+
+class PrometheusTestCase(unittest.TestCase):
+
+    def parse(self, text):
+        """ parse the Prometheus text format
+
+        Returns {name: (type, [(labels, value)])}, the samples of a
+        histogram are kept under the name of the histogram.
+
+        """
+        metrics = {}
+        types = {}
+        self.assertTrue(text.endswith('\n'))
+        for line in text.splitlines():
+            if line.startswith('# HELP '):
+                name, help = line[7:].split(' ', 1)
+                self.assertNotIn(name, metrics)
+                metrics[name] = (None, [])
+                continue
+            if line.startswith('# TYPE '):
+                name, type = line[7:].split(' ')
+                self.assertIn(type, ('counter', 'gauge', 'histogram'))
+                self.assertEqual(metrics[name], (None, []))
+                metrics[name] = (type, [])
+                types[name] = type
+                continue
+
+            m = SAMPLE.match(line)
+            self.assertIsNotNone(m, line)
+            name, labels, value = m.groups()
+            base = re.sub(r'_(bucket|sum|count)\Z', '', name)
+            if types.get(base) != 'histogram':
+                base = name
+            self.assertIn(base, types, line)
+
+            pairs = {}
+            if labels:
+                pos = 0
+                for l in LABEL.finditer(labels):
+                    self.assertEqual(l.start(), pos, line)
+                    pairs[l.group(1)] = l.group(2)
+                    pos = l.end()
+                self.assertEqual(pos, len(labels), line)
+            pairs['__name__'] = name
+            metrics[base][1].append((pairs, float(value)))
+        return metrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        hist = Histogram((1, 10))
+        for value in (0.5, 1, 5, 100):
+            hist.observe(value)
+        # the upper bounds are inclusive
+        self.assertEqual(hist.counts, [2, 1, 1])
+        self.assertEqual(hist.sum, 106.5)
+
+    def test_lines(self):
+        hist = Histogram((1, 10))
+        for value in (0.5, 5, 100):
+            hist.observe(value)
+        self.assertEqual(list(hist.lines('h', 'a="b",')), [
+            'h_bucket{a="b",le="1"} 1',
+            'h_bucket{a="b",le="10"} 2',
+            'h_bucket{a="b",le="+Inf"} 3',
+            'h_sum{a="b"} 105.5',
+            'h_count{a="b"} 3',
+        ])
+
+
+class TestMetrics(PrometheusTestCase):
+    def test_render(self):
+        metrics = Metrics()
+        metrics.observe('GET', 200, 0.003, 100, 2000, 0)
+        metrics.observe('GET', 200, 0.2, 100, 3000, 0)
+        metrics.observe('GET', 404, 0.001, 90, 10, 0)
+        metrics.observe('PROPFIND', 207, 0.02, 300, 5000, 42)
+        text = metrics.render([('pywebdav_locks', 'gauge', 'Active locks', 3)])
+        parsed = self.parse(text)
+
+        latency = parsed['pywebdav_request_duration_seconds']
+        self.assertEqual(latency[0], 'histogram')
+        buckets = samples(parsed, 'pywebdav_request_duration_seconds',
+                          __name__='pywebdav_request_duration_seconds_bucket',
+                          method='GET', status='200')
+        self.assertEqual(len(buckets), len(LATENCY_BUCKETS) + 1)
+        counts = [v for l, v in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(buckets[-1], ({
+            '__name__': 'pywebdav_request_duration_seconds_bucket',
+            'method': 'GET', 'status': '200', 'le': '+Inf'}, 2))
+        count, = samples(parsed, 'pywebdav_request_duration_seconds',
+                         __name__='pywebdav_request_duration_seconds_count',
+                         method='GET', status='200')
+        self.assertEqual(count[1], 2)
+        total, = samples(parsed, 'pywebdav_request_duration_seconds',
+                         __name__='pywebdav_request_duration_seconds_sum',
+                         method='GET', status='404')
+        self.assertAlmostEqual(total[1], 0.001)
+
+        self.assertEqual(samples(parsed, 'pywebdav_read_bytes_total',
+                                 method='GET')[0][1], 290)
+        self.assertEqual(samples(parsed, 'pywebdav_written_bytes_total',
+                                 method='PROPFIND')[0][1], 5000)
+
+        # only the tree methods count visited resources
+        visited = parsed['pywebdav_visited_resources'][1]
+        self.assertEqual(set(l['method'] for l, v in visited), {'PROPFIND'})
+        self.assertEqual(samples(parsed, 'pywebdav_visited_resources',
+                                 __name__='pywebdav_visited_resources_sum')[0][1],
+                         42)
+
+        self.assertEqual(parsed['pywebdav_locks'], ('gauge', [
+            ({'__name__': 'pywebdav_locks'}, 3)]))
+
+    def test_empty(self):
+        parsed = self.parse(Metrics().render())
+        self.assertEqual(parsed['pywebdav_request_duration_seconds'],
+                         ('histogram', []))
+
+    def test_visit(self):
+        take_visited()
+        visit()
+        visit(10)
+        self.assertEqual(take_visited(), 11)
+        self.assertEqual(take_visited(), 0)
+
+
+class TestCountingFile(unittest.TestCase):
+    def test_read(self):
+        fp = CountingFile(io.BytesIO(b'line 1\nline 2\nrest'))
+        self.assertEqual(fp.readline(), b'line 1\n')
+        self.assertEqual(fp.read(3), b'lin')
+        buf = bytearray(4)
+        self.assertEqual(fp.readinto(buf), 4)
+        self.assertEqual(fp.read(), b'rest')
+        self.assertEqual(fp.count, 18)
+        # other attributes are the ones of the file
+        self.assertEqual(fp.tell(), 18)
+
+    def test_readinto_fallback(self):
+        class Reader(object):
+            def __init__(self, data):
+                self.read = io.BytesIO(data).read
+
+        fp = CountingFile(Reader(b'abcdef'))
+        buf = bytearray(4)
+        self.assertEqual(fp.readinto(buf), 4)
+        self.assertEqual(bytes(buf), b'abcd')
+        self.assertEqual(fp.readinto(buf), 2)
+        self.assertEqual(fp.count, 6)
+
+    def test_write(self):
+        out = io.BytesIO()
+        fp = CountingFile(out)
+        fp.write(b'abc')
+        fp.write(memoryview(b'defg'))
+        self.assertEqual(fp.count, 7)
+        self.assertEqual(out.getvalue(), b'abcdefg')
+
+
+class TestServer(PrometheusTestCase):
+    """ the metrics of a running server """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rundir = tempfile.mkdtemp()
+        root = os.path.join(cls.rundir, 'root')
+        os.mkdir(root)
+        with open(os.path.join(root, 'f.txt'), 'wb') as fp:
+            fp.write(b'x' * 1000)
+
+        parser = configparser.RawConfigParser()
+        parser.read(os.path.join(testdir, '..', 'pywebdav', 'server', 'config.ini'))
+        for name, value in (('host', 'localhost'), ('port', str(port)),
+                            ('noauth', '1'), ('verbose', '0'),
+                            ('directory', root),
+                            ('metrics_path', '/metrics')):
+            parser.set('DAV', name, value)
+        config = os.path.join(cls.rundir, 'config.ini')
+        with open(config, 'w') as fp:
+            parser.write(fp)
+
+        env = dict(os.environ, PYTHONPATH=os.path.join(testdir, '..'))
+        cls.proc = subprocess.Popen(
+            [sys.executable, os.path.join(testdir, '..', 'pywebdav', 'server', 'server.py'),
+             '-c', config],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        for i in range(50):
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.kill()
+        cls.proc.wait()
+        shutil.rmtree(cls.rundir)
+
+    def request(self, method, path, body=None, headers={}):
+        conn = http_client.HTTPConnection('localhost', port)
+        try:
+            conn.request(method, path, body, headers)
+            res = conn.getresponse()
+            return res, res.read()
+        finally:
+            conn.close()
+
+    def test_metrics(self):
+        res, body = self.request('GET', '/f.txt')
+        self.assertEqual(res.status, 200)
+        self.request('GET', '/missing')
+        self.request('PROPFIND', '/', headers={'Depth': '1'})
+
+        # a request is recorded after its response was sent
+        for i in range(50):
+            res, body = self.request('GET', '/metrics?x=1')
+            self.assertEqual(res.status, 200)
+            self.assertTrue(res.getheader('Content-Type').startswith('text/plain'))
+            parsed = self.parse(body.decode('utf-8'))
+            recorded = [samples(parsed, 'pywebdav_request_duration_seconds',
+                                __name__='pywebdav_request_duration_seconds_count',
+                                method=method, status=status)
+                        for method, status in (('GET', '200'), ('GET', '404'),
+                                               ('PROPFIND', '207'))]
+            if all(recorded):
+                break
+            time.sleep(0.05)
+
+        count, = samples(parsed, 'pywebdav_request_duration_seconds',
+                         __name__='pywebdav_request_duration_seconds_count',
+                         method='GET', status='200')
+        self.assertGreaterEqual(count[1], 1)
+        self.assertTrue(samples(parsed, 'pywebdav_request_duration_seconds',
+                                method='GET', status='404'))
+        written, = samples(parsed, 'pywebdav_written_bytes_total', method='GET')
+        self.assertGreater(written[1], 1000)
+
+        # the PROPFIND visited the collection and its member
+        visited, = samples(parsed, 'pywebdav_visited_resources',
+                           __name__='pywebdav_visited_resources_sum',
+                           method='PROPFIND')
+        self.assertGreaterEqual(visited[1], 2)
+        self.assertEqual(parsed['pywebdav_locks'][0], 'gauge')
+        self.assertGreaterEqual(parsed['pywebdav_requests_total'][1][0][1], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
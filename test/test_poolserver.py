@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+import subprocess
+from six.moves import configparser
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+port = 38033
+
+THREADS = 4
+
+OPTIONS = {
+    'host': 'localhost',
+    'port': str(port),
+    'noauth': '1',
+    'engine': 'pool',
+    'pool_threads': str(THREADS),
+    'pool_queue': '8',
+    'keepalive_timeout': '15',
+    'verbose': '0',
+}
+
+REQUEST = b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def read_response(fp):
+    """ read one response with a Content-Length or chunked body """
+    status = fp.readline()
+    headers = {}
+    while True:
+        line = fp.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        fp.read(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int(fp.readline().split(b';')[0], 16)
+            fp.read(size + 2)
+            if size == 0:
+                break
+    return status, headers
+
+
+class Test(unittest.TestCase):
+    """ the pool engine must not let idle clients hold its threads """
+
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        root = os.path.join(self.rundir, 'root')
+        os.mkdir(root)
+
+        # the example config with a small pool
+        parser = configparser.RawConfigParser()
+        parser.read(os.path.join(testdir, '..', 'pywebdav', 'server', 'config.ini'))
+        for name, value in OPTIONS.items():
+            parser.set('DAV', name, value)
+        parser.set('DAV', 'directory', root)
+        config = os.path.join(self.rundir, 'config.ini')
+        with open(config, 'w') as fp:
+            parser.write(fp)
+
+        env = dict(os.environ, PYTHONPATH=os.path.join(testdir, '..'))
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.join(testdir, '..', 'pywebdav', 'server', 'server.py'),
+             '-c', config],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        for i in range(50):
+            try:
+                socket.create_connection(('localhost', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        self.proc.kill()
+        self.proc.wait()
+        shutil.rmtree(self.rundir)
+
+    def connect(self):
+        sock = socket.create_connection(('localhost', port), timeout=10)
+        self.sockets.append(sock)
+        return sock
+
+    def test_idle_clients(self):
+        # every thread waits for the next request of an idle client
+        for i in range(THREADS):
+            sock = self.connect()
+            sock.sendall(REQUEST)
+            status, headers = read_response(sock.makefile('rb'))
+            self.assertIn(b' 200 ', status)
+            self.assertNotEqual(headers.get('connection'), 'close')
+
+        started = time.time()
+        sock = self.connect()
+        sock.sendall(REQUEST)
+        status, headers = read_response(sock.makefile('rb'))
+        self.assertIn(b' 200 ', status)
+        self.assertLess(time.time() - started, 2)
+
+    def test_pipelined(self):
+        # a buffered request is not taken for an idle connection
+        sock = self.connect()
+        sock.sendall(REQUEST * 3)
+        fp = sock.makefile('rb')
+        for i in range(3):
+            self.assertIn(b' 200 ', read_response(fp)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
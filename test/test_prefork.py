@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import errno
+import signal
+import shutil
+import tempfile
+import threading
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.server import prefork
+
+WORKERS = 2
+
+
+class Runner(object):
+    """ server stand-in, every worker leaves a file named by its pid """
+
+    def __init__(self, rundir):
+        self.rundir = rundir
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        open(os.path.join(self.rundir, str(os.getpid())), 'w').close()
+        while not self._stopped.wait(0.1):
+            pass
+
+    def shutdown(self):
+        self._stopped.set()
+
+    def server_close(self):
+        pass
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno != errno.ESRCH
+    return True
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'needs fork()')
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.rundir)
+
+        self.master = os.fork()
+        if self.master == 0:
+            status = 1
+            try:
+                prefork.POLL_INTERVAL = 0.05
+                prefork.RESPAWN_DELAY = 0
+                prefork.serve_forever(Runner(self.rundir), WORKERS)
+                status = 0
+            finally:
+                os._exit(status)
+
+    def tearDown(self):
+        if self.master:
+            os.kill(self.master, signal.SIGKILL)
+            os.waitpid(self.master, 0)
+        for pid in self.started():
+            if alive(pid):
+                os.kill(pid, signal.SIGKILL)
+
+    def started(self):
+        return set(int(name) for name in os.listdir(self.rundir))
+
+    def wait_started(self, count):
+        for i in range(100):
+            pids = self.started()
+            if len(pids) >= count:
+                return pids
+            time.sleep(0.05)
+        self.fail('%d of %d workers started' % (len(pids), count))
+
+    def wait_exited(self, pids):
+        for i in range(100):
+            if not any(alive(pid) for pid in pids):
+                return
+            time.sleep(0.05)
+        self.fail('workers %s still running' % [p for p in pids if alive(p)])
+
+    def stop(self):
+        os.kill(self.master, signal.SIGTERM)
+        pid, status = os.waitpid(self.master, 0)
+        self.master = None
+        self.assertEqual(status, 0)
+
+    def test_stop(self):
+        workers = self.wait_started(WORKERS)
+        self.assertEqual(len(workers), WORKERS)
+        self.stop()
+        self.wait_exited(workers)
+
+    def test_restart(self):
+        workers = self.wait_started(WORKERS)
+        dead = workers.pop()
+        os.kill(dead, signal.SIGKILL)
+
+        # a new worker replaces the dead one
+        replaced = self.wait_started(WORKERS + 1) - workers - set([dead])
+        self.assertEqual(len(replaced), 1)
+        self.assertTrue(all(alive(pid) for pid in workers | replaced))
+
+        self.stop()
+        self.wait_exited(workers | replaced)
+
+    def test_reload(self):
+        old = self.wait_started(WORKERS)
+        os.kill(self.master, signal.SIGHUP)
+
+        # new workers are started, the old ones are stopped
+        new = self.wait_started(2 * WORKERS) - old
+        self.assertEqual(len(new), WORKERS)
+        self.wait_exited(old)
+        self.assertTrue(all(alive(pid) for pid in new))
+
+        self.stop()
+        self.wait_exited(new)
+
+
+if __name__ == '__main__':
+    unittest.main()
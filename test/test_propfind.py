@@ -0,0 +1,268 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from xml.dom import minidom
+from six.moves import urllib
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib import utils
+from pywebdav.lib.errors import DAV_Error, DAV_Forbidden
+from pywebdav.lib.propfind import PROPFIND, PROPS_BATCH_SIZE
+from pywebdav.server.fshandler import FilesystemHandler
+
+BASE = 'http://localhost:8008/'
+NS = 'http://example.com/ns'
+
+
+class Handler(FilesystemHandler):
+    """ a handler with properties in another namespace """
+
+    PROPS = dict(FilesystemHandler.PROPS)
+    PROPS[NS] = ('color', 'doc')
+    M_NS = dict(FilesystemHandler.M_NS)
+    M_NS[NS] = '_get_ex'
+
+    # get_props() raises for these resources
+    failing = ()
+
+    def _get_ex_color(self, uri):
+        return 'red & "blue" <green>'
+
+    def _get_ex_doc(self, uri):
+        doc = minidom.parseString('<x:doc xmlns:x="%s">text<x:i/></x:doc>' % NS)
+        return doc.documentElement
+
+    def get_props(self, uris, proplist, infos=None):
+        for uri in uris:
+            if uri in self.failing:
+                raise DAV_Forbidden
+        return FilesystemHandler.get_props(self, uris, proplist, infos)
+
+
+def propfind_body(*props):
+    return ('<?xml version="1.0"?><D:propfind xmlns:D="DAV:" xmlns:x="%s">'
+            '<D:prop>%s</D:prop></D:propfind>' % (NS, ''.join(props)))
+
+
+def dom_multistatus(pf, propname=False):
+    """ the multistatus document built with the DOM like it was before
+    the serializer was written by hand """
+    doc = minidom.getDOMImplementation().createDocument(None, "multistatus", None)
+    ms = doc.documentElement
+    ms.setAttribute("xmlns:D", "DAV:")
+    ms.tagName = 'D:multistatus'
+
+    for uri, info in pf.get_uris():
+        re = doc.createElement("D:response")
+        if not propname:
+            for nsnum, nsname in enumerate(pf.namespaces):
+                if nsname != 'DAV:':
+                    re.setAttribute("xmlns:ns" + str(nsnum), nsname)
+
+        uparts = urllib.parse.urlparse(uri)
+        href = doc.createElement("D:href")
+        href.appendChild(doc.createTextNode(
+            uparts[0] + '://' + '/'.join(uparts[1:2]) +
+            urllib.parse.quote(uparts[2])))
+        re.appendChild(href)
+
+        if propname:
+            ps = doc.createElement("D:propstat")
+            for nsnum, (ns, plist) in enumerate(
+                    pf._dataclass.get_propnames(uri).items()):
+                pr = doc.createElement("D:prop")
+                pr.setAttribute("xmlns:ns" + str(nsnum), ns)
+                for p in plist:
+                    pr.appendChild(doc.createElement("ns%d:%s" % (nsnum, p)))
+                ps.appendChild(pr)
+            re.appendChild(ps)
+            ms.appendChild(re)
+            continue
+
+        good_props, bad_props = pf.get_propvalues(uri)
+        ps = doc.createElement("D:propstat")
+        gp = doc.createElement("D:prop")
+        for ns in good_props:
+            for p, v in good_props[ns].items():
+                pe = doc.createElement(pf._ns_prefix(ns) + str(p))
+                if isinstance(v, minidom.Element):
+                    pe.appendChild(v)
+                elif isinstance(v, list):
+                    for val in v:
+                        pe.appendChild(val)
+                elif p == "resourcetype":
+                    if v == 1:
+                        pe.appendChild(doc.createElement("D:collection"))
+                else:
+                    pe.appendChild(doc.createTextNode(str(v)))
+                gp.appendChild(pe)
+        ps.appendChild(gp)
+        s = doc.createElement("D:status")
+        s.appendChild(doc.createTextNode("HTTP/1.1 200 OK"))
+        ps.appendChild(s)
+        re.appendChild(ps)
+
+        for ecode in bad_props:
+            ps = doc.createElement("D:propstat")
+            bp = doc.createElement("D:prop")
+            for ns in bad_props[ecode]:
+                for p in bad_props[ecode][ns]:
+                    bp.appendChild(doc.createElement(pf._ns_prefix(ns) + str(p)))
+            ps.appendChild(bp)
+            s = doc.createElement("D:status")
+            s.appendChild(doc.createTextNode(utils.gen_estring(ecode)))
+            ps.appendChild(s)
+            re.appendChild(ps)
+        ms.appendChild(re)
+
+    return doc.toxml(encoding="utf-8")
+
+
+def canonical(node):
+    """ the elements and the text of a document, independent of the
+    namespace prefixes """
+    if node.nodeType == node.TEXT_NODE:
+        return node.data
+    children = []
+    for child in node.childNodes:
+        if child.nodeType == node.TEXT_NODE and children and \
+                isinstance(children[-1], str):
+            children[-1] += child.data
+        elif child.nodeType in (node.ELEMENT_NODE, node.TEXT_NODE):
+            children.append(canonical(child))
+    return (node.namespaceURI, node.localName, children)
+
+
+class TestPropfind(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, 'dir'))
+        for name in ('a.txt', 'b & c.txt', 'dir/d.txt'):
+            with open(os.path.join(self.root, name), 'wb') as fp:
+                fp.write(b'data')
+        self.dc = Handler(self.root, BASE)
+        self.dc.baseurl = None
+        self.dc.mimecheck = True
+
+    def propfind(self, body, depth='1', uri=BASE):
+        pf = PROPFIND(uri, self.dc, depth, body)
+        return pf, b''.join(pf.createResponse())
+
+    def assertSameAsDOM(self, body, depth='1', propname=False):
+        pf, data = self.propfind(body, depth)
+        ref = PROPFIND(BASE, self.dc, depth, body)
+        # sets the properties of an allprop request
+        ref.createResponse()
+        expected = dom_multistatus(ref, propname)
+        doc = minidom.parseString(data)
+        self.assertEqual(canonical(doc.documentElement),
+                         canonical(minidom.parseString(expected).documentElement))
+        return doc
+
+    def statuses(self, doc):
+        """ {href: status} of the responses with a plain status """
+        result = {}
+        for res in doc.getElementsByTagNameNS('DAV:', 'response'):
+            status = [e for e in res.childNodes if e.localName == 'status']
+            if status:
+                href = res.getElementsByTagNameNS('DAV:', 'href')[0]
+                result[href.firstChild.data] = status[0].firstChild.data
+        return result
+
+    def test_prop(self):
+        doc = self.assertSameAsDOM(propfind_body(
+            '<D:getcontentlength/>', '<D:resourcetype/>', '<D:nosuchprop/>'))
+        self.assertEqual(len(doc.getElementsByTagNameNS('DAV:', 'response')), 4)
+
+    def test_namespaced_prop(self):
+        doc = self.assertSameAsDOM(propfind_body(
+            '<D:displayname/>', '<x:color/>', '<x:doc/>', '<x:nosuchprop/>'))
+        colors = doc.getElementsByTagNameNS(NS, 'color')
+        self.assertEqual(colors[0].firstChild.data, 'red & "blue" <green>')
+        self.assertEqual(len(doc.getElementsByTagNameNS(NS, 'i')), 4)
+
+    def test_propname(self):
+        body = ('<?xml version="1.0"?><D:propfind xmlns:D="DAV:">'
+                '<D:propname/></D:propfind>')
+        self.assertSameAsDOM(body, propname=True)
+
+    def test_allprop(self):
+        body = ('<?xml version="1.0"?><D:propfind xmlns:D="DAV:">'
+                '<D:allprop/></D:propfind>')
+        doc = self.assertSameAsDOM(body, 'infinity')
+        self.assertEqual(len(doc.getElementsByTagNameNS('DAV:', 'response')), 5)
+        self.assertEqual(len(doc.getElementsByTagNameNS(NS, 'color')), 5)
+
+    def test_error_of_requested_resource(self):
+        # raised before the status of the response is sent
+        self.dc.failing = (BASE.rstrip('/'),)
+        pf = PROPFIND(BASE, self.dc, '1', propfind_body('<D:getetag/>'))
+        with self.assertRaises(DAV_Error) as cm:
+            pf.createResponse()
+        self.assertEqual(cm.exception.args[0], 403)
+
+    def test_error_of_member(self):
+        self.dc.failing = (BASE + 'a.txt',)
+        pf, data = self.propfind(propfind_body('<D:getetag/>'))
+        doc = minidom.parseString(data)
+        self.assertEqual(self.statuses(doc), {
+            BASE + 'a.txt': 'HTTP/1.1 403 Forbidden'})
+        self.assertEqual(len(doc.getElementsByTagNameNS('DAV:', 'getetag')), 3)
+
+    def test_error_in_later_batch(self):
+        for i in range(PROPS_BATCH_SIZE + 10):
+            with open(os.path.join(self.root, 'dir', 'f%03d' % i), 'wb'):
+                pass
+        failing = BASE + 'dir/f%03d' % (PROPS_BATCH_SIZE + 5)
+        self.dc.failing = (failing,)
+        pf = PROPFIND(BASE + 'dir', self.dc, '1', propfind_body('<D:getetag/>'))
+        # the first batch is fine
+        result = pf.createResponse()
+        doc = minidom.parseString(b''.join(result))
+        self.assertEqual(self.statuses(doc), {failing: 'HTTP/1.1 403 Forbidden'})
+        self.assertEqual(len(doc.getElementsByTagNameNS('DAV:', 'response')),
+                         PROPS_BATCH_SIZE + 12)
+
+    def test_propname_error(self):
+        get_propnames = self.dc.get_propnames
+
+        def failing(uri):
+            if uri.endswith('a.txt'):
+                raise DAV_Forbidden
+            return get_propnames(uri)
+
+        self.dc.get_propnames = failing
+        pf, data = self.propfind(
+            '<?xml version="1.0"?><D:propfind xmlns:D="DAV:">'
+            '<D:propname/></D:propfind>')
+        self.assertEqual(self.statuses(minidom.parseString(data)), {
+            BASE + 'a.txt': 'HTTP/1.1 403 Forbidden'})
+
+    def test_listing_error(self):
+        get_childs_info = self.dc.get_childs_info
+
+        def failing(uri):
+            if uri.rstrip('/').endswith('dir'):
+                raise DAV_Forbidden
+            return get_childs_info(uri)
+
+        self.dc.get_childs_info = failing
+        pf, data = self.propfind(propfind_body('<D:getetag/>'), 'infinity')
+        hrefs = [e.firstChild.data for e in
+                 minidom.parseString(data).getElementsByTagNameNS('DAV:', 'href')]
+        # the members of dir are left out
+        self.assertEqual(len(hrefs), 4)
+        self.assertIn(BASE + 'dir', hrefs)
+
+        # but not the ones of the requested collection
+        pf = PROPFIND(BASE + 'dir', self.dc, 'infinity', propfind_body('<D:getetag/>'))
+        self.assertRaises(DAV_Error, pf.createResponse)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.server.fshandler import StatCache
+
+
+class TestStatCache(unittest.TestCase):
+    def test_size(self):
+        cache = StatCache(size=3)
+        for name in 'abcd':
+            cache.set('/r/' + name, name)
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn('/r/a', cache)
+
+        # a lookup makes an entry recent
+        cache.get('/r/b')
+        cache.set('/r/e', 'e')
+        self.assertIn('/r/b', cache)
+        self.assertNotIn('/r/c', cache)
+
+    def test_invalidate(self):
+        cache = StatCache()
+        for path in ('/r', '/r/a', '/r/a/b', '/r/a/b/c', '/r/a2', '/r/x'):
+            cache.set(path, path)
+
+        cache.invalidate('/r/a')
+        self.assertNotIn('/r/a', cache)
+        self.assertNotIn('/r/a/b', cache)
+        self.assertNotIn('/r/a/b/c', cache)
+        # the parent changed as well
+        self.assertNotIn('/r', cache)
+        self.assertIn('/r/a2', cache)
+        self.assertIn('/r/x', cache)
+
+    def test_invalidate_evicted_directory(self):
+        cache = StatCache(size=2)
+        cache.set('/r/a', 'a')
+        cache.set('/r/a/b/c', 'c')
+        cache.set('/r/x', 'x')
+        self.assertNotIn('/r/a', cache)
+
+        # the descendants of an evicted directory are still found
+        cache.invalidate('/r/a')
+        self.assertNotIn('/r/a/b/c', cache)
+        self.assertIn('/r/x', cache)
+
+    def test_index_is_cleaned_up(self):
+        cache = StatCache(size=1)
+        for i in range(100):
+            cache.set('/r/d%d/f' % i, i)
+        cache.invalidate('/r/d99/f')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache._childs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
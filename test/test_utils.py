@@ -0,0 +1,226 @@
+import os
+import sys
+import unittest
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.lib.utils import etag_matches, parse_http_date, rfc1123_date, \
+    rfc850_date, parse_byte_ranges, gzip_etag, walk_tree, create_treelist, \
+    create_treeinfo, MAX_RANGES
+from pywebdav.lib.errors import DAV_Forbidden
+
+
+class Tree(object):
+    """ a dataclass with a tree of collections and members in memory """
+
+    def __init__(self, members):
+        # collection: [member, ...]
+        self.members = members
+        self.listed = []
+
+    def is_collection(self, uri):
+        return uri in self.members
+
+    def get_childs_info(self, uri):
+        self.listed.append(uri)
+        if self.members[uri] is None:
+            raise DAV_Forbidden
+        for child in self.members[uri]:
+            yield child, child in self.members, 'info of ' + child
+
+
+TREE = {
+    '/r': ['/r/a', '/r/c', '/r/z'],
+    '/r/c': ['/r/c/d', '/r/c/e'],
+    '/r/c/e': [],
+}
+
+
+class TestEtagMatches(unittest.TestCase):
+    def test_match(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('"x", "a"', '"a"'))
+        self.assertTrue(etag_matches(' "x" ,"a" ', '"a"'))
+        self.assertFalse(etag_matches('"x", "y"', '"a"'))
+        self.assertFalse(etag_matches('', '"a"'))
+
+    def test_star(self):
+        self.assertTrue(etag_matches('*', '"a"'))
+        self.assertTrue(etag_matches('*', 'W/"a"', weak=True))
+        # no resource, nothing matches
+        self.assertFalse(etag_matches('*', None))
+
+    def test_weak(self):
+        self.assertTrue(etag_matches('W/"a"', '"a"'))
+        self.assertTrue(etag_matches('"a"', 'W/"a"'))
+        self.assertTrue(etag_matches('W/"a"', 'W/"a"'))
+
+    def test_strong(self):
+        self.assertTrue(etag_matches('"a"', '"a"', weak=False))
+        self.assertFalse(etag_matches('W/"a"', '"a"', weak=False))
+        self.assertFalse(etag_matches('"a"', 'W/"a"', weak=False))
+        self.assertFalse(etag_matches('W/"a"', 'W/"a"', weak=False))
+        self.assertTrue(etag_matches('W/"a", "a"', '"a"', weak=False))
+
+
+class TestParseHttpDate(unittest.TestCase):
+    ts = 784111777
+
+    def test_formats(self):
+        # the three formats of RFC 7231, 7.1.1.1
+        self.assertEqual(parse_http_date('Sun, 06 Nov 1994 08:49:37 GMT'),
+                         self.ts)
+        self.assertEqual(parse_http_date('Sunday, 06-Nov-94 08:49:37 GMT'),
+                         self.ts)
+        self.assertEqual(parse_http_date('Sun Nov  6 08:49:37 1994'), self.ts)
+
+    def test_roundtrip(self):
+        self.assertEqual(parse_http_date(rfc1123_date(self.ts)), self.ts)
+        self.assertEqual(parse_http_date(rfc850_date(self.ts)), self.ts)
+
+    def test_invalid(self):
+        for value in (None, '', 'yesterday', '"etag"',
+                      'Sun, 99 Nov 1994 08:49:37 GMT',
+                      'Sun, 06 Nov 1994 25:49:37 GMT'):
+            self.assertIsNone(parse_http_date(value), value)
+
+
+class TestParseByteRanges(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_byte_ranges('bytes=0-499', 1000), [(0, 500)])
+        self.assertEqual(parse_byte_ranges('bytes=500-', 1000), [(500, 1000)])
+        self.assertEqual(parse_byte_ranges('bytes=-200', 1000), [(800, 1000)])
+        self.assertEqual(parse_byte_ranges(' Bytes = 1-1 ', 1000), [(1, 2)])
+
+    def test_clip(self):
+        # ranges beyond the end are shortened
+        self.assertEqual(parse_byte_ranges('bytes=900-2000', 1000),
+                         [(900, 1000)])
+        self.assertEqual(parse_byte_ranges('bytes=-2000', 1000), [(0, 1000)])
+
+    def test_coalesce(self):
+        self.assertEqual(parse_byte_ranges('bytes=500-599,0-99,50-149', 1000),
+                         [(0, 150), (500, 600)])
+        # adjacent ones too
+        self.assertEqual(parse_byte_ranges('bytes=0-99,100-199', 1000),
+                         [(0, 200)])
+        self.assertEqual(parse_byte_ranges('bytes=0-0,2-2,-1', 4),
+                         [(0, 1), (2, 4)])
+
+    def test_whole(self):
+        # a single range for the whole resource is kept
+        self.assertEqual(parse_byte_ranges('bytes=0-', 1000), [(0, 1000)])
+        # several ranges which add up to it are ignored
+        self.assertIsNone(parse_byte_ranges('bytes=0-,0-,0-', 1000))
+        self.assertIsNone(parse_byte_ranges('bytes=0-499,500-', 1000))
+        self.assertIsNone(parse_byte_ranges('bytes=0-0,-1', 1))
+
+    def test_too_many(self):
+        ranges = ','.join('%d-%d' % (i * 10, i * 10) for i in range(MAX_RANGES))
+        self.assertEqual(len(parse_byte_ranges('bytes=' + ranges, 10000)),
+                         MAX_RANGES)
+        self.assertIsNone(parse_byte_ranges('bytes=' + ranges + ',5000-', 10000))
+        self.assertIsNone(parse_byte_ranges('bytes=' + '0-0,' * 1000, 10000))
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_byte_ranges('bytes=1000-', 1000), [])
+        self.assertEqual(parse_byte_ranges('bytes=1000-1999,2000-', 1000), [])
+        self.assertEqual(parse_byte_ranges('bytes=-0', 1000), [])
+        self.assertEqual(parse_byte_ranges('bytes=0-', 0), [])
+        # one satisfiable range is enough
+        self.assertEqual(parse_byte_ranges('bytes=2000-,0-9', 1000), [(0, 10)])
+
+    def test_invalid(self):
+        for header in ('', 'bytes', 'items=0-1', 'bytes=', 'bytes=,',
+                       'bytes=1', 'bytes=-', 'bytes=a-b', 'bytes=5-1',
+                       'bytes=0-1,x', 'bytes=+1-2', 'bytes=1-2-3'):
+            self.assertIsNone(parse_byte_ranges(header, 1000), header)
+
+
+class TestWalkTree(unittest.TestCase):
+    def walk(self, **kw):
+        return [uri for uri, iscol, info in walk_tree(Tree(TREE), '/r', **kw)]
+
+    def test_pre_order(self):
+        self.assertEqual(self.walk(), [
+            '/r', '/r/a', '/r/c', '/r/c/d', '/r/c/e', '/r/z'])
+
+    def test_post_order(self):
+        self.assertEqual(self.walk(post_order=True), [
+            '/r/a', '/r/c/d', '/r/c/e', '/r/c', '/r/z', '/r'])
+
+    def test_info(self):
+        result = list(walk_tree(Tree(TREE), '/r'))
+        self.assertEqual(result[0], ('/r', True, None))
+        self.assertEqual(result[2], ('/r/c', True, 'info of /r/c'))
+        self.assertEqual(result[3], ('/r/c/d', False, 'info of /r/c/d'))
+        # a resource which is no collection
+        self.assertEqual(list(walk_tree(Tree(TREE), '/r/a')),
+                         [('/r/a', False, None)])
+
+    def test_lazy(self):
+        tree = Tree(TREE)
+        walk = walk_tree(tree, '/r')
+        self.assertEqual(next(walk)[0], '/r')
+        self.assertEqual(tree.listed, [])
+        self.assertEqual([next(walk)[0] for i in range(3)],
+                         ['/r/a', '/r/c', '/r/c/d'])
+        self.assertEqual(tree.listed, ['/r', '/r/c'])
+
+    def test_prune(self):
+        pruned = []
+
+        def prune(uri):
+            pruned.append(uri)
+            return uri == '/r/c'
+
+        self.assertEqual(self.walk(prune=prune),
+                         ['/r', '/r/a', '/r/c', '/r/z'])
+        self.assertEqual(pruned, ['/r', '/r/c'])
+
+        # in post-order the pruned collection still comes last
+        del pruned[:]
+        self.assertEqual(self.walk(post_order=True, prune=prune),
+                         ['/r/a', '/r/c', '/r/z', '/r'])
+
+        # in pre-order prune is called after the collection was yielded
+        seen = []
+        walk = walk_tree(Tree(TREE), '/r', prune=lambda uri: uri in seen)
+        for uri, iscol, info in walk:
+            if uri == '/r/c':
+                seen.append(uri)
+        self.assertEqual(seen, ['/r/c'])
+
+    def test_onerror(self):
+        tree = dict(TREE)
+        tree['/r/c'] = None
+        self.assertRaises(DAV_Forbidden, list, walk_tree(Tree(tree), '/r'))
+
+        errors = []
+        result = [uri for uri, iscol, info in walk_tree(
+            Tree(tree), '/r', onerror=lambda uri, e: errors.append((uri, e)))]
+        self.assertEqual(result, ['/r', '/r/a', '/r/c', '/r/z'])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], '/r/c')
+        self.assertIsInstance(errors[0][1], DAV_Forbidden)
+
+    def test_create_treeinfo(self):
+        self.assertEqual(create_treeinfo(Tree(TREE), '/r'), [
+            ('/r', True), ('/r/a', False), ('/r/c', True), ('/r/c/d', False),
+            ('/r/c/e', True), ('/r/z', False)])
+        self.assertEqual(create_treeinfo(Tree(TREE), '/r/a'), [('/r/a', False)])
+        self.assertEqual(create_treelist(Tree(TREE), '/r/c'),
+                         ['/r/c', '/r/c/d', '/r/c/e'])
+
+
+class TestGzipEtag(unittest.TestCase):
+    def test_etag(self):
+        self.assertEqual(gzip_etag('"abc"'), '"abc-gzip"')
+        self.assertEqual(gzip_etag('W/"abc"'), 'W/"abc-gzip"')
+        self.assertNotEqual(gzip_etag('"abc"'), '"abc"')
+        self.assertFalse(etag_matches(gzip_etag('"abc"'), '"abc"'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from xml.dom import minidom
+from wsgiref import simple_server
+from wsgiref.util import setup_testing_defaults
+from wsgiref.validate import validator
+from six.moves import configparser, http_client
+
+testdir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(testdir, '..'))
+
+from pywebdav.server.wsgiapp import make_app
+
+CONTENT = b''.join(b'line %d\n' % i for i in range(2000))
+
+PROPFIND = (b'<?xml version="1.0"?><D:propfind xmlns:D="DAV:">'
+            b'<D:prop><D:getcontentlength/></D:prop></D:propfind>')
+
+
+class QuietHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Test(unittest.TestCase):
+    """ DAVApplication served by wsgiref """
+
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.rundir)
+        root = os.path.join(self.rundir, 'root')
+        os.mkdir(root)
+        with open(os.path.join(root, 'f.txt'), 'wb') as fp:
+            fp.write(CONTENT)
+
+        parser = configparser.RawConfigParser()
+        parser.read(os.path.join(testdir, '..', 'pywebdav', 'server', 'config.ini'))
+        parser.set('DAV', 'directory', root)
+        parser.set('DAV', 'noauth', '1')
+        parser.set('DAV', 'verbose', '0')
+        config = os.path.join(self.rundir, 'config.ini')
+        with open(config, 'w') as fp:
+            parser.write(fp)
+
+        self.app = make_app(config)
+
+        # the requests whose end was signalled
+        self.ended = []
+        base = self.app.handler_class
+        ended = self.ended
+
+        def end_wsgi_request(handler):
+            ended.append(handler.command)
+            base.end_wsgi_request(handler)
+
+        self.app.handler_class = type('Recording', (base,), {
+            'end_wsgi_request': end_wsgi_request})
+
+        # wsgiref refuses hop-by-hop headers of the application
+        self.server = simple_server.make_server(
+            'localhost', 0, validator(self.app), handler_class=QuietHandler)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, method, path, body=None, headers={}):
+        conn = http_client.HTTPConnection('localhost', self.server.server_port)
+        try:
+            conn.request(method, path, body, headers)
+            res = conn.getresponse()
+            return res, res.read()
+        finally:
+            conn.close()
+
+    def assertEnded(self, methods):
+        # the server closes the result after the client got the body
+        deadline = time.time() + 5
+        while self.ended != methods and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.ended, methods)
+
+    def call(self, method, path, body=b'', **environ):
+        """ call the application like a server decoding a chunked body """
+        env = {'REQUEST_METHOD': method, 'PATH_INFO': path,
+               'wsgi.input': io.BytesIO(body), 'wsgi.errors': io.StringIO()}
+        env.update(environ)
+        setup_testing_defaults(env)
+        started = []
+
+        def start_response(status, headers):
+            started.append((status, headers))
+
+        result = self.app(env, start_response)
+        try:
+            data = b''.join(result)
+        finally:
+            result.close()
+        return started[0][0], dict(started[0][1]), data
+
+    def test_get(self):
+        res, body = self.request('GET', '/f.txt')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(body, CONTENT)
+        self.assertEqual(res.getheader('Content-Length'), str(len(CONTENT)))
+        self.assertEnded(['GET'])
+
+    def test_get_range(self):
+        res, body = self.request('GET', '/f.txt', headers={
+            'Range': 'bytes=100-199'})
+        self.assertEqual(res.status, 206)
+        self.assertEqual(res.getheader('Content-Range'),
+                         'bytes 100-199/%d' % len(CONTENT))
+        self.assertEqual(body, CONTENT[100:200])
+
+    def test_head(self):
+        res, body = self.request('HEAD', '/f.txt')
+        self.assertEqual(res.status, 200)
+        self.assertEqual(body, b'')
+        self.assertEqual(res.getheader('Content-Length'), str(len(CONTENT)))
+        self.assertEnded(['HEAD'])
+
+    def test_propfind(self):
+        res, body = self.request('PROPFIND', '/', PROPFIND, {'Depth': '1'})
+        self.assertEqual(res.status, 207)
+        doc = minidom.parseString(body)
+        hrefs = [e.firstChild.data for e in
+                 doc.getElementsByTagNameNS('DAV:', 'href')]
+        self.assertEqual(len(hrefs), 2)
+        self.assertTrue(hrefs[1].endswith('/f.txt'))
+
+    def test_propfind_streamed(self):
+        # the multistatus document is generated while it is sent, the
+        # request ends when the server closes the body
+        status, headers, body = self.call(
+            'PROPFIND', '/', PROPFIND, CONTENT_LENGTH=str(len(PROPFIND)),
+            HTTP_DEPTH='1')
+        self.assertTrue(status.startswith('207'))
+        self.assertIn(b'f.txt', body)
+        self.assertEqual(self.ended, ['PROPFIND'])
+
+    def test_end_on_close(self):
+        env = {'REQUEST_METHOD': 'PROPFIND', 'PATH_INFO': '/',
+               'CONTENT_LENGTH': str(len(PROPFIND)), 'HTTP_DEPTH': '1',
+               'wsgi.input': io.BytesIO(PROPFIND),
+               'wsgi.errors': io.StringIO()}
+        setup_testing_defaults(env)
+        result = self.app(env, lambda status, headers: None)
+        next(iter(result))
+        self.assertEqual(self.ended, [])
+        # a client going away in the middle of the body
+        result.close()
+        self.assertEqual(self.ended, ['PROPFIND'])
+
+    def test_put_chunked(self):
+        # the server has decoded the chunked body already
+        status, headers, body = self.call(
+            'PUT', '/new.txt', CONTENT, HTTP_TRANSFER_ENCODING='chunked')
+        self.assertTrue(status.startswith('201'), status)
+        with open(os.path.join(self.rundir, 'root', 'new.txt'), 'rb') as fp:
+            self.assertEqual(fp.read(), CONTENT)
+        self.assertEqual(self.ended, ['PUT'])
+
+        status, headers, body = self.call(
+            'PUT', '/new.txt', b'', HTTP_TRANSFER_ENCODING='chunked')
+        with open(os.path.join(self.rundir, 'root', 'new.txt'), 'rb') as fp:
+            self.assertEqual(fp.read(), b'')
+
+    def test_hop_by_hop(self):
+        status, headers, body = self.call(
+            'GET', '/f.txt', HTTP_CONNECTION='keep-alive',
+            HTTP_KEEP_ALIVE='timeout=5', HTTP_TE='trailers')
+        self.assertTrue(status.startswith('200'))
+        names = set(name.lower() for name in headers)
+        for name in ('connection', 'keep-alive', 'transfer-encoding',
+                     'proxy-authenticate', 'upgrade'):
+            self.assertNotIn(name, names)
+
+        # also of chunked responses
+        status, headers, body = self.call(
+            'PROPFIND', '/', PROPFIND, CONTENT_LENGTH=str(len(PROPFIND)),
+            HTTP_DEPTH='1')
+        self.assertNotIn('transfer-encoding',
+                         set(name.lower() for name in headers))
+
+
+if __name__ == '__main__':
+    unittest.main()